@@ -0,0 +1,198 @@
+import os
+import sys
+import argparse
+import logging
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dotenv import load_dotenv
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
+from pyspark.sql.types import DoubleType
+from ods.ods_logging_utils import configure_logging
+from ods.ods_jdbc_export_utils import OdsExportEngine, MSSQL_JDBC_DRIVER, get_jdbc_url
+from ods.ods_define_star_schemas_dictionaries import dwh_export_profiles
+from ods.ods_spark_stage_runner import SparkStageRunner
+from dwh_fact_measures_sql import SUPPLY_CHAIN_COLUMNS, SALES_COLUMNS, get_supply_chain_measures_sql, get_sales_measures_sql
+
+PARITY_DECIMALS = 6
+
+def create_spark_session():
+    """
+    Initialize and return a Spark session with specific configurations.
+    """
+    try:
+        spark = SparkSession.builder \
+                .appName("NamkinProductionDwhFactTables") \
+                .config("spark.driver.host", "localhost") \
+                .master("local[*]") \
+                .config("spark.executor.memory", "4g") \
+                .config("spark.driver.memory", "2g") \
+                .config("spark.sql.shuffle.partitions", "50") \
+                .config("spark.executor.cores", "4") \
+                .config("spark.scheduler.mode", "FAIR") \
+                .getOrCreate()
+        logging.info("Spark session created successfully.")
+        return spark
+    except Exception as e:
+        logging.error(f'An unexpected error occurred while initializing the Spark Session: {e}')
+
+def read_sql_server(spark, jdbc_url, dbtable=None, query=None):
+    """Reads a SQL Server table, or the result of a query, into a Spark DataFrame."""
+    reader = spark.read.format("jdbc") \
+                  .option("url", jdbc_url) \
+                  .option("driver", MSSQL_JDBC_DRIVER)
+    reader = reader.option("query", query) if query else reader.option("dbtable", dbtable)
+    return reader.load()
+
+def build_fact_supply_chain(supply_chain_df):
+    """
+    Computes the DWH fact_supply_chain rows from the ODS fact_supply_chain DataFrame in a single pass.
+
+    The records are partitioned by timeId once, then CountProductionMachine, CountProductionPart and GarbageProduction
+    are computed with window functions over that partitioning, rather than by three GROUP BY subqueries joined back.
+    As in the SQL script, the counts cover every record of their group, then the records of a timeId without any
+    damaged unit are dropped, as are the records with a null timeId, machineId or partId, and the resulting rows are distinct.
+
+    :param supply_chain_df: The ODS fact_supply_chain DataFrame, repartitioned by timeId by the caller.
+    """
+    time_window = Window.partitionBy('timeId')
+    is_damaged = F.col('isDamaged') == F.lit(True)
+
+    return supply_chain_df \
+        .withColumn('CountProductionMachine', F.count('timeOfProduction').over(Window.partitionBy('timeId', 'machineId'))) \
+        .withColumn('CountProductionPart', F.count('timeOfProduction').over(Window.partitionBy('timeId', 'partId'))) \
+        .withColumn('GarbageProduction', F.count(F.when(is_damaged, F.col('timeOfProduction'))).over(time_window)) \
+        .withColumn('hasDamaged', F.max(is_damaged.cast('int')).over(time_window)) \
+        .where((F.col('hasDamaged') == 1) & F.col('timeId').isNotNull() & F.col('machineId').isNotNull() & F.col('partId').isNotNull()) \
+        .select(*SUPPLY_CHAIN_COLUMNS) \
+        .distinct()
+
+def build_fact_sales(sales_df, supply_chain_df):
+    """
+    Computes the DWH fact_sales rows from the ODS fact_sales and fact_supply_chain DataFrames.
+
+    PartPurchasedPerDay is a window count over the sales partitioned by their timeId, computed arithmetically from
+    the date rather than by casting its string form. The part cost of each timeId is aggregated from the supply chain
+    DataFrame already partitioned by timeId, and the material cost of each price date is joined per year
+    as a broadcast table, so that MarginPerDay needs no self-join of the sales.
+
+    :param sales_df: The ODS fact_sales DataFrame.
+    :param supply_chain_df: The ODS fact_supply_chain DataFrame, repartitioned by timeId by the caller.
+    """
+    sales_df = sales_df.withColumn('timeId', (F.year('date') * 10000 + F.month('date') * 100 + F.dayofmonth('date')).cast('int')) \
+                       .where(F.col('timeId').isNotNull()) \
+                       .withColumn('PartPurchasedPerDay', F.count('partId').over(Window.partitionBy('timeId')))
+
+    part_cost_df = supply_chain_df.groupBy('timeId') \
+                                  .agg(F.sum('partDefaultPrice').alias('CostPartPricePerDay'))
+    material_cost_df = supply_chain_df.select('materialId', 'materialPriceDate', 'materialPrice') \
+                                      .distinct() \
+                                      .groupBy('materialPriceDate') \
+                                      .agg(F.sum('materialPrice').alias('CostMaterialPricePerDay')) \
+                                      .withColumn('materialYear', F.year('materialPriceDate'))
+
+    return sales_df.join(part_cost_df, 'timeId', 'inner') \
+                   .join(F.broadcast(material_cost_df), F.year(sales_df['date']) == material_cost_df['materialYear'], 'inner') \
+                   .withColumn('MarginPerDay', F.col('cash') - (F.col('CostMaterialPricePerDay') + F.col('CostPartPricePerDay'))) \
+                   .select(*SALES_COLUMNS)
+
+def round_doubles(df, decimals=PARITY_DECIMALS):
+    """Rounds the floating point columns of a DataFrame, whose sums may differ in their last digits with the summation order."""
+    return df.select(*[
+        F.round(F.col(field.name), decimals).alias(field.name) if isinstance(field.dataType, DoubleType) else F.col(field.name)
+        for field in df.schema.fields
+    ])
+
+def check_parity(spark, ods_jdbc_url, ods_database, built_dfs):
+    """
+    Checks that the built fact DataFrames hold exactly the rows computed by the SQL measures of the
+    dwh_truncate_and_bulk_massive_inserts_* scripts, evaluated on the same ODS database.
+
+    :param built_dfs: Dictionary mapping 'fact_supply_chain' and 'fact_sales' to their built DataFrames.
+    :return: Dictionary mapping each fact table to True when its rows match, duplicates included.
+    """
+    reference_queries = {
+        'fact_supply_chain': get_supply_chain_measures_sql(ods_database),
+        'fact_sales': get_sales_measures_sql(ods_database),
+    }
+    parity = {}
+    for table_name, built_df in built_dfs.items():
+        reference_df = read_sql_server(spark, ods_jdbc_url, query=reference_queries[table_name])
+        reference_df = round_doubles(reference_df.select(*[F.col(field.name).cast(field.dataType) for field in built_df.schema.fields]))
+        built_rounded_df = round_doubles(built_df)
+
+        missing_rows = reference_df.exceptAll(built_rounded_df).count()
+        extra_rows = built_rounded_df.exceptAll(reference_df).count()
+        parity[table_name] = missing_rows == 0 and extra_rows == 0
+        if parity[table_name]:
+            logging.info(f"The built {table_name} rows match the SQL measures.")
+        else:
+            logging.error(f"The built {table_name} rows differ from the SQL measures: {missing_rows} missing and {extra_rows} extra rows.")
+    return parity
+
+def get_ods_jdbc_url():
+    return get_jdbc_url(os.getenv('DB_HOST'), os.getenv('ODS_DB_NAME', 'ODS_PRODUCTION'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD'))
+
+def stage_read_ods_facts(runner):
+    """Reads the ODS fact tables, the supply chain repartitioned by timeId and cached for both fact builders."""
+    ods_jdbc_url = get_ods_jdbc_url()
+    supply_chain_df = read_sql_server(runner.spark, ods_jdbc_url, dbtable='fact_supply_chain').repartition('timeId').cache()
+    sales_df = read_sql_server(runner.spark, ods_jdbc_url, dbtable='fact_sales')
+    return {
+        'supply_chain_df': supply_chain_df,
+        'built_dfs': {
+            'fact_supply_chain': build_fact_supply_chain(supply_chain_df),
+            'fact_sales': build_fact_sales(sales_df, supply_chain_df),
+        },
+    }
+
+def stage_build_dwh_fact_tables(runner):
+    """
+    Bulk loads the built fact DataFrames into the DWH tables.
+
+    :raises RuntimeError: If the export of a table failed.
+    """
+    export_engine = OdsExportEngine(runner.spark, os.getenv('DB_HOST'), os.getenv('DWH_DB_NAME', 'DWH_PRODUCTION'), os.getenv('DB_USER'), os.getenv('DB_PASSWORD'),
+                                    dwh_export_profiles, max_workers=2)
+    reports = export_engine.export_tables(runner.get('read_ods_facts', 'built_dfs'))
+    failed_tables = [table_name for table_name, report in reports.items() if report is None]
+    if failed_tables:
+        raise RuntimeError(f"The export of the DWH tables {failed_tables} failed.")
+    return {'reports': reports}
+
+def stage_check_dwh_parity(runner):
+    """
+    Compares the built fact DataFrames with the SQL measures.
+
+    :raises ValueError: If the rows of a fact table differ.
+    """
+    parity = check_parity(runner.spark, get_ods_jdbc_url(), os.getenv('ODS_DB_NAME', 'ODS_PRODUCTION'), runner.get('read_ods_facts', 'built_dfs'))
+    mismatched_tables = [table_name for table_name, matches in parity.items() if not matches]
+    if mismatched_tables:
+        raise ValueError(f"The built {mismatched_tables} rows differ from the SQL measures.")
+    return {'parity': parity}
+
+def register_dwh_stages(runner):
+    """
+    Registers the stages of the DWH fact build on a SparkStageRunner. The ODS facts are read again on every submission,
+    once for both the load and the parity check when they are submitted together.
+    """
+    runner.register('read_ods_facts', stage_read_ods_facts, cache=False)
+    runner.register('build_dwh_fact_tables', stage_build_dwh_fact_tables, depends_on=['read_ods_facts'], cache=False)
+    runner.register('check_dwh_parity', stage_check_dwh_parity, depends_on=['read_ods_facts'], cache=False)
+
+if __name__ == "__main__":
+    configure_logging('dwh_build_fact_tables.log', log_format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Build the DWH fact tables from the ODS with Spark and bulk load them.")
+    parser.add_argument('--check-parity', action='store_true', help="Compare the built rows with the SQL measures instead of loading them. Exits with status 1 on a mismatch.")
+    args = parser.parse_args()
+
+    load_dotenv('../../.env')
+    runner = SparkStageRunner(create_spark_session())
+    register_dwh_stages(runner)
+    try:
+        report = runner.run(['check_dwh_parity' if args.check_parity else 'build_dwh_fact_tables'])
+    finally:
+        runner.close()
+    if any(result['status'] == 'failed' for result in report.values()):
+        sys.exit(1)
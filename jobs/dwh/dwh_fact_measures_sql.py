@@ -0,0 +1,71 @@
+SALES_TIME_ID_SQL = "CAST(REPLACE({date_col}, '-', '') AS INT)"
+
+SUPPLY_CHAIN_COLUMNS = [
+    'machineId', 'partId', 'materialId', 'timeId', 'materialPrice', 'materialPriceDate', 'partDefaultPrice',
+    'CountProductionMachine', 'CountProductionPart', 'GarbageProduction',
+]
+
+SALES_COLUMNS = ['partId', 'contractId', 'timeId', 'cash', 'date', 'PartPurchasedPerDay', 'MarginPerDay']
+
+def get_supply_chain_measures_sql(ods_database, time_ids_table=None):
+    """
+    Returns the SELECT statement computing the DWH fact_supply_chain rows from the ODS, as the
+    dwh_truncate_and_bulk_massive_inserts_fact_supply_chain_table.sql script does.
+
+    :param ods_database: The name of the ODS database.
+    :param time_ids_table: A table of timeIds restricting the computed rows to those slices, None for every row.
+    """
+    ods_supply_chain = f"[{ods_database}].[dbo].[fact_supply_chain]"
+    affected = f"timeId IN (SELECT timeId FROM {time_ids_table})" if time_ids_table else "1 = 1"
+    return (
+        f"SELECT DISTINCT\n"
+        f"    MachineProduction.machineId, PartProduction.partId, main.materialId, MachineProduction.timeId,\n"
+        f"    main.materialPrice, main.materialPriceDate, main.partDefaultPrice,\n"
+        f"    MachineProduction.CountProductionMachine, PartProduction.CountProductionPart, GarbageCount.GarbageProduction\n"
+        f"FROM (SELECT * FROM {ods_supply_chain} WHERE {affected}) AS main\n"
+        f"INNER JOIN (SELECT COUNT(timeOfProduction) AS CountProductionMachine, timeId, machineId\n"
+        f"            FROM {ods_supply_chain} WHERE {affected} GROUP BY timeId, machineId) AS MachineProduction\n"
+        f"ON main.timeId = MachineProduction.timeId AND main.machineId = MachineProduction.machineId\n"
+        f"INNER JOIN (SELECT COUNT(timeOfProduction) AS CountProductionPart, timeId, partId\n"
+        f"            FROM {ods_supply_chain} WHERE {affected} GROUP BY timeId, partId) AS PartProduction\n"
+        f"ON main.timeId = PartProduction.timeId AND main.partId = PartProduction.partId\n"
+        f"INNER JOIN (SELECT COUNT(timeOfProduction) AS GarbageProduction, timeId\n"
+        f"            FROM {ods_supply_chain} WHERE isDamaged = 1 AND {affected} GROUP BY timeId) AS GarbageCount\n"
+        f"ON main.timeId = GarbageCount.timeId"
+    )
+
+def get_sales_measures_sql(ods_database, time_ids_table=None):
+    """
+    Returns the SELECT statement computing the DWH fact_sales rows from the ODS, as the
+    dwh_truncate_and_bulk_massive_inserts_fact_sales_table.sql script does. The material prices are read
+    from materialPriceDate, the ODS column the script refers to as materialDate.
+
+    :param ods_database: The name of the ODS database.
+    :param time_ids_table: A table of sales timeIds restricting the computed rows to those days, None for every row.
+    """
+    ods_sales = f"[{ods_database}].[dbo].[fact_sales]"
+    ods_supply_chain = f"[{ods_database}].[dbo].[fact_supply_chain]"
+    sales_time_id = SALES_TIME_ID_SQL.format(date_col='[date]')
+    if time_ids_table:
+        affected = f"IN (SELECT timeId FROM {time_ids_table})"
+        sales_filter = f"{sales_time_id} {affected}"
+        material_filter = f"YEAR(materialPriceDate) IN (SELECT DISTINCT timeId / 10000 FROM {time_ids_table})"
+        part_filter = f"timeId {affected}"
+    else:
+        sales_filter = material_filter = part_filter = "1 = 1"
+    return (
+        f"SELECT main.[partId], main.[contractId], PartSales.[timeId], main.[cash], main.[date], PartSales.PartPurchasedPerDay,\n"
+        f"       main.[cash] - (CostMaterial.CostMaterialPricePerDay + CostPart.CostPartPricePerDay) AS MarginPerDay\n"
+        f"FROM (SELECT * FROM {ods_sales} WHERE {sales_filter}) AS main\n"
+        f"INNER JOIN (SELECT {sales_time_id} AS timeId, COUNT(partId) AS PartPurchasedPerDay\n"
+        f"            FROM {ods_sales} WHERE {sales_filter} GROUP BY {sales_time_id}) AS PartSales\n"
+        f"ON {SALES_TIME_ID_SQL.format(date_col='main.[date]')} = PartSales.[timeId]\n"
+        f"INNER JOIN (SELECT materialDate, SUM(materialPrice) AS CostMaterialPricePerDay\n"
+        f"            FROM (SELECT DISTINCT materialId, materialPriceDate AS materialDate, materialPrice FROM {ods_supply_chain}\n"
+        f"                  WHERE {material_filter}) AS DistinctMaterialPrices\n"
+        f"            GROUP BY materialDate) AS CostMaterial\n"
+        f"ON YEAR(main.[date]) = YEAR(CostMaterial.[materialDate])\n"
+        f"INNER JOIN (SELECT timeId, SUM(partDefaultPrice) AS CostPartPricePerDay\n"
+        f"            FROM {ods_supply_chain} WHERE {part_filter} GROUP BY timeId) AS CostPart\n"
+        f"ON PartSales.[timeId] = CostPart.[timeId]"
+    )
@@ -0,0 +1,211 @@
+import os
+import sys
+import argparse
+import logging
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from dotenv import load_dotenv
+from ods.ods_structure_tables_star_schema import DataWarehouseManager
+from ods.ods_logging_utils import configure_logging
+from ods.ods_schema_registry import DWH_LAYER
+from dwh_fact_measures_sql import SALES_TIME_ID_SQL, SUPPLY_CHAIN_COLUMNS, SALES_COLUMNS, get_supply_chain_measures_sql, get_sales_measures_sql
+
+REFRESH_WATERMARKS_TABLE = 'dwh_refresh_watermarks'
+ROW_VERSION_COLUMN = 'rowVersion'
+
+SUPPLY_CHAIN_TIME_IDS_TABLE = '#refresh_supply_chain_time_ids'
+SALES_TIME_IDS_TABLE = '#refresh_sales_time_ids'
+
+class DwhIncrementalRefresher:
+    """
+    Refreshes the DWH fact tables from the ODS incrementally, rather than truncating and rebuilding them.
+
+    The ODS fact tables carry a 'rowVersion' column, added by the ODS structure job, a rowversion that SQL Server bumps on every insert and update,
+    whatever the lastUpdate supplied by the producers, so late or out of order records are never missed. A rowversion
+    watermark is kept per ODS table in the DWH. Each refresh reads the ODS records written since the watermark, derives
+    the timeId slices of the DWH facts whose measures they change, then deletes and recomputes only those slices, in the
+    same transaction as the new watermarks. The measures are the ones of the dwh_truncate_and_bulk_massive_inserts_*
+    scripts, restricted to the affected slices.
+    """
+
+    def __init__(self, dwh_manager, ods_database='ODS_PRODUCTION', dwh_database='DWH_PRODUCTION'):
+        """
+        Initializes the DwhIncrementalRefresher.
+
+        :param dwh_manager: The DataWarehouseManager connected to the DWH database.
+        :param ods_database: The name of the ODS database the facts are computed from.
+        :param dwh_database: The name of the DWH database.
+        """
+        self.dwh_manager = dwh_manager
+        self.ods_database = ods_database
+        self.dwh_database = dwh_database
+
+    def ods_table(self, table_name):
+        return f"[{self.ods_database}].[dbo].[{table_name}]"
+
+    def dwh_table(self, table_name):
+        return f"[{self.dwh_database}].[dbo].[{table_name}]"
+
+    def prepare_refresh(self):
+        """
+        Creates the watermarks table and the session tables of the affected timeIds. The rowVersion column of the ODS fact tables
+        and its indexes are declared in the schema registry and added by the ODS structure job.
+
+        :raises RuntimeError: If an ODS fact table has no rowVersion column, in which case no record could be tracked.
+        """
+        for table_name in ('fact_supply_chain', 'fact_sales'):
+            column_length = self.dwh_manager.execute_query(f"SELECT COL_LENGTH('{self.ods_table(table_name)}', '{ROW_VERSION_COLUMN}')")
+            if not column_length or column_length[0][0] is None:
+                raise RuntimeError(f"The ODS {table_name} table has no {ROW_VERSION_COLUMN} column. Run the ODS structure job first.")
+
+        self.dwh_manager.execute_query(
+            f"IF OBJECT_ID('{REFRESH_WATERMARKS_TABLE}') IS NULL\n"
+            f"CREATE TABLE {REFRESH_WATERMARKS_TABLE} (tableName VARCHAR(128) PRIMARY KEY, lastRowVersion BIGINT)"
+        )
+        self.dwh_manager.execute_query(
+            f"IF COL_LENGTH('{REFRESH_WATERMARKS_TABLE}', 'lastRowVersion') IS NULL\n"
+            f"ALTER TABLE {REFRESH_WATERMARKS_TABLE} ADD lastRowVersion BIGINT"
+        )
+        for time_ids_table in (SUPPLY_CHAIN_TIME_IDS_TABLE, SALES_TIME_IDS_TABLE):
+            self.dwh_manager.execute_query(
+                f"IF OBJECT_ID('tempdb..{time_ids_table}') IS NULL\n"
+                f"CREATE TABLE {time_ids_table} (timeId INT PRIMARY KEY)"
+            )
+
+    def get_watermark(self, table_name):
+        """Returns the rowversion watermark of an ODS table, None if it was never refreshed."""
+        rows = self.dwh_manager.execute_query(f"SELECT lastRowVersion FROM {REFRESH_WATERMARKS_TABLE} WHERE tableName = ?", (table_name,))
+        return rows[0][0] if rows else None
+
+    def get_high_watermark(self):
+        """
+        Returns the upper bound of the ODS records refreshed by this run: the rowversion below the lowest one still
+        held by an open transaction of the ODS database, so that a record committed after this run with a lower
+        rowversion than a refreshed one can't exist.
+        """
+        cursor = self.dwh_manager.get_cursor()
+        cursor.execute(f"EXEC [{self.ods_database}].sys.sp_executesql N'SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) - 1'")
+        return cursor.fetchone()[0]
+
+    def set_watermark(self, table_name, watermark):
+        self.dwh_manager.execute_query(
+            f"MERGE INTO {REFRESH_WATERMARKS_TABLE} AS target\n"
+            f"USING (SELECT ? AS tableName, ? AS lastRowVersion) AS source ON target.tableName = source.tableName\n"
+            f"WHEN MATCHED THEN UPDATE SET lastRowVersion = source.lastRowVersion\n"
+            f"WHEN NOT MATCHED THEN INSERT (tableName, lastRowVersion) VALUES (source.tableName, source.lastRowVersion);",
+            (table_name, watermark)
+        )
+
+    def get_update_window_sql(self, low_watermark):
+        """Returns the SQL filter of the ODS records written after the low watermark, up to the high watermark parameter."""
+        upper_bound = f"{ROW_VERSION_COLUMN} <= CAST(CAST(? AS BIGINT) AS BINARY(8))"
+        return f"{ROW_VERSION_COLUMN} > CAST(CAST(? AS BIGINT) AS BINARY(8)) AND {upper_bound}" if low_watermark is not None else upper_bound
+
+    def get_update_window_params(self, low_watermark, high_watermark):
+        return (low_watermark, high_watermark) if low_watermark is not None else (high_watermark,)
+
+    def stage_time_ids(self, time_ids_table, query, params):
+        """Fills a session table with the distinct timeIds returned by a query."""
+        self.dwh_manager.execute_query(f"TRUNCATE TABLE {time_ids_table}")
+        self.dwh_manager.execute_query(f"INSERT INTO {time_ids_table} (timeId) SELECT DISTINCT timeId FROM ({query}) AS affected WHERE timeId IS NOT NULL", params)
+        return self.dwh_manager.execute_query(f"SELECT COUNT(*) FROM {time_ids_table}")[0][0]
+
+    def prepare_supply_chain_refresh_sql(self):
+        """Returns the INSERT statement recomputing the fact_supply_chain rows of the staged timeIds."""
+        return (
+            f"INSERT INTO {self.dwh_table('fact_supply_chain')} ({', '.join(SUPPLY_CHAIN_COLUMNS)})\n"
+            f"{get_supply_chain_measures_sql(self.ods_database, SUPPLY_CHAIN_TIME_IDS_TABLE)}"
+        )
+
+    def prepare_sales_refresh_sql(self):
+        """Returns the INSERT statement recomputing the fact_sales rows of the staged timeIds."""
+        return (
+            f"INSERT INTO {self.dwh_table('fact_sales')} ({', '.join(SALES_COLUMNS)})\n"
+            f"{get_sales_measures_sql(self.ods_database, SALES_TIME_IDS_TABLE)}"
+        )
+
+    def refresh(self, full=False):
+        """
+        Refreshes fact_supply_chain and fact_sales from the ODS records written since the last refresh.
+
+        The measures of fact_supply_chain are counted per timeId, machineId and partId, and its damaged count per timeId,
+        so a changed ODS record affects its whole timeId slice. The measures of fact_sales depend on the sales of the day,
+        on the part prices of the supply chain of the same timeId and on the material prices of the same year, so the
+        affected sales slices are the timeIds of the changed sales and supply chain records, plus every sales day
+        of the years of the changed material prices.
+
+        Deleted ODS records leave no rowversion behind, so an incremental refresh doesn't reconcile them:
+        their DWH slices are only recomputed by a full refresh, or when another record of the same timeId changes.
+
+        :param full: Recomputes the whole fact tables, as on the first refresh.
+        :return: Dictionary mapping each DWH fact table to its number of refreshed timeId slices.
+        """
+        self.prepare_refresh()
+        refreshed_slices = {}
+        with self.dwh_manager.transaction():
+            supply_chain_low = None if full else self.get_watermark('fact_supply_chain')
+            sales_low = None if full else self.get_watermark('fact_sales')
+            high_watermark = self.get_high_watermark()
+
+            supply_chain_slices = self.stage_time_ids(
+                SUPPLY_CHAIN_TIME_IDS_TABLE,
+                f"SELECT timeId FROM {self.ods_table('fact_supply_chain')} WHERE {self.get_update_window_sql(supply_chain_low)}",
+                self.get_update_window_params(supply_chain_low, high_watermark)
+            )
+            if full:
+                self.dwh_manager.execute_query(f"DELETE FROM {self.dwh_table('fact_supply_chain')}")
+            elif supply_chain_slices:
+                self.dwh_manager.execute_query(f"DELETE FROM {self.dwh_table('fact_supply_chain')} WHERE timeId IN (SELECT timeId FROM {SUPPLY_CHAIN_TIME_IDS_TABLE})")
+            if supply_chain_slices:
+                self.dwh_manager.execute_query(self.prepare_supply_chain_refresh_sql())
+            refreshed_slices['fact_supply_chain'] = supply_chain_slices
+
+            affected_sales_queries = [
+                f"SELECT {SALES_TIME_ID_SQL.format(date_col='[date]')} AS timeId FROM {self.ods_table('fact_sales')} "
+                f"WHERE {self.get_update_window_sql(sales_low)}"
+            ]
+            if supply_chain_slices:
+                affected_sales_queries.append(f"SELECT timeId FROM {SUPPLY_CHAIN_TIME_IDS_TABLE}")
+                affected_sales_queries.append(
+                    f"SELECT {SALES_TIME_ID_SQL.format(date_col='[date]')} AS timeId FROM {self.ods_table('fact_sales')} "
+                    f"WHERE YEAR([date]) IN (SELECT DISTINCT YEAR(materialPriceDate) FROM {self.ods_table('fact_supply_chain')} "
+                    f"WHERE timeId IN (SELECT timeId FROM {SUPPLY_CHAIN_TIME_IDS_TABLE}))"
+                )
+
+            sales_slices = self.stage_time_ids(SALES_TIME_IDS_TABLE, '\nUNION\n'.join(affected_sales_queries), self.get_update_window_params(sales_low, high_watermark))
+            if full:
+                self.dwh_manager.execute_query(f"DELETE FROM {self.dwh_table('fact_sales')}")
+            elif sales_slices:
+                self.dwh_manager.execute_query(f"DELETE FROM {self.dwh_table('fact_sales')} WHERE timeId IN (SELECT timeId FROM {SALES_TIME_IDS_TABLE})")
+            if sales_slices:
+                self.dwh_manager.execute_query(self.prepare_sales_refresh_sql())
+            refreshed_slices['fact_sales'] = sales_slices
+
+            self.set_watermark('fact_supply_chain', high_watermark)
+            self.set_watermark('fact_sales', high_watermark)
+
+        logging.info(f"Refreshed {refreshed_slices['fact_supply_chain']} fact_supply_chain and {refreshed_slices['fact_sales']} fact_sales timeId slices{' (full refresh)' if full else ''}.")
+        return refreshed_slices
+
+if __name__ == "__main__":
+    configure_logging('dwh_refresh_fact_tables.log')
+
+    parser = argparse.ArgumentParser(description="Refresh the DWH fact tables from the ODS records written since the last refresh.")
+    parser.add_argument('--full', action='store_true', help="Recompute the whole fact tables, the only way to reconcile the deleted ODS records.")
+    args = parser.parse_args()
+
+    load_dotenv('../../.env')
+    server = os.getenv('DB_HOST')
+    username = os.getenv('DB_USER')
+    password = os.getenv('DB_PASSWORD')
+    ods_database = os.getenv('ODS_DB_NAME', 'ODS_PRODUCTION')
+    dwh_database = os.getenv('DWH_DB_NAME', 'DWH_PRODUCTION')
+
+    dwh_manager = DataWarehouseManager(server, dwh_database, username, password, DWH_LAYER)
+    dwh_manager.connect()
+    try:
+        DwhIncrementalRefresher(dwh_manager, ods_database, dwh_database).refresh(full=args.full)
+    except Exception as e:
+        logging.error(f"An error occurred while refreshing the DWH fact tables: {e}")
+        sys.exit(1)
+    finally:
+        dwh_manager.close_connection()
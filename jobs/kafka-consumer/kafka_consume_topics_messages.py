@@ -1,12 +1,35 @@
-import json
 import logging
 import os
 import sys
+import time
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from dotenv import load_dotenv
-from kafka import KafkaConsumer
-from ods.ods_structure_tables_star_schema import DataWarehouseManager
-from kafka_process_data_schema_topics_messages import execute_ruling_topic_processor
+from kafka import KafkaConsumer, ConsumerRebalanceListener
+from kafka.errors import CommitFailedError
+from kafka.structs import OffsetAndMetadata
+from ods.ods_structure_tables_star_schema import DataWarehouseManager, DataWarehouseManagerPool
+from kafka_process_data_schema_topics_messages import execute_ruling_topic_processor, execute_ruling_topic_processor_batch, get_topic_processing_rank
+from kafka_topic_messages_key_cache import preload_ods_key_caches, refresh_stale_ods_key_caches, get_ods_key_cache_stats, ods_key_cache_scope
+from kafka_topic_messages_worker_pool import TopicMessageWorkerPool
+from kafka_topic_messages_schemas import decode_topic_message
+from kafka_topic_messages_logging import TopicPayloadSampler, ConsumerActivitySummary
+from kafka_topic_messages_metrics import consumer_metrics, start_metrics_server, MetricsSnapshotWriter
+from ods.ods_logging_utils import configure_logging
+from ods.ods_schema_registry import ODS_LAYER
+
+PARALLEL_POLL_MAX_RECORDS = 500
+
+class PartitionRevocationListener(ConsumerRebalanceListener):
+    """Hands the partitions revoked by a rebalance over to the consumer client, before they are assigned to another consumer."""
+
+    def __init__(self, consumer_client):
+        self.consumer_client = consumer_client
+
+    def on_partitions_revoked(self, revoked):
+        self.consumer_client.on_partitions_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        self.consumer_client.logger.info(f"Partitions assigned: {sorted(str(topic_partition) for topic_partition in assigned)}")
 
 class KafkaConsumerClient:
     """
@@ -14,75 +37,386 @@ class KafkaConsumerClient:
 
     """
 
-    def __init__(self, servers, topics, group_id=None):
+    def __init__(self, servers, topics, group_id=None, batch_size=None, linger_ms=1000, manual_commit=False, message_encoding='auto', payload_log_rate=1.0, summary_interval=30, lag_interval=10, revoke_timeout=30, retry_interval=5, key_cache_manager=None, key_cache_check_interval=60):
         """
         Initializes the KafkaConsumerClient.
 
         :param servers: List of bootstrap servers in the format ['host1:port', 'host2:port', ...]
         :param topic: The topic to subscribe to.
         :param group_id: The group ID to use for consuming messages. If None, a random group ID is assigned.
-
+        :param batch_size: Maximum number of records written per batch. If None, the records are consumed one by one
+                           and the offsets are committed automatically.
+        :param linger_ms: Maximum time in milliseconds spent filling a batch before it is written.
+        :param manual_commit: Disables the automatic offset commit, as required by the parallel consumption mode.
+        :param message_encoding: Encoding of the message values: 'json', 'msgpack' or 'auto' to detect it per message.
+        :param payload_log_rate: Maximum number of message payloads logged per topic and per second.
+        :param summary_interval: Number of seconds between two summary lines of the consumer activity.
+        :param lag_interval: Number of seconds between two computations of the consumer lag of each partition.
+        :param revoke_timeout: Maximum number of seconds the workers are waited for to process the records of a revoked partition.
+        :param retry_interval: Number of seconds a partition is paused after the workers failed to process one of its records,
+                               before it is consumed again from that record.
+        :param key_cache_manager: The DataWarehouseManager the surrogate-key caches were preloaded with, used by the main thread only
+                                  to check whether the populate job replaced the rows of a dimension, see refresh_stale_ods_key_caches.
+        :param key_cache_check_interval: Number of seconds between two checks of the surrogate-key caches.
         """
         self.consumer = KafkaConsumer(
             bootstrap_servers=servers,
             auto_offset_reset='earliest',
             group_id=group_id,
-            value_deserializer=lambda m: json.loads(m.decode('utf-8'))
+            enable_auto_commit=batch_size is None and not manual_commit
         )
         self.topics = topics
-        self.configure_logging()
-
-    def configure_logging(self):
-        """Configures the logging settings for the consumer."""
-        log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'kafka_consume_topics_messages.log'))
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file_path),
-                logging.StreamHandler()
-            ]
-        )
+        self.batch_size = batch_size
+        self.linger_ms = linger_ms
+        self.message_encoding = message_encoding
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
+        self.payload_sampler = TopicPayloadSampler(payload_log_rate, self.logger)
+        self.activity_summary = ConsumerActivitySummary(summary_interval, self.logger)
+        self.lag_interval = lag_interval
+        self.lag_updated_at = time.monotonic()
+        self.key_cache_manager = key_cache_manager
+        self.key_cache_check_interval = key_cache_check_interval
+        self.key_cache_checked_at = time.monotonic()
+        self.revoke_timeout = revoke_timeout
+        self.retry_interval = retry_interval
+        self.pending_records = {}
+        self.worker_pool = None
 
     def subscribe(self):
-        """Subscribes the consumer to the topics."""
-        self.consumer.subscribe(self.topics)
+        """Subscribes the consumer to the topics, with a listener of the partitions revoked by the rebalances."""
+        self.consumer.subscribe(self.topics, listener=PartitionRevocationListener(self))
         self.logger.info(f"Subscribed to topics: {self.topics}")
 
+    def on_partitions_revoked(self, revoked):
+        """
+        Releases the partitions revoked by a rebalance. The records of a batch being polled are dropped, since the next
+        owner of their partition consumes them again from the last committed offset. The records dispatched to the workers
+        are processed and their offsets committed first, within the revoke timeout.
+        """
+        revoked = set(revoked)
+        if not revoked:
+            return
+        self.logger.info(f"Partitions revoked: {sorted(str(topic_partition) for topic_partition in revoked)}")
+        for topic_partition in revoked:
+            self.pending_records.pop(topic_partition, None)
+
+        if self.worker_pool is not None:
+            if not self.worker_pool.drain(revoked, self.revoke_timeout):
+                self.logger.warning(f"The records of the revoked partitions weren't all processed within {self.revoke_timeout}s. The next owner consumes them again.")
+            self.commit_committable_offsets(self.worker_pool)
+            self.worker_pool.offset_tracker.forget(revoked)
+
+    def commit(self, offsets):
+        """
+        Commits the offsets of the partitions still assigned to the consumer. A commit rejected after a rebalance is logged,
+        the records since the last committed offset being consumed again by the next owner of their partition.
+
+        :return: True if the offsets were committed.
+        """
+        assignment = self.consumer.assignment()
+        offsets = {topic_partition: offset for topic_partition, offset in offsets.items() if topic_partition in assignment}
+        if not offsets:
+            return False
+        try:
+            with consumer_metrics.time('commit', 'all'):
+                self.consumer.commit(offsets)
+            return True
+        except CommitFailedError as e:
+            consumer_metrics.increment('commit_failures_total', 'all')
+            self.logger.warning(f"Failed to commit the offsets after a rebalance: {e}")
+            return False
+
     def consume_messages(self, ods_manager):
         """Consumes and processes messages from the subscribed topics."""
         try:
             self.logger.info(f"Starting to consume messages from {self.topics}")
             for message in self.consumer:
-                self.logger.debug(f"Message received from {message.topic} and from partition {message.partition}")
-                self.logger.info(f"Message received from {message.topic} and from partition {message.partition} at offset {message.offset} : {message.value}")
-                execute_ruling_topic_processor(ods_manager, message.topic, message.value)
+                self.observe_record(message)
+                decoded_message = self.decode_record(message)
+                if decoded_message is None:
+                    continue
+                try:
+                    execute_ruling_topic_processor(ods_manager, message.topic, decoded_message)
+                except Exception as e:
+                    self.logger.error(f"Failed to process the message from {message.topic} at partition {message.partition} and offset {message.offset}: {e}")
+        except Exception as e:
+            self.logger.error(f"An error occurred while consuming messages: {e}")
+        finally:
+            self.close()
+
+    def observe_record(self, record):
+        """Counts a received record, logs its payload if its topic isn't rate-limited and logs the periodic summary."""
+        self.activity_summary.record_received(record.topic)
+        consumer_metrics.increment('records_received_total', record.topic)
+        self.payload_sampler.log(record)
+        self.activity_summary.maybe_log_summary()
+        self.maybe_update_lag()
+        self.maybe_refresh_key_caches()
+
+    def maybe_refresh_key_caches(self):
+        """Preloads again the surrogate-key caches of the dimensions replaced by the populate job if the check interval has elapsed."""
+        if self.key_cache_manager is None or time.monotonic() - self.key_cache_checked_at < self.key_cache_check_interval:
+            return
+        self.key_cache_checked_at = time.monotonic()
+
+        try:
+            refresh_stale_ods_key_caches(self.key_cache_manager)
+        except Exception as e:
+            self.logger.warning(f"Failed to check the surrogate-key caches: {e}")
+
+    def maybe_update_lag(self):
+        """Computes the consumer lag of every assigned partition if the lag interval has elapsed."""
+        if time.monotonic() - self.lag_updated_at < self.lag_interval:
+            return
+        self.lag_updated_at = time.monotonic()
+
+        try:
+            partitions = self.consumer.assignment()
+            end_offsets = {topic_partition: self.consumer.highwater(topic_partition) for topic_partition in partitions}
+            unknown_partitions = [topic_partition for topic_partition, end_offset in end_offsets.items() if end_offset is None]
+            if unknown_partitions:
+                end_offsets.update(self.consumer.end_offsets(unknown_partitions))
+            for topic_partition, end_offset in end_offsets.items():
+                consumer_metrics.set_lag(topic_partition.topic, topic_partition.partition, max(end_offset - self.consumer.position(topic_partition), 0))
+        except Exception as e:
+            self.logger.warning(f"Failed to compute the consumer lag: {e}")
+
+    def decode_record(self, record):
+        """
+        Decodes the value of a Kafka record into the typed message of its topic.
+        An undecodable or invalid message is logged and None is returned, so that it doesn't stop the consumer.
+        """
+        try:
+            with consumer_metrics.time('decode', record.topic):
+                return decode_topic_message(record.topic, record.value, self.message_encoding)
+        except Exception as e:
+            consumer_metrics.increment('decode_failures_total', record.topic)
+            self.logger.error(f"Failed to decode the message from {record.topic} at partition {record.partition} and offset {record.offset}: {e}")
+            return None
+
+    def poll_batch(self):
+        """
+        Polls records until the batch size is reached or the linger time has elapsed.
+
+        :return: Dictionary mapping each TopicPartition to its records in offset order.
+        """
+        records_by_partition = self.pending_records = {}
+        records_count = 0
+        deadline = time.monotonic() + self.linger_ms / 1000
+
+        while records_count < self.batch_size:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+
+            with consumer_metrics.time('poll', 'all'):
+                polled_records = self.consumer.poll(timeout_ms=remaining_ms, max_records=self.batch_size - records_count)
+            for topic_partition, records in polled_records.items():
+                records_by_partition.setdefault(topic_partition, []).extend(records)
+            records_count = sum(len(records) for records in records_by_partition.values())
+
+        self.pending_records = {}
+        return records_by_partition
+
+    def commit_offsets(self, records_by_partition):
+        """Commits the offsets following the last record of each partition in the batch."""
+        offsets = {
+            topic_partition: OffsetAndMetadata(records[-1].offset + 1, None)
+            for topic_partition, records in records_by_partition.items()
+        }
+        self.commit(offsets)
+
+    def replay_batch(self, ods_manager, decoded_by_partition):
+        """
+        Replays a batch whose transaction was rolled back message by message, each one in its own transaction, so that
+        a single faulty message doesn't hold back the other partitions. The partitions are replayed in the dimension-first
+        topic order, and each one stops at its first failed message: its offset is only committed up to that message,
+        and the consumer seeks back to it so that it is consumed again rather than skipped.
+
+        :param decoded_by_partition: Dictionary mapping each TopicPartition to its (record, decoded message) pairs in offset order.
+                                     An undecodable record has no message, and is committed without being replayed.
+        """
+        offsets = {}
+        for topic_partition in sorted(decoded_by_partition, key=lambda topic_partition: get_topic_processing_rank(topic_partition.topic)):
+            for record, message in decoded_by_partition[topic_partition]:
+                if message is not None:
+                    try:
+                        with ods_key_cache_scope(), ods_manager.transaction():
+                            execute_ruling_topic_processor(ods_manager, record.topic, message)
+                    except Exception as e:
+                        self.logger.error(f"Failed to replay the message from {record.topic} at partition {record.partition} and offset {record.offset}. The partition is consumed again from that offset: {e}")
+                        self.consumer.seek(topic_partition, record.offset)
+                        break
+                offsets[topic_partition] = OffsetAndMetadata(record.offset + 1, None)
+
+        if offsets:
+            self.commit(offsets)
+
+    def consume_messages_in_batches(self, ods_manager):
+        """
+        Consumes the subscribed topics in micro-batches.
+
+        Each batch is grouped by topic and written with one massive insert per ODS table inside a single transaction.
+        The offsets are only committed once that transaction is committed. If the batch transaction fails, the batch
+        is replayed message by message, see replay_batch, so that a single faulty message doesn't block the other partitions
+        and no offset is committed past it.
+        The records of a partition revoked while the batch is polled are left to its next owner.
+        """
+        try:
+            self.logger.info(f"Starting to consume messages from {self.topics} in batches of {self.batch_size} records")
+            while True:
+                records_by_partition = self.poll_batch()
+                if not records_by_partition:
+                    self.activity_summary.maybe_log_summary()
+                    self.maybe_update_lag()
+                    self.maybe_refresh_key_caches()
+                    continue
+
+                decoded_by_partition = {}
+                messages_by_topic = {}
+                for topic_partition, records in records_by_partition.items():
+                    for record in records:
+                        self.observe_record(record)
+                    decoded_by_partition[topic_partition] = [(record, self.decode_record(record)) for record in records]
+                    messages_by_topic.setdefault(topic_partition.topic, []).extend(message for _, message in decoded_by_partition[topic_partition] if message is not None)
+
+                records_count = sum(len(records) for records in records_by_partition.values())
+                self.logger.debug(f"Batch of {records_count} records received from {sorted(messages_by_topic)}")
+
+                if execute_ruling_topic_processor_batch(ods_manager, messages_by_topic):
+                    self.commit_offsets(records_by_partition)
+                else:
+                    self.logger.warning("Batch transaction failed. Replaying the batch message by message.")
+                    self.replay_batch(ods_manager, decoded_by_partition)
+        except Exception as e:
+            self.logger.error(f"An error occurred while consuming messages: {e}")
+        finally:
+            self.close()
+
+    def consume_messages_in_parallel(self, ods_pool, workers, dispatch_mode='partition'):
+        """
+        Consumes the subscribed topics with a pool of workers, each one writing through its own ODS connection.
+
+        Records are dispatched by topic-partition or by business key so that their order holds per key.
+        The offset of a partition is only committed once every earlier record of that partition is processed.
+
+        :param ods_pool: The DataWarehouseManagerPool holding one connection per worker.
+        :param workers: Number of worker threads.
+        :param dispatch_mode: Either 'partition' or 'business'.
+
+        The consumer polls at most the records every worker queue can take, and pauses its partitions while a queue is
+        too full, so that it keeps polling and stays in its group rather than blocking on a full queue.
+        A partition holding a record that failed to be processed is paused and retried, see retry_failed_partitions.
+        """
+        worker_pool = self.worker_pool = TopicMessageWorkerPool(ods_pool, workers, dispatch_mode)
+        try:
+            self.logger.info(f"Starting to consume messages from {self.topics} with {workers} workers dispatching by {dispatch_mode}")
+            while True:
+                failed_partitions = self.retry_failed_partitions(worker_pool)
+                if not worker_pool.has_room(PARALLEL_POLL_MAX_RECORDS):
+                    self.consumer.pause(*self.consumer.assignment())
+                elif set(self.consumer.paused()) - failed_partitions:
+                    self.consumer.resume(*(set(self.consumer.paused()) - failed_partitions))
+                with consumer_metrics.time('poll', 'all'):
+                    records_by_partition = self.consumer.poll(timeout_ms=self.linger_ms, max_records=PARALLEL_POLL_MAX_RECORDS)
+                self.activity_summary.maybe_log_summary()
+                self.maybe_update_lag()
+                self.maybe_refresh_key_caches()
+                for topic_partition, records in records_by_partition.items():
+                    for record in records:
+                        self.observe_record(record)
+                        decoded_message = self.decode_record(record)
+                        if decoded_message is None:
+                            worker_pool.skip(topic_partition, record)
+                        else:
+                            worker_pool.dispatch(topic_partition, record, decoded_message)
+                self.commit_committable_offsets(worker_pool)
         except Exception as e:
             self.logger.error(f"An error occurred while consuming messages: {e}")
         finally:
+            worker_pool.close()
+            self.commit_committable_offsets(worker_pool)
+            self.worker_pool = None
             self.close()
 
+    def retry_failed_partitions(self, worker_pool):
+        """
+        Pauses the partitions holding a record the workers failed to process, so that no offset is committed past it.
+        Once the earlier records of such a partition are processed and committed, and the retry interval has elapsed,
+        the consumer seeks back to the failed record and resumes the partition, so that the record is processed again.
+
+        :return: The set of partitions still paused on a failed record.
+        """
+        failed_partitions = set()
+        for topic_partition, (failed_offset, failed_at) in worker_pool.offset_tracker.get_failed().items():
+            if time.monotonic() - failed_at < self.retry_interval or worker_pool.offset_tracker.pending_count([topic_partition]):
+                self.consumer.pause(topic_partition)
+                failed_partitions.add(topic_partition)
+                continue
+
+            self.commit_committable_offsets(worker_pool)
+            worker_pool.offset_tracker.forget([topic_partition])
+            if topic_partition in self.consumer.assignment():
+                self.logger.info(f"Retrying {topic_partition} from the failed offset {failed_offset}.")
+                self.consumer.seek(topic_partition, failed_offset)
+        return failed_partitions
+
+    def commit_committable_offsets(self, worker_pool):
+        """Commits the offsets whose earlier records have all been processed by the workers."""
+        committable = worker_pool.offset_tracker.pop_committable()
+        if committable:
+            self.commit({topic_partition: OffsetAndMetadata(offset, None) for topic_partition, offset in committable.items()})
+
     def close(self):
         """Closes the Kafka consumer."""
+        self.activity_summary.close()
+        for table_name, stats in get_ods_key_cache_stats().items():
+            self.logger.info(f"Surrogate key cache of {table_name}: {stats}")
         self.logger.info(f"Closing the consumer for topic: {self.topics}")
         self.consumer.close()
 
 if __name__ == "__main__":
     load_dotenv('../../.env')
+    configure_logging('kafka_consume_topics_messages.log', os.getenv('LOG_LEVEL', 'INFO'), asynchronous=os.getenv('LOG_ASYNC', 'true').lower() == 'true')
     kafka_servers = [f"{os.getenv('KAFKA_HOSTNAME')}:{os.getenv('KAFKA_PORT')}"]
     topic_names = ['material', 'material_prices', 'part_information', 'machine', 'supply_chain', 'sales']
     group_id = 'g2'
+    batch_size = int(os.getenv('KAFKA_BATCH_SIZE')) if os.getenv('KAFKA_BATCH_SIZE') else None
+    linger_ms = int(os.getenv('KAFKA_LINGER_MS', 1000))
+    workers = int(os.getenv('KAFKA_WORKERS')) if os.getenv('KAFKA_WORKERS') else None
+    dispatch_mode = os.getenv('KAFKA_DISPATCH_MODE', 'partition')
+    message_encoding = os.getenv('KAFKA_MESSAGE_ENCODING', 'auto')
+    payload_log_rate = float(os.getenv('KAFKA_PAYLOAD_LOG_RATE', 1))
+    summary_interval = float(os.getenv('KAFKA_LOG_SUMMARY_INTERVAL', 30))
+    lag_interval = float(os.getenv('KAFKA_LAG_INTERVAL', 10))
+    revoke_timeout = float(os.getenv('KAFKA_REVOKE_TIMEOUT', 30))
+    retry_interval = float(os.getenv('KAFKA_RETRY_INTERVAL', 5))
+    key_cache_check_interval = float(os.getenv('KAFKA_KEY_CACHE_CHECK_INTERVAL', 60))
+    metrics_port = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+    metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+    metrics_snapshot_path = os.getenv('METRICS_SNAPSHOT_PATH')
 
     server = os.getenv('DB_HOST')
     database = os.getenv('DB_NAME')
     username = os.getenv('DB_USER')
     password = os.getenv('DB_PASSWORD')
 
-    db_manager = DataWarehouseManager(server, database, username, password)
+    db_manager = DataWarehouseManager(server, database, username, password, ODS_LAYER)
     db_manager.connect()
+    preload_ods_key_caches(db_manager, int(os.getenv('ODS_KEY_CACHE_SIZE', 100000)))
 
-    consumer_client = KafkaConsumerClient(servers=kafka_servers, topics=topic_names, group_id=group_id)
+    consumer_client = KafkaConsumerClient(servers=kafka_servers, topics=topic_names, group_id=group_id, batch_size=batch_size, linger_ms=linger_ms, manual_commit=bool(workers), message_encoding=message_encoding, payload_log_rate=payload_log_rate, summary_interval=summary_interval, lag_interval=lag_interval, revoke_timeout=revoke_timeout, retry_interval=retry_interval, key_cache_manager=db_manager, key_cache_check_interval=key_cache_check_interval)
     consumer_client.subscribe()
-    consumer_client.consume_messages(db_manager)
+    if metrics_port:
+        start_metrics_server(metrics_port, metrics_host)
+    snapshot_writer = MetricsSnapshotWriter(metrics_snapshot_path, float(os.getenv('METRICS_SNAPSHOT_INTERVAL', 15))).start() if metrics_snapshot_path else None
+    if workers:
+        db_pool = DataWarehouseManagerPool(server, database, username, password, workers, ODS_LAYER)
+        consumer_client.consume_messages_in_parallel(db_pool, workers, dispatch_mode)
+        db_pool.close()
+    elif batch_size:
+        consumer_client.consume_messages_in_batches(db_manager)
+    else:
+        consumer_client.consume_messages(db_manager)
+    if snapshot_writer:
+        snapshot_writer.stop()
@@ -2,79 +2,192 @@ import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import logging
-from kafka_topic_messages_utils import append_kafka_message_to_tuples, filter_kafka_message_fields_to_push, get_max_id_incremented, get_ods_table_id, delete_ods_table_records
-
-log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'kafka_process_data_schema_topics_messages.log'))
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-            logging.FileHandler(log_file_path),
-            logging.StreamHandler()
-            ]
-    )
+from kafka_topic_messages_utils import get_ods_table_id, delete_ods_table_records
+from kafka_topic_messages_key_cache import ods_key_cache_scope
+from kafka_topic_messages_batch_writer import OdsBatchWriter
+from kafka_topic_messages_metrics import consumer_metrics, MeteredOdsManager
+from ods.ods_schema_registry import ODS_LAYER, get_column_names, validate_column_names
 
-def process_supply_chain_topic_messages(ods_manager, message):
-    """
-    Processes messages from the supply chain topic, updating the ODS (Operational Data Store).
+TOPIC_PROCESSING_ORDER = ['material', 'part_information', 'machine', 'supply_chain', 'sales']
 
-    This function handles the processing of messages received from the supply chain topic.
-    It performs a series of queries and inserts into the ODS (Operational Data Store).  
+SUPPLY_CHAIN_FIELDS = validate_column_names('fact_supply_chain', ['materialId', 'materialPrice', 'materialPriceDate', 'partDefaultPrice', 'trscMaterialId', 'machineId', 'partId', 'timeId', 'trscMachineId', 'trscPartId', 'timeOfProduction', 'isDamaged', 'lastUpdate', 'trscUnitId'], ODS_LAYER)
+SALES_FIELDS = validate_column_names('fact_sales', ["trscContractId", "trscPartId", "partId", "contractId", "cash", "date", "lastUpdate"], ODS_LAYER)
+PART_INFORMATION_FIELDS = get_column_names('dim_part_information', ODS_LAYER)
+MACHINE_FIELDS = get_column_names('dim_machine', ODS_LAYER)
+MATERIAL_FIELDS = get_column_names('dim_material', ODS_LAYER)
+CONTRACT_FIELDS = get_column_names('dim_contract', ODS_LAYER)
+
+# Three parameters per looked up message, under the 2100 parameters of a SQL Server statement.
+SUPPLY_CHAIN_LOOKUP_CHUNK_SIZE = 600
+
+def fetch_supply_chain_materials(ods_manager, supply_chain_keys):
     """
-    try:
-        table_name = 'fact_supply_chain'
-        if message['isDeleted']:
-            logging.info(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
-            query_to_delete = f"""
-                                DELETE FROM [ODS_PRODUCTION].[dbo].[{table_name}] 
-                                WHERE [{table_name}].[trscMachineId] = ?
-                                AND [{table_name}].[trscPartId] = ?
-                                AND [{table_name}].[timeOfProduction] = ?
-                                """
-            return ods_manager.execute_query(query_to_delete, (message['machineId'], message['partId'], message['timeOfProduction'],))
+    Resolves in one set-based query the surrogate ids, materials, prices and operational material ids of a batch of
+    (machineId, partId, production year) keys.
+
+    The machine and part surrogate ids are joined from dim_machine and dim_part_information, and the operational material
+    ids from dim_material, along with the next operational id to hand out when a material has none. The material prices and
+    part default prices are only stored in fact_supply_chain, which is read for them alone, once per batch, by seeking
+    its (partId, materialPriceDate) index over the production year of each key.
+    The keys are sent as a VALUES table, chunked to stay under the SQL Server parameter limit.
+
+    :param ods_manager: The connected DataWarehouseManager.
+    :param supply_chain_keys: Iterable of (machineId, partId, production year) keys.
+    :return: A dictionary mapping each key to its machine surrogate id, its part surrogate id and its material rows
+             (materialId, materialPrice, materialPriceDate, partDefaultPrice, materialFound, trscMaterialId, nextTrscMaterialId).
+    """
+    materials_by_key = {}
+    supply_chain_keys = list(dict.fromkeys(supply_chain_keys))
 
+    for chunk_start in range(0, len(supply_chain_keys), SUPPLY_CHAIN_LOOKUP_CHUNK_SIZE):
+        chunk = supply_chain_keys[chunk_start:chunk_start + SUPPLY_CHAIN_LOOKUP_CHUNK_SIZE]
+        requested_values = ', '.join('(?, ?, ?)' for _ in chunk)
         supply_chain_query = f"""
-                            SELECT DISTINCT
-                                materialId,
-                                materialPrice,
-                                materialPriceDate,
-                                partDefaultPrice 
-                            FROM 
-                                [ODS_PRODUCTION].[dbo].[{table_name}]
-                            WHERE 
-                                [{table_name}].[partId] = ?
-                            AND
-                                YEAR([{table_name}].[materialPriceDate]) = YEAR(?)
+                            SELECT
+                                requested.machineId,
+                                requested.partId,
+                                requested.productionYear,
+                                machine.machineId,
+                                part.partId,
+                                prices.materialId,
+                                prices.materialPrice,
+                                prices.materialPriceDate,
+                                prices.partDefaultPrice,
+                                material.materialFound,
+                                material.trscMaterialId,
+                                (SELECT MAX(trscMaterialId) + 1 FROM [ODS_PRODUCTION].[dbo].[dim_material]) AS nextTrscMaterialId
+                            FROM
+                                (VALUES {requested_values}) AS requested(machineId, partId, productionYear)
+                            OUTER APPLY (
+                                SELECT TOP 1 machineId
+                                FROM [ODS_PRODUCTION].[dbo].[dim_machine]
+                                WHERE dim_machine.trscMachineId = requested.machineId
+                            ) AS machine
+                            OUTER APPLY (
+                                SELECT TOP 1 partId
+                                FROM [ODS_PRODUCTION].[dbo].[dim_part_information]
+                                WHERE dim_part_information.trscPartId = requested.partId
+                            ) AS part
+                            OUTER APPLY (
+                                SELECT DISTINCT
+                                    materialId,
+                                    materialPrice,
+                                    materialPriceDate,
+                                    partDefaultPrice
+                                FROM
+                                    [ODS_PRODUCTION].[dbo].[fact_supply_chain]
+                                WHERE
+                                    fact_supply_chain.partId = requested.partId
+                                AND
+                                    fact_supply_chain.materialPriceDate >= DATEFROMPARTS(requested.productionYear, 1, 1)
+                                AND
+                                    fact_supply_chain.materialPriceDate < DATEFROMPARTS(requested.productionYear + 1, 1, 1)
+                            ) AS prices
+                            OUTER APPLY (
+                                SELECT TOP 1 1 AS materialFound, trscMaterialId
+                                FROM [ODS_PRODUCTION].[dbo].[dim_material]
+                                WHERE dim_material.materialId = prices.materialId
+                            ) AS material
                             """
-        material_operational_id = f"""SELECT trscMaterialId FROM [ODS_PRODUCTION].[dbo].[dim_material] WHERE materialId = ?"""
+        params = tuple(value for supply_chain_key in chunk for value in supply_chain_key)
+        for row in ods_manager.execute_query(supply_chain_query, params) or []:
+            machine_id, part_id, materials = materials_by_key.setdefault(tuple(row[:3]), (row[3], row[4], []))
+            if row[5] is not None:
+                materials.append(tuple(row[5:]))
 
-        logging.info('Starting to ingest Kafka part information messages in the dedicated ODS table.')
+    return materials_by_key
 
-        materials_fetched = ods_manager.execute_query(supply_chain_query, (message['partId'], message['timeOfProduction']))
-        if materials_fetched:
-            tuple_materials = [tuple(material) for material in materials_fetched]
-            for idx, material in enumerate(materials_fetched):
-                trsc_material_id = ods_manager.execute_query(material_operational_id, (material[0],))[0][0]
-                operational_material_id = trsc_material_id if trsc_material_id is not None else get_max_id_incremented(ods_manager, 'trscMaterialId', 'dim_material')[0][0] + idx
-                tuple_materials[idx] += (operational_material_id,)
-            
-            message['machineIdODS'] = get_ods_table_id(ods_manager, 'machineId', message['machineId'], 'dim_machine')[0][0]
-            message['partIdODS'] = get_ods_table_id(ods_manager, 'partId', message['partId'], 'dim_part_information')[0][0]
-            
-            message['timeId'] = int(message['timeOfProduction'].split('T')[0].replace('-', ''))
-            message['isDamaged'] = message['var5']
+def get_supply_chain_lookup_key(message):
+    """Returns the (machineId, partId, production year) key a supply chain message is enriched with."""
+    return (message.machineId, message.partId, int(message.timeOfProduction[:4]))
 
-            message_to_append = filter_kafka_message_fields_to_push(message, ['machineIdODS', 'partIdODS', 'materialIdODS', 'timeId', 'machineId', 'partId', 'timeOfProduction', 'isDamaged', 'lastUpdate'])
-            records = append_kafka_message_to_tuples(message_to_append, tuple_materials)
-            
-            fields = ['materialId', 'materialPrice', 'materialPriceDate', 'partDefaultPrice', 'trscMaterialId', 'machineId', 'partId', 'timeId', 'trscMachineId', 'trscPartId', 'timeOfProduction', 'isDamaged', 'lastUpdate']
+def get_supply_chain_time_id(message):
+    """Returns the yyyymmdd time id of the production day of a supply chain message."""
+    return int(message.timeOfProduction.split('T')[0].replace('-', ''))
 
-            ods_manager.generate_and_execute_massive_insert(table_name, fields, records)
-        else:
-            logging.error(f"No additional data fetched for the supply chain message. Check if {message['partId']} is a referenced part number.")
-        
+def build_supply_chain_records(ods_manager, message, machine_id, part_id, materials_fetched):
+    """
+    Builds the fact_supply_chain records of a supply chain message from its fetched surrogate ids and material rows.
+
+    A material without an operational id in dim_material gets the next one, and a machine or part missing from
+    its dimension table gets a newly allocated surrogate id. A message referencing a material missing from dim_material
+    is logged and skipped.
+    """
+    tuple_materials = []
+    for idx, (material_id, material_price, material_price_date, part_default_price, material_found, trsc_material_id, next_trsc_material_id) in enumerate(materials_fetched):
+        if not material_found:
+            logging.error(f"Material {material_id} isn't referenced in the dim_material table. Skipping the supply chain message {message.id}.")
+            return []
+        operational_material_id = trsc_material_id if trsc_material_id is not None else next_trsc_material_id + idx
+        tuple_materials.append((material_id, material_price, material_price_date, part_default_price, operational_material_id))
+
+    if machine_id is None:
+        machine_id = get_ods_table_id(ods_manager, 'machineId', message.machineId, 'dim_machine')[0][0]
+    if part_id is None:
+        part_id = get_ods_table_id(ods_manager, 'partId', message.partId, 'dim_part_information')[0][0]
+    time_id = get_supply_chain_time_id(message)
+
+    return [
+        material + (machine_id, part_id, time_id, message.machineId, message.partId, message.timeOfProduction, message.var5, message.lastUpdate, message.id)
+        for material in tuple_materials
+    ]
+
+def process_supply_chain_topic_messages_batch(ods_manager, messages):
+    """
+    Processes a batch of messages from the supply chain topic, updating the ODS (Operational Data Store).
+
+    The insert messages are enriched with a single set-based query per run of consecutive insert messages.
+    A delete message closes the current run, so that the runs following it observe the deletion exactly
+    as if the messages had been processed one by one. Each message is one produced unit, whose records are
+    merged on its unit id and material so that a replayed message doesn't duplicate them, the deletes being keyed
+    on the machine, part and production day.
+    An error is logged and re-raised, so that the caller rolls the batch back rather than committing its offsets.
+    """
+    table_name = 'fact_supply_chain'
+    fields = SUPPLY_CHAIN_FIELDS
+    pending_messages = []
+
+    def ingest_pending_messages():
+        if not pending_messages:
+            return
+
+        logging.debug(f'Starting to ingest {len(pending_messages)} Kafka supply_chain messages in the dedicated ODS table.')
+        materials_by_key = fetch_supply_chain_materials(ods_manager, (get_supply_chain_lookup_key(message) for message in pending_messages))
+
+        records = []
+        for message in pending_messages:
+            machine_id, part_id, materials_fetched = materials_by_key.get(get_supply_chain_lookup_key(message), (None, None, []))
+            if materials_fetched:
+                records.extend(build_supply_chain_records(ods_manager, message, machine_id, part_id, materials_fetched))
+            else:
+                logging.error(f"No additional data fetched for the supply chain message. Check if {message.partId} is a referenced part number.")
+
+        pending_messages.clear()
+        if records:
+            ods_manager.generate_and_execute_massive_upsert(table_name, fields, records)
+
+    try:
+        for message in messages:
+            if message.isDeleted:
+                ingest_pending_messages()
+                logging.debug(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
+                ods_manager.generate_and_execute_massive_delete(table_name, ['trscMachineId', 'trscPartId', 'timeId'], [(message.machineId, message.partId, get_supply_chain_time_id(message))])
+            else:
+                pending_messages.append(message)
+
+        ingest_pending_messages()
     except Exception as e:
-        logging.error(f'An unexpected error occurred while processing the message from the supply_chain topic: {e}')
+        logging.error(f'An unexpected error occurred while processing the messages from the supply_chain topic: {e}')
+        raise
+
+def process_supply_chain_topic_messages(ods_manager, message):
+    """
+    Processes messages from the supply chain topic, updating the ODS (Operational Data Store).
+
+    This function handles the processing of messages received from the supply chain topic.
+    It performs a series of queries and inserts into the ODS (Operational Data Store).  
+    """
+    return process_supply_chain_topic_messages_batch(ods_manager, [message])
 
 def process_part_topic_messages(ods_manager, message):
     """
@@ -84,21 +197,22 @@ def process_part_topic_messages(ods_manager, message):
     try:
         table_name = "dim_part_information"
 
-        if message['isDeleted']:
-            logging.info(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
-            return delete_ods_table_records(ods_manager, 'partId', message['id'], table_name)
+        if message.isDeleted:
+            logging.debug(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
+            return delete_ods_table_records(ods_manager, 'partId', message.id, table_name)
 
-        logging.info('Starting to ingest Kafka part_information messages in the dedicated ODS table.')
+        logging.debug('Starting to ingest Kafka part_information messages in the dedicated ODS table.')
 
-        fields = ["trscPartId", "partId", "timeToProduce", "lastUpdate"]
-        part_id = get_ods_table_id(ods_manager, 'partId', message['id'], table_name)[0][0]
+        fields = PART_INFORMATION_FIELDS
+        part_id = get_ods_table_id(ods_manager, 'partId', message.id, table_name)[0][0]
         records = [
-            (message['id'], part_id, float(message['timeToProduce']), message['lastUpdate']),
+            (message.id, part_id, message.timeToProduce, message.lastUpdate),
         ]
 
-        return ods_manager.generate_and_execute_massive_insert(table_name, fields, records)
+        return ods_manager.generate_and_execute_massive_upsert(table_name, fields, records)
     except Exception as e:
         logging.error(f'An unexpected error occurred while processing the message from the part_information topic: {e}')
+        raise
 
 def process_machine_topic_messages(ods_manager, message):
     """
@@ -107,21 +221,22 @@ def process_machine_topic_messages(ods_manager, message):
     try:
         table_name = 'dim_machine'
 
-        if message['isDeleted']:
-            logging.info(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
-            return delete_ods_table_records(ods_manager, 'machineId', message['id'], table_name)
+        if message.isDeleted:
+            logging.debug(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
+            return delete_ods_table_records(ods_manager, 'machineId', message.id, table_name)
         
-        logging.info('Starting to ingest Kafka machine messages in the dedicated ODS table.')
+        logging.debug('Starting to ingest Kafka machine messages in the dedicated ODS table.')
 
-        fields = ['trscMachineId', 'machineId', 'lastUpdate']
-        machine_id = get_ods_table_id(ods_manager, 'machineId', message['id'], table_name)[0][0]
+        fields = MACHINE_FIELDS
+        machine_id = get_ods_table_id(ods_manager, 'machineId', message.id, table_name)[0][0]
         records = [
-            (message['id'], machine_id, message['lastUpdate'],),
+            (message.id, machine_id, message.lastUpdate,),
         ]
 
-        return ods_manager.generate_and_execute_massive_insert(table_name, fields, records)
+        return ods_manager.generate_and_execute_massive_upsert(table_name, fields, records)
     except Exception as e:
         logging.error(f'An unexpected error occurred while processing the message from the machine topic: {e}')
+        raise
 
 def process_material_topic_messages(ods_manager, message):
     """
@@ -130,21 +245,22 @@ def process_material_topic_messages(ods_manager, message):
     try:
         table_name = 'dim_material'
 
-        if message['isDeleted']:
-            logging.info(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
-            return delete_ods_table_records(ods_manager, 'materialId', message['id'], table_name)
+        if message.isDeleted:
+            logging.debug(f'Attempting to delete records for table {table_name} in the dedicated ODS table.')
+            return delete_ods_table_records(ods_manager, 'materialId', message.id, table_name)
 
-        logging.info('Starting to ingest Kafka material messages in the dedicated ODS table.')
+        logging.debug('Starting to ingest Kafka material messages in the dedicated ODS table.')
 
-        fields = ['trscMaterialId', 'materialId', 'name', 'lastUpdate']
-        material_id = get_ods_table_id(ods_manager, 'materialId', message['id'], table_name)[0][0]
+        fields = MATERIAL_FIELDS
+        material_id = get_ods_table_id(ods_manager, 'materialId', message.id, table_name)[0][0]
         records = [
-            (message['id'], material_id, message['name'], message['lastUpdate']),
+            (message.id, material_id, message.name, message.lastUpdate),
         ]
 
-        return ods_manager.generate_and_execute_massive_insert(table_name, fields, records)
+        return ods_manager.generate_and_execute_massive_upsert(table_name, fields, records)
     except Exception as e:
         logging.error(f'An unexpected error occurred while processing the message from the material topic: {e}')
+        raise
 
 def process_contract_topic_messages(ods_manager, message):
     """
@@ -155,58 +271,58 @@ def process_contract_topic_messages(ods_manager, message):
         fact_name = "fact_sales"
         dim_name = "dim_contract"
 
-        if message['isDeleted']:
-            logging.info(f'Attempting to delete records for table {fact_name} in the dedicated ODS table.')
-            query_to_delete = f"""
-                                DELETE FROM [ODS_PRODUCTION].[dbo].[{fact_name}] 
-                                WHERE [{fact_name}].[trscContractId] = ?
-                                AND [{fact_name}].[trscPartId] = ?
-                                """
-            for part in message['parts']:
-                ods_manager.execute_query(query_to_delete, (message['contract_number'], part,))
+        if message.isDeleted:
+            logging.debug(f'Attempting to delete records for table {fact_name} in the dedicated ODS table.')
+            ods_manager.generate_and_execute_massive_delete(fact_name, ['trscContractId', 'trscPartId'], [(message.contract_number, part) for part in message.parts])
             
-            logging.info(f'Attempting to delete records for table {dim_name} in the dedicated ODS table.')
-            return delete_ods_table_records(ods_manager, 'contractId', message['contract_number'], dim_name)
+            logging.debug(f'Attempting to delete records for table {dim_name} in the dedicated ODS table.')
+            return delete_ods_table_records(ods_manager, 'contractId', message.contract_number, dim_name)
 
-        logging.info('Starting to ingest Kafka contract messages in the dedicated ODS tables.')
+        logging.debug('Starting to ingest Kafka contract messages in the dedicated ODS tables.')
 
-        total_cash = sum(cash * part for cash, part in zip(message['cash'], message['parts']))
-        contract_id = get_ods_table_id(ods_manager, 'contractId', message['contract_number'], dim_name)[0][0]
+        total_cash = sum(cash * part for cash, part in zip(message.cash, message.parts))
+        contract_id = get_ods_table_id(ods_manager, 'contractId', message.contract_number, dim_name)[0][0]
 
-        fact_fields = ["trscContractId", "trscPartId", "partId", "contractId", "cash", "date", "lastUpdate"]
+        fact_fields = SALES_FIELDS
         fact_records = [
                         (
-                            message['contract_number'],
+                            message.contract_number,
                             part,
-                            get_ods_table_id(ods_manager, 'partId', part, 'dim_part_information')[0][0],
+                            get_ods_table_id(ods_manager, 'partId', part, 'dim_part_information', allocate=False)[0][0],
                             contract_id,
                             total_cash,
-                            message['date'],
-                            message['lastUpdate']
+                            message.date,
+                            message.lastUpdate
                         )
-                        for part in message['parts']
+                        for part in message.parts
                     ]
 
-        ods_manager.generate_and_execute_massive_insert(fact_name, fact_fields, fact_records)
+        ods_manager.generate_and_execute_massive_upsert(fact_name, fact_fields, fact_records)
 
-        dim_fields = ["trscContractId", "contractId", "clientName", "lastUpdate"]
+        dim_fields = CONTRACT_FIELDS
         dim_records = [
-             (message['contract_number'], contract_id, message['client_name'], message['lastUpdate'])
+             (message.contract_number, contract_id, message.client_name, message.lastUpdate)
         ]
 
-        return ods_manager.generate_and_execute_massive_insert(dim_name, dim_fields, dim_records)
+        return ods_manager.generate_and_execute_massive_upsert(dim_name, dim_fields, dim_records)
 
     except Exception as e:
         logging.error(f'An unexpected error occurred while processing the message from the contract topic: {e}')
+        raise
 
 
-def execute_ruling_topic_processor(ods_manager, topic_name, message):
+def execute_ruling_topic_processor(ods_manager, topic_name, message, metered=True):
     """
     Executes the appropriate processor function based on the Kafka topic name.
 
     This function routes Kafka messages to their respective processing functions
     based on the topic name. It is a centralized handler for different topics,
     making it easier to manage the processing logic for each Kafka message type.
+
+    When metered, the processing latency and the ODS lookups and writes of the message are recorded in the consumer metrics.
+    A processing error is re-raised, so that the caller doesn't commit the offset of a message that wasn't written.
+    The surrogate keys resolved by the message are only cached once it is processed, or once the transaction of the
+    caller's ods_key_cache_scope is committed.
     """
     topic_processors = {
         'part_information': process_part_topic_messages, 
@@ -217,7 +333,57 @@ def execute_ruling_topic_processor(ods_manager, topic_name, message):
     }
 
     processor = topic_processors.get(topic_name)
-    if processor:
-        return processor(ods_manager, message)
+    if processor and metered:
+        consumer_metrics.increment('messages_processed_total', topic_name)
+        with consumer_metrics.time('process', topic_name), ods_key_cache_scope():
+            return processor(MeteredOdsManager(ods_manager, topic_name), message)
+    elif processor:
+        with ods_key_cache_scope():
+            return processor(ods_manager, message)
     else:
-        logging.error(f"{topic_name} isn't recognized. Cannot process messages from an unreferenced topic.")
\ No newline at end of file
+        logging.error(f"{topic_name} isn't recognized. Cannot process messages from an unreferenced topic.")
+
+def get_topic_processing_rank(topic_name):
+    """Returns the rank of a topic in the dimension-first processing order, unknown topics coming last."""
+    return TOPIC_PROCESSING_ORDER.index(topic_name) if topic_name in TOPIC_PROCESSING_ORDER else len(TOPIC_PROCESSING_ORDER)
+
+TOPIC_BATCH_PROCESSORS = {
+    'supply_chain': process_supply_chain_topic_messages_batch,
+}
+
+def execute_ruling_topic_processor_batch(ods_manager, messages_by_topic):
+    """
+    Executes the topic processors over a whole batch of Kafka messages grouped by topic.
+
+    Dimension topics are processed before the fact topics so that the facts resolve the dimensions
+    received in the same batch. Every insert is buffered and written with one massive insert per ODS table,
+    and the batch is committed as a single transaction. The surrogate keys allocated by the batch are only cached
+    once that transaction is committed.
+
+    :param ods_manager: The connected DataWarehouseManager.
+    :param messages_by_topic: Dictionary mapping each topic name to its messages in offset order.
+    :return: True if the batch transaction was committed, False if it was rolled back.
+    """
+    metered_ods_manager = MeteredOdsManager(ods_manager, None)
+    batch_writer = OdsBatchWriter(metered_ods_manager)
+    ordered_topics = sorted(messages_by_topic, key=get_topic_processing_rank)
+
+    try:
+        with ods_key_cache_scope(), ods_manager.transaction():
+            for topic_name in ordered_topics:
+                logging.debug(f'Processing a batch of {len(messages_by_topic[topic_name])} messages from the {topic_name} topic.')
+                metered_ods_manager.topic_name = topic_name
+                consumer_metrics.increment('messages_processed_total', topic_name, len(messages_by_topic[topic_name]))
+                with consumer_metrics.time('batch', topic_name):
+                    if topic_name in TOPIC_BATCH_PROCESSORS:
+                        TOPIC_BATCH_PROCESSORS[topic_name](batch_writer, messages_by_topic[topic_name])
+                        continue
+                    for message in messages_by_topic[topic_name]:
+                        execute_ruling_topic_processor(batch_writer, topic_name, message, metered=False)
+            metered_ods_manager.topic_name = 'all'
+            batch_writer.flush_all()
+        logging.debug('Batch transaction committed successfully.')
+        return True
+    except Exception as e:
+        logging.error(f'An unexpected error occurred while writing the batch of messages. The batch transaction was rolled back: {e}')
+        return False
\ No newline at end of file
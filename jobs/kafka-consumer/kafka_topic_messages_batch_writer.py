@@ -0,0 +1,131 @@
+class PendingTableWrites:
+    """
+    A generation of buffered writes on one ODS table. Its deletes are flushed before its inserts and upserts,
+    so a delete is only added to a generation if none of its buffered records shares the deleted key.
+    """
+
+    def __init__(self):
+        self.deletes = {}
+        self.writes = {}
+        self.key_indexes = {}
+
+    def add_write(self, operation, column_names, records):
+        self.writes.setdefault((operation, column_names), []).extend(records)
+        for key_columns, key_index in self.key_indexes.items():
+            key_index.update(project_records(records, column_names, key_columns))
+
+    def add_delete(self, key_columns, keys):
+        self.deletes.setdefault(key_columns, []).extend(keys)
+
+    def conflicts_with_delete(self, key_columns, keys):
+        """Tells whether any buffered record of this generation matches one of the deleted keys."""
+        if any(not set(key_columns) <= set(column_names) for _, column_names in self.writes):
+            return True
+        if key_columns not in self.key_indexes:
+            key_index = set()
+            for (_, column_names), records in self.writes.items():
+                key_index.update(project_records(records, column_names, key_columns))
+            self.key_indexes[key_columns] = key_index
+        return any(tuple(key) in self.key_indexes[key_columns] for key in keys)
+
+def project_records(records, column_names, key_columns):
+    """Returns the values of the key columns of each record."""
+    if not set(key_columns) <= set(column_names):
+        return []
+    positions = [column_names.index(column) for column in key_columns]
+    return [tuple(record[position] for position in positions) for record in records]
+
+class OdsBatchWriter:
+    """
+    Buffers the inserts, upserts and deletes emitted by the topic processors so that a whole batch of Kafka messages
+    is written with one set-based statement per ODS table and operation inside a single transaction.
+    The writer must be used inside a DataWarehouseManager.transaction() block.
+
+    The writer exposes the same `execute_query`, `generate_and_execute_massive_insert`,
+    `generate_and_execute_massive_upsert` and `generate_and_execute_massive_delete` methods as the
+    DataWarehouseManager, so the topic processors can run against it unchanged.
+    """
+
+    def __init__(self, ods_manager):
+        """
+        Initializes the OdsBatchWriter.
+
+        :param ods_manager: The connected DataWarehouseManager the batch is written through.
+        """
+        self.ods_manager = ods_manager
+        self.pending_writes = {}
+        self.failed = False
+
+    def pending_tables(self):
+        """Returns the names of the tables holding buffered writes."""
+        return set(self.pending_writes)
+
+    def execute_query(self, query, params=None):
+        """
+        Executes a query inside the batch transaction.
+
+        Buffered writes of any table referenced by the query are flushed beforehand, so that lookups
+        observe the same state as if every message had been written one by one.
+        """
+        try:
+            self.flush([table_name for table_name in self.pending_tables() if f"[{table_name}]" in query])
+            return self.ods_manager.execute_query(query, params)
+        except Exception:
+            self.failed = True
+            raise
+
+    def current_generation(self, table_name):
+        """Returns the latest generation of buffered writes of a table."""
+        generations = self.pending_writes.setdefault(table_name, [PendingTableWrites()])
+        return generations[-1]
+
+    def generate_and_execute_massive_insert(self, table_name, column_names, records):
+        """Buffers the records to insert until the batch is flushed."""
+        self.current_generation(table_name).add_write('insert', tuple(column_names), records)
+        return True
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records):
+        """Buffers the records to upsert until the batch is flushed."""
+        self.current_generation(table_name).add_write('upsert', tuple(column_names), records)
+        return True
+
+    def generate_and_execute_massive_delete(self, table_name, key_columns, keys):
+        """
+        Buffers the keys to delete until the batch is flushed. A delete targeting a record buffered earlier
+        in the batch opens a new generation, so that it is applied after that record is written.
+        """
+        generation = self.current_generation(table_name)
+        if generation.conflicts_with_delete(tuple(key_columns), keys):
+            generation = PendingTableWrites()
+            self.pending_writes[table_name].append(generation)
+        generation.add_delete(tuple(key_columns), keys)
+        return True
+
+    def flush(self, table_names=None):
+        """
+        Issues the buffered writes of each table inside the batch transaction, generation by generation:
+        one massive delete per key column list, then one massive insert or upsert per column list.
+
+        :param table_names: Optional list restricting the flush to these tables. Every table is flushed when None.
+        """
+        for table_name in list(self.pending_writes):
+            if table_names is not None and table_name not in table_names:
+                continue
+
+            for generation in self.pending_writes.pop(table_name):
+                for key_columns, keys in generation.deletes.items():
+                    self.ods_manager.generate_and_execute_massive_delete(table_name, list(key_columns), keys)
+                for (operation, column_names), records in generation.writes.items():
+                    if operation == 'upsert':
+                        self.ods_manager.generate_and_execute_massive_upsert(table_name, list(column_names), records)
+                    else:
+                        self.ods_manager.generate_and_execute_massive_insert(table_name, list(column_names), records)
+
+    def flush_all(self):
+        """
+        Flushes every buffered table. Meant to be called last inside the batch transaction, which is
+        refused if any query of the batch failed.
+        """
+        if self.failed:
+            raise RuntimeError("A query failed inside the batch transaction. Refusing to commit.")
+        self.flush()
@@ -0,0 +1,222 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+ODS_DIMENSION_KEYS = {
+    'dim_part_information': 'partId',
+    'dim_machine': 'machineId',
+    'dim_material': 'materialId',
+    'dim_contract': 'contractId',
+}
+
+class SurrogateKeyCache:
+    """
+    An in-process mapping between the transactional ids of a dimension table and its ODS surrogate ids.
+
+    The mapping is size-bounded with a LRU eviction policy, and new surrogate ids are handed out by a local
+    monotonic allocator seeded once from the MAX of the surrogate id column, so that resolving a key never
+    needs to hit the ODS (Operational Data Store) while the cache holds the whole table.
+    """
+
+    def __init__(self, table_name, id, max_size=100000):
+        """
+        Initializes the SurrogateKeyCache.
+
+        :param table_name: The name of the dimension table.
+        :param id: The surrogate id column, e.g. 'partId'. The transactional id column is its 'trsc' counterpart.
+        :param max_size: Maximum number of keys kept in memory.
+        """
+        self.table_name = table_name
+        self.id = id
+        self.trsc_id = f"trsc{id[0].upper()}{id[1:]}"
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.next_id = None
+        self.complete = False
+        self.snapshot_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get_snapshot_version(self, ods_manager):
+        """
+        Returns the count and the latest 'lastUpdate' of the rows written by the populate job, those without transactional id,
+        which change whenever the populate job replaces its snapshot of the table. None is returned if the ODS couldn't be queried.
+        """
+        rows = ods_manager.execute_query(f"""SELECT COUNT(*), MAX(lastUpdate) FROM [ODS_PRODUCTION].[dbo].[{self.table_name}] WHERE {self.trsc_id} IS NULL""")
+        return tuple(rows[0]) if rows else None
+
+    def preload(self, ods_manager):
+        """
+        Loads the mapping in bulk and seeds the id allocator from the MAX of the surrogate id column.
+
+        The cache is flagged as complete when the whole table fits in it, in which case a miss is
+        known to be a new key and is resolved without querying the ODS. A cache preloaded again keeps
+        its allocator above the ids it already handed out.
+
+        :return: True if the cache was preloaded, False if the ODS couldn't be queried.
+        """
+        rows = ods_manager.execute_query(f"""SELECT {self.trsc_id}, {self.id} FROM [ODS_PRODUCTION].[dbo].[{self.table_name}] WHERE {self.trsc_id} IS NOT NULL""")
+        max_id = ods_manager.execute_query(f"""SELECT COALESCE(MAX({self.id}), 0) + 1 FROM [ODS_PRODUCTION].[dbo].[{self.table_name}]""")
+        snapshot_version = self.get_snapshot_version(ods_manager)
+        if rows is None or not max_id:
+            logging.error(f"Failed to preload the keys of the {self.table_name} table.")
+            return False
+
+        with self.lock:
+            self.entries.clear()
+            for trsc_id, surrogate_id in rows[-self.max_size:]:
+                self.entries[int(trsc_id)] = surrogate_id
+            self.next_id = max(max_id[0][0], self.next_id or 0)
+            self.complete = len(rows) <= self.max_size
+            self.snapshot_version = snapshot_version
+
+        logging.info(f"Preloaded {len(self.entries)} keys of the {self.table_name} table. Next surrogate id is {self.next_id}.")
+        return True
+
+    def get(self, trsc_id):
+        """
+        Returns the surrogate id mapped to a transactional id, or None on a miss.
+        The keys put or removed by the current thread inside an ods_key_cache_scope are seen first.
+        """
+        pending_keys = get_pending_keys(self.table_name)
+        if pending_keys is not None and int(trsc_id) in pending_keys:
+            return pending_keys[int(trsc_id)]
+
+        with self.lock:
+            surrogate_id = self.entries.get(int(trsc_id))
+            if surrogate_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(int(trsc_id))
+            self.hits += 1
+            return surrogate_id
+
+    def put(self, trsc_id, surrogate_id):
+        """
+        Maps a transactional id to its surrogate id. Inside an ods_key_cache_scope, the mapping is deferred until the scope
+        exits, since the dimension row it refers to isn't committed yet.
+        """
+        pending_keys = get_pending_keys(self.table_name)
+        if pending_keys is not None:
+            pending_keys[int(trsc_id)] = surrogate_id
+        else:
+            self.store(trsc_id, surrogate_id)
+
+    def remove(self, trsc_id):
+        """Forgets a transactional id once its records are deleted, or once the scope deleting them exits."""
+        pending_keys = get_pending_keys(self.table_name)
+        if pending_keys is not None:
+            pending_keys[int(trsc_id)] = None
+        else:
+            self.discard(trsc_id)
+
+    def store(self, trsc_id, surrogate_id):
+        """Maps a transactional id to its surrogate id, evicting the least recently used key if needed."""
+        with self.lock:
+            self.entries[int(trsc_id)] = surrogate_id
+            self.entries.move_to_end(int(trsc_id))
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+                self.complete = False
+
+    def discard(self, trsc_id):
+        """Forgets a transactional id."""
+        with self.lock:
+            self.entries.pop(int(trsc_id), None)
+
+    def allocate_id(self):
+        """Hands out the next surrogate id."""
+        with self.lock:
+            surrogate_id = self.next_id
+            self.next_id += 1
+            return surrogate_id
+
+    def stats(self):
+        """Returns the hit/miss counters used to size the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'next_id': self.next_id,
+            }
+
+ods_key_caches = {}
+pending_key_changes = threading.local()
+
+def get_pending_keys(table_name):
+    """Returns the keys put or removed by the current thread in a table inside an ods_key_cache_scope, or None outside of it."""
+    changes = getattr(pending_key_changes, 'tables', None)
+    return None if changes is None else changes.setdefault(table_name, {})
+
+@contextmanager
+def ods_key_cache_scope():
+    """
+    Defers the keys cached while writing to the ODS until the write is committed.
+
+    The keys put or removed inside the block are only seen by the current thread, and are applied to the shared caches
+    when the block exits, or dropped if an exception escapes it, e.g. when the transaction they were written in is
+    rolled back. The block must therefore wrap the transaction. A nested block joins the outermost one.
+
+    Usage:
+        with ods_key_cache_scope(), ods_manager.transaction():
+            ...
+    """
+    if getattr(pending_key_changes, 'tables', None) is not None:
+        yield
+        return
+
+    changes = pending_key_changes.tables = {}
+    try:
+        yield
+    finally:
+        pending_key_changes.tables = None
+
+    for table_name, pending_keys in changes.items():
+        key_cache = ods_key_caches.get(table_name)
+        if key_cache is None:
+            continue
+        for trsc_id, surrogate_id in pending_keys.items():
+            if surrogate_id is None:
+                key_cache.discard(trsc_id)
+            else:
+                key_cache.store(trsc_id, surrogate_id)
+
+def preload_ods_key_caches(ods_manager, max_size=100000):
+    """
+    Builds and preloads one SurrogateKeyCache per ODS dimension table.
+    A table whose cache couldn't be preloaded keeps resolving its keys against the ODS.
+    """
+    for table_name, id in ODS_DIMENSION_KEYS.items():
+        key_cache = SurrogateKeyCache(table_name, id, max_size)
+        if key_cache.preload(ods_manager):
+            ods_key_caches[table_name] = key_cache
+
+def refresh_stale_ods_key_caches(ods_manager):
+    """
+    Preloads again the dimension caches whose table had its populate job snapshot replaced since they were preloaded,
+    the surrogate ids of the replaced rows being unknown to their mapping and to their allocator.
+
+    :return: The names of the tables whose cache was preloaded again.
+    """
+    refreshed_tables = []
+    for table_name, key_cache in list(ods_key_caches.items()):
+        snapshot_version = key_cache.get_snapshot_version(ods_manager)
+        if snapshot_version is None or snapshot_version == key_cache.snapshot_version:
+            continue
+        logging.info(f"The populate job snapshot of the {table_name} table changed, its key cache is preloaded again.")
+        if key_cache.preload(ods_manager):
+            refreshed_tables.append(table_name)
+    return refreshed_tables
+
+def get_ods_key_cache_stats():
+    """Returns the counters of every preloaded dimension cache."""
+    return {table_name: key_cache.stats() for table_name, key_cache in ods_key_caches.items()}
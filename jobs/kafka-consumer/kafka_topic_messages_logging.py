@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+class TopicPayloadSampler:
+    """
+    Rate-limits the payload logs of the consumed records, per topic.
+
+    Each topic is granted a token bucket refilled at `payloads_per_second`, so that a burst of records only
+    logs a handful of payloads while the number of skipped ones is reported along the next logged payload.
+    Every payload is logged when the DEBUG level is enabled.
+    """
+
+    def __init__(self, payloads_per_second=1.0, logger=None):
+        """
+        Initializes the TopicPayloadSampler.
+
+        :param payloads_per_second: Maximum rate of payloads logged per topic. 0 disables the payload logs.
+        :param logger: The logger the payloads are written to. Defaults to the root logger.
+        """
+        self.payloads_per_second = payloads_per_second
+        self.capacity = max(1.0, payloads_per_second)
+        self.logger = logger or logging.getLogger()
+        self.buckets = {}
+
+    def allow(self, topic_name):
+        """Takes a token from the bucket of a topic, returning whether its next payload may be logged."""
+        now = time.monotonic()
+        tokens, last_refill, skipped = self.buckets.get(topic_name, (self.capacity, now, 0))
+        tokens = min(self.capacity, tokens + (now - last_refill) * self.payloads_per_second)
+        if tokens >= 1:
+            self.buckets[topic_name] = (tokens - 1, now, 0)
+            return skipped
+        self.buckets[topic_name] = (tokens, now, skipped + 1)
+        return None
+
+    def log(self, record):
+        """Logs the payload of a Kafka record, unless its topic has exhausted its rate."""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Message received from {record.topic} and from partition {record.partition} at offset {record.offset} : {record.value}")
+            return
+        if self.payloads_per_second <= 0 or not self.logger.isEnabledFor(logging.INFO):
+            return
+
+        skipped = self.allow(record.topic)
+        if skipped is not None:
+            skipped_note = f" ({skipped} payloads of this topic skipped since the last one)" if skipped else ""
+            self.logger.info(f"Message received from {record.topic} and from partition {record.partition} at offset {record.offset} : {record.value}{skipped_note}")
+
+class ErrorCountingHandler(logging.Handler):
+    """A logging handler counting the ERROR and CRITICAL records logged from any thread."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+class ConsumerActivitySummary:
+    """
+    Logs a periodic summary line of the consumer activity: the records received per topic, the throughput
+    in records per second and the number of errors logged since the previous summary.
+    """
+
+    def __init__(self, interval_seconds=30, logger=None):
+        """
+        Initializes the ConsumerActivitySummary and starts counting the logged errors.
+
+        :param interval_seconds: Minimum number of seconds between two summary lines. 0 disables them.
+        :param logger: The logger the summaries are written to. Defaults to the root logger.
+        """
+        self.interval_seconds = interval_seconds
+        self.logger = logger or logging.getLogger()
+        self.records_by_topic = {}
+        self.total_records = 0
+        self.reported_errors = 0
+        self.interval_start = time.monotonic()
+        self.lock = threading.Lock()
+        self.error_counter = ErrorCountingHandler()
+        logging.getLogger().addHandler(self.error_counter)
+
+    def record_received(self, topic_name, count=1):
+        """Counts records received from a topic."""
+        with self.lock:
+            self.records_by_topic[topic_name] = self.records_by_topic.get(topic_name, 0) + count
+
+    def maybe_log_summary(self):
+        """Logs the summary line if the interval has elapsed since the previous one."""
+        if self.interval_seconds > 0 and time.monotonic() - self.interval_start >= self.interval_seconds:
+            self.log_summary()
+
+    def log_summary(self):
+        """Logs the summary line of the current interval and starts a new one."""
+        with self.lock:
+            now = time.monotonic()
+            elapsed = max(now - self.interval_start, 1e-9)
+            records_by_topic, self.records_by_topic = self.records_by_topic, {}
+            errors = self.error_counter.errors - self.reported_errors
+            self.reported_errors = self.error_counter.errors
+            self.interval_start = now
+
+        records_count = sum(records_by_topic.values())
+        self.total_records += records_count
+        self.logger.info(
+            f"Consumed {records_count} records in {elapsed:.1f}s ({records_count / elapsed:.1f} records/s, {self.total_records} in total) "
+            f"by topic {records_by_topic}. {errors} errors logged."
+        )
+
+    def close(self):
+        """Logs the last summary line and stops counting the logged errors."""
+        self.log_summary()
+        logging.getLogger().removeHandler(self.error_counter)
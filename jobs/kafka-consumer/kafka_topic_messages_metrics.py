@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LatencyHistogram:
+    """
+    A latency histogram with fixed cumulative buckets, as exposed by Prometheus.
+    Observing a value is a binary search and two additions, so it can stay on the hot path.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket holding it. None is returned when it falls past the last
+        bucket, whose upper bound is infinite and has no JSON representation.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return upper_bound
+        return None
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+class ConsumerMetrics:
+    """
+    The counters, stage latency histograms and partition lags of the Kafka consumer.
+
+    Counters and histograms are labelled by topic, and histograms also by stage:
+    'poll', 'decode', 'lookup', 'write', 'commit', 'process' (one message) and 'batch' (the messages of a topic in a batch).
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lags = {}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    def increment(self, name, topic_name, value=1):
+        """Adds a value to the counter of a topic."""
+        with self.lock:
+            self.counters[(name, topic_name)] = self.counters.get((name, topic_name), 0) + value
+
+    def observe(self, stage, topic_name, seconds):
+        """Records the latency of a stage for a topic."""
+        with self.lock:
+            histogram = self.histograms.get((stage, topic_name))
+            if histogram is None:
+                histogram = self.histograms[(stage, topic_name)] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage, topic_name):
+        """Times the enclosed block as a stage of a topic, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, topic_name, time.perf_counter() - start)
+
+    def set_lag(self, topic_name, partition, lag):
+        """Records the number of records of a topic-partition that remain to be consumed."""
+        with self.lock:
+            self.lags[(topic_name, partition)] = lag
+
+    def snapshot(self):
+        """Returns every metric as a JSON serializable dictionary."""
+        with self.lock:
+            counters = {}
+            for (name, topic_name), value in sorted(self.counters.items()):
+                counters.setdefault(name, {})[topic_name] = value
+            histograms = {}
+            for (stage, topic_name), histogram in sorted(self.histograms.items()):
+                histograms.setdefault(stage, {})[topic_name] = histogram.snapshot()
+            lags = {}
+            for (topic_name, partition), lag in sorted(self.lags.items()):
+                lags.setdefault(topic_name, {})[str(partition)] = lag
+
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'counters': counters,
+            'latency_seconds': histograms,
+            'lag': lags,
+        }
+
+    def render_prometheus(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f"# TYPE kafka_consumer_{name} counter")
+                for (counter_name, topic_name), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f'kafka_consumer_{name}{{topic="{topic_name}"}} {value}')
+
+            lines.append("# TYPE kafka_consumer_stage_latency_seconds histogram")
+            for (stage, topic_name), histogram in sorted(self.histograms.items()):
+                labels = f'stage="{stage}",topic="{topic_name}"'
+                cumulative = 0
+                for upper_bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'kafka_consumer_stage_latency_seconds_bucket{{{labels},le="{upper_bound}"}} {cumulative}')
+                lines.append(f'kafka_consumer_stage_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'kafka_consumer_stage_latency_seconds_sum{{{labels}}} {histogram.total}')
+                lines.append(f'kafka_consumer_stage_latency_seconds_count{{{labels}}} {histogram.count}')
+
+            lines.append("# TYPE kafka_consumer_lag gauge")
+            for (topic_name, partition), lag in sorted(self.lags.items()):
+                lines.append(f'kafka_consumer_lag{{topic="{topic_name}",partition="{partition}"}} {lag}')
+        return '\n'.join(lines) + '\n'
+
+consumer_metrics = ConsumerMetrics()
+
+class MeteredOdsManager:
+    """
+    Wraps a DataWarehouseManager, or an OdsBatchWriter, to time its lookups and writes as the stages of a topic.
+    Any other attribute is delegated to the wrapped manager.
+    """
+
+    def __init__(self, ods_manager, topic_name, metrics=consumer_metrics):
+        self.ods_manager = ods_manager
+        self.topic_name = topic_name
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.ods_manager, name)
+
+    def execute_query(self, query, *args, **kwargs):
+        with self.metrics.time('lookup', self.topic_name):
+            return self.ods_manager.execute_query(query, *args, **kwargs)
+
+    def metered_write(self, write, table_name, column_names, records, *args, **kwargs):
+        self.metrics.increment('ods_rows_written_total', self.topic_name, len(records))
+        with self.metrics.time('write', self.topic_name):
+            return write(table_name, column_names, records, *args, **kwargs)
+
+    def generate_and_execute_massive_insert(self, table_name, column_names, records, *args, **kwargs):
+        return self.metered_write(self.ods_manager.generate_and_execute_massive_insert, table_name, column_names, records, *args, **kwargs)
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records, *args, **kwargs):
+        return self.metered_write(self.ods_manager.generate_and_execute_massive_upsert, table_name, column_names, records, *args, **kwargs)
+
+    def generate_and_execute_massive_delete(self, table_name, key_columns, keys, *args, **kwargs):
+        return self.metered_write(self.ods_manager.generate_and_execute_massive_delete, table_name, key_columns, keys, *args, **kwargs)
+
+def start_metrics_server(port, host='127.0.0.1', metrics=consumer_metrics):
+    """
+    Serves the metrics in the Prometheus text format on http://<host>:<port>/metrics and as JSON on /metrics.json,
+    from a daemon thread. The server is unauthenticated, so it only listens on the loopback interface by default.
+
+    :return: The running ThreadingHTTPServer.
+    """
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = metrics.render_prometheus().encode(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = json.dumps(metrics.snapshot(), allow_nan=False).encode(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving the consumer metrics on http://{host}:{port}/metrics")
+    return server
+
+class MetricsSnapshotWriter:
+    """Periodically writes a JSON snapshot of the metrics into a file, from a daemon thread."""
+
+    def __init__(self, file_path, interval_seconds=15, metrics=consumer_metrics):
+        """
+        Initializes the MetricsSnapshotWriter.
+
+        :param file_path: The JSON file the snapshot is written to. It is replaced atomically.
+        :param interval_seconds: Number of seconds between two snapshots.
+        """
+        self.file_path = file_path
+        self.interval_seconds = interval_seconds
+        self.metrics = metrics
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='metrics-snapshot-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval_seconds):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        """Writes the current snapshot into the file."""
+        try:
+            temporary_path = f"{self.file_path}.tmp"
+            with open(temporary_path, 'w') as snapshot_file:
+                json.dump(self.metrics.snapshot(), snapshot_file, indent=2, allow_nan=False)
+            os.replace(temporary_path, self.file_path)
+        except Exception as e:
+            logging.error(f"Failed to write the metrics snapshot into {self.file_path}: {e}")
+
+    def stop(self):
+        """Stops the writer after a last snapshot."""
+        self.stopped.set()
+        self.write_snapshot()
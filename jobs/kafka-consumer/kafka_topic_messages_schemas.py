@@ -0,0 +1,168 @@
+import json
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def parse_bool(value):
+    """Parses a boolean flag sent either as a JSON boolean, a number or a string."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1')
+    return bool(value)
+
+def parse_datetime(value):
+    """
+    Parses an ISO 8601 datetime string, e.g. '2023-12-09T14:51:40.024Z', or an epoch timestamp in seconds.
+    The time zone designator is dropped without conversion, as SQL Server does when casting the string to datetime2.
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+
+    value = value.strip().replace(' ', 'T', 1)
+    for designator in ('Z', '+', '-'):
+        position = value.rfind(designator)
+        if position > 10:
+            value = value[:position]
+            break
+    if '.' in value:
+        value, fraction = value.split('.', 1)
+        value = f"{value}.{fraction[:6].ljust(6, '0')}"
+    return datetime.fromisoformat(value)
+
+def parse_datetime_string(value):
+    """
+    Validates an ISO 8601 datetime, and keeps the string as the producer sent it, e.g. '2023-12-09T14:51:40.024Z',
+    so that SQL Server casts it exactly as it casts the raw payload value. A timestamp decoded from msgpack is formatted in ISO 8601.
+    """
+    parsed = parse_datetime(value)
+    return value if isinstance(value, str) else parsed.isoformat()
+
+def parse_date(value):
+    """Parses an ISO 8601 date or datetime string into a date."""
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return parse_datetime(value).date()
+
+def parse_int_list(value):
+    return [int(item) for item in value]
+
+def parse_float_list(value):
+    return [float(item) for item in value]
+
+class PartInformationMessage(NamedTuple):
+    id: int
+    isDeleted: bool
+    timeToProduce: Optional[float]
+    lastUpdate: Optional[datetime]
+
+    parsers = {'id': int, 'isDeleted': parse_bool, 'timeToProduce': float, 'lastUpdate': parse_datetime}
+    required = ('id', 'isDeleted')
+
+class MachineMessage(NamedTuple):
+    id: int
+    isDeleted: bool
+    lastUpdate: Optional[datetime]
+
+    parsers = {'id': int, 'isDeleted': parse_bool, 'lastUpdate': parse_datetime}
+    required = ('id', 'isDeleted')
+
+class MaterialMessage(NamedTuple):
+    id: int
+    isDeleted: bool
+    name: Optional[str]
+    lastUpdate: Optional[datetime]
+
+    parsers = {'id': int, 'isDeleted': parse_bool, 'name': str, 'lastUpdate': parse_datetime}
+    required = ('id', 'isDeleted')
+
+class SupplyChainMessage(NamedTuple):
+    id: str
+    machineId: int
+    partId: int
+    timeOfProduction: str
+    isDeleted: bool
+    var5: Optional[bool]
+    lastUpdate: Optional[datetime]
+
+    parsers = {'id': str, 'machineId': int, 'partId': int, 'timeOfProduction': parse_datetime_string, 'isDeleted': parse_bool, 'var5': parse_bool, 'lastUpdate': parse_datetime}
+    required = ('id', 'machineId', 'partId', 'timeOfProduction', 'isDeleted')
+
+class ContractMessage(NamedTuple):
+    contract_number: int
+    isDeleted: bool
+    parts: List[int]
+    cash: List[float]
+    client_name: Optional[str]
+    date: Optional[date]
+    lastUpdate: Optional[datetime]
+
+    parsers = {'contract_number': int, 'isDeleted': parse_bool, 'parts': parse_int_list, 'cash': parse_float_list, 'client_name': str, 'date': parse_date, 'lastUpdate': parse_datetime}
+    required = ('contract_number', 'isDeleted')
+
+TOPIC_MESSAGE_SCHEMAS = {
+    'part_information': PartInformationMessage,
+    'machine': MachineMessage,
+    'material': MaterialMessage,
+    'supply_chain': SupplyChainMessage,
+    'sales': ContractMessage,
+}
+
+MESSAGE_FIELD_DEFAULTS = {'parts': [], 'cash': []}
+# The producers send the deletion flag as 'isDelete'.
+MESSAGE_FIELD_ALIASES = {'isDeleted': ('isDelete',)}
+
+def build_topic_message(schema, payload):
+    """
+    Builds the typed record of a topic from a decoded payload, parsing and validating every field once.
+    A field missing from the payload is read from its alias, e.g. 'isDelete' for 'isDeleted'.
+    Missing optional fields are set to None, and a missing required field raises a ValueError.
+    """
+    values = []
+    for field in schema._fields:
+        value = payload.get(field)
+        for alias in MESSAGE_FIELD_ALIASES.get(field, ()):
+            if value is None:
+                value = payload.get(alias)
+        if value is None:
+            if field in schema.required:
+                raise ValueError(f"The {schema.__name__} is missing the required field '{field}'.")
+            values.append(MESSAGE_FIELD_DEFAULTS.get(field))
+        else:
+            values.append(schema.parsers[field](value))
+    return schema._make(values)
+
+def decode_payload(raw_value, encoding='auto'):
+    """
+    Decodes the raw bytes of a Kafka message with the fastest decoder available.
+
+    :param encoding: 'json', 'msgpack' or 'auto'. In 'auto' mode, a payload starting with '{' is decoded as JSON
+                     and any other payload as msgpack, so both encodings can share a topic.
+    """
+    if encoding == 'auto':
+        encoding = 'json' if raw_value.lstrip()[:1] == b'{' else 'msgpack'
+
+    if encoding == 'msgpack':
+        if msgpack is None:
+            raise ImportError("The msgpack package is required to decode msgpack encoded messages.")
+        return msgpack.unpackb(raw_value, raw=False, timestamp=3)
+    return json_loads(raw_value)
+
+def decode_topic_message(topic_name, raw_value, encoding='auto'):
+    """
+    Decodes a Kafka message straight into the compact typed record of its topic.
+    Messages of a topic without schema are returned as the decoded payload.
+    """
+    payload = decode_payload(raw_value, encoding)
+    schema = TOPIC_MESSAGE_SCHEMAS.get(topic_name)
+    return build_topic_message(schema, payload) if schema else payload
@@ -1,27 +1,39 @@
-def append_kafka_message_to_tuples(message, tuple_lists):
-    """
-    Parses a Kafka message and appends its data to each tuple in a list of tuples.
-    """
-    message_values = tuple(message.values())
-    return [tuple(tup) + message_values for tup in tuple_lists]
-
-def filter_kafka_message_fields_to_push(message, fields_to_push):
-    """
-    Reconstructs a dictionary including only the selected keys.
-    """
-    return {
-            k: message[k] 
-            for k in fields_to_push if k in message
-        }
+from kafka_topic_messages_key_cache import ods_key_caches
 
 def get_max_id_incremented(ods_manager, id, table_name):
     return ods_manager.execute_query(f"""SELECT MAX({id}) + 1 FROM [ODS_PRODUCTION].[dbo].[{table_name}]""")
 
-def get_ods_table_id(ods_manager, id, id_param, table_name):
+def get_ods_table_id(ods_manager, id, id_param, table_name, allocate=True):
+    """
+    Resolves the ODS surrogate id of a transactional id. When the dimension table has a preloaded key cache,
+    the id is served from it and a new key gets an id from the local allocator instead of querying the ODS.
+
+    The ODS is queried outside of the cache lock, and a new key is handed to the cache with put, which defers it
+    until the write is committed when called inside an ods_key_cache_scope.
+
+    :param allocate: Whether a key missing from the dimension table gets a new surrogate id. The fact records only
+                     reference the dimension rows without inserting them, so their lookups pass False and a missing
+                     key resolves to a null id.
+    """
     query = f"""SELECT {id} FROM [ODS_PRODUCTION].[dbo].[{table_name}] WHERE trsc{id[0].upper()}{id[1:]} = ?"""
+    key_cache = ods_key_caches.get(table_name)
+    if key_cache:
+        surrogate_id = key_cache.get(id_param)
+        if surrogate_id is None and not key_cache.complete:
+            dim_table_record_fetched = ods_manager.execute_query(query, id_param)
+            surrogate_id = dim_table_record_fetched[0][0] if dim_table_record_fetched else None
+        if surrogate_id is None and allocate:
+            surrogate_id = key_cache.allocate_id()
+        if surrogate_id is not None:
+            key_cache.put(id_param, surrogate_id)
+        return [(surrogate_id,)]
+
     dim_table_record_fetched = ods_manager.execute_query(query, id_param)
-    return dim_table_record_fetched if len(dim_table_record_fetched) > 0 else get_max_id_incremented(ods_manager, id, table_name)
+    if dim_table_record_fetched:
+        return dim_table_record_fetched
+    return get_max_id_incremented(ods_manager, id, table_name) if allocate else [(None,)]
 
 def delete_ods_table_records(ods_manager, id, id_param, table_name):
-    query = f"""DELETE FROM [ODS_PRODUCTION].[dbo].[{table_name}] WHERE trsc{id[0].upper()}{id[1:]} = ?"""
-    return ods_manager.execute_query(query, id_param)
\ No newline at end of file
+    if table_name in ods_key_caches:
+        ods_key_caches[table_name].remove(id_param)
+    return ods_manager.generate_and_execute_massive_delete(table_name, [f"trsc{id[0].upper()}{id[1:]}"], [(id_param,)])
\ No newline at end of file
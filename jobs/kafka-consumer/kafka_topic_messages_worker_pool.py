@@ -0,0 +1,226 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from kafka_process_data_schema_topics_messages import execute_ruling_topic_processor
+from kafka_topic_messages_key_cache import ods_key_cache_scope
+
+TOPIC_BUSINESS_KEYS = {
+    'part_information': lambda message: ('part', message.id),
+    'supply_chain': lambda message: ('part', message.partId),
+    'machine': lambda message: ('machine', message.id),
+    'material': lambda message: ('material', message.id),
+    'sales': lambda message: ('contract', message.contract_number),
+}
+
+def get_dispatch_key(record, message, dispatch_mode):
+    """
+    Returns the key deciding which worker processes a Kafka record.
+
+    In 'partition' mode, every record of a topic-partition goes to the same worker.
+    In 'business' mode, records sharing a business key go to the same worker, e.g. a part_information message
+    and the supply_chain messages of that part. Records without a recognized key fall back to their partition.
+    """
+    if dispatch_mode == 'business' and record.topic in TOPIC_BUSINESS_KEYS:
+        try:
+            return TOPIC_BUSINESS_KEYS[record.topic](message)
+        except AttributeError:
+            pass
+    return (record.topic, record.partition)
+
+class PartitionOffsetTracker:
+    """
+    Tracks the in-flight offsets of every topic-partition so that an offset is only committed
+    once every earlier record of its partition has been processed.
+
+    A record that failed to be processed stops its partition: the committable offset never moves past it,
+    and the later records of the partition are dropped until the consumer seeks back to it, see forget.
+
+    Every record is dispatched in the current epoch of its partition, which forget bumps. The records of an earlier
+    epoch still queued for a worker, e.g. dropped after a failure or revoked, are stale: they are neither processed
+    nor allowed to complete the offset of a record dispatched again in the new epoch.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.committable = {}
+        self.failed_offsets = {}
+        self.epochs = {}
+        self.lock = threading.Lock()
+
+    def dispatched(self, topic_partition, offset):
+        """Registers a record handed to a worker, and returns the epoch of its partition it is dispatched in."""
+        with self.lock:
+            self.in_flight.setdefault(topic_partition, OrderedDict())[offset] = False
+            return self.epochs.get(topic_partition, 0)
+
+    def completed(self, topic_partition, offset, epoch):
+        """
+        Marks a record as processed and advances the committable offset of its partition.
+        A record of a forgotten partition or of an earlier epoch, e.g. revoked before it was processed, is ignored.
+        """
+        with self.lock:
+            offsets = self.in_flight.get(topic_partition)
+            if offsets is None or offset not in offsets or epoch != self.epochs.get(topic_partition, 0):
+                return
+            offsets[offset] = True
+            while offsets and next(iter(offsets.values())):
+                done_offset, _ = offsets.popitem(last=False)
+                self.committable[topic_partition] = done_offset + 1
+
+    def failed(self, topic_partition, offset, epoch):
+        """
+        Marks a record as failed. Its partition keeps the earliest failed offset and the time of the failure,
+        and its in-flight offsets from the failed one on are dropped, since they are consumed again on retry.
+        A record of an earlier epoch is ignored.
+        """
+        with self.lock:
+            if epoch != self.epochs.get(topic_partition, 0):
+                return
+            failed_offset, failed_at = self.failed_offsets.get(topic_partition, (offset, time.monotonic()))
+            self.failed_offsets[topic_partition] = (min(offset, failed_offset), failed_at)
+            offsets = self.in_flight.get(topic_partition, {})
+            for in_flight_offset in [in_flight_offset for in_flight_offset in offsets if in_flight_offset >= offset]:
+                del offsets[in_flight_offset]
+
+    def is_stale(self, topic_partition, offset, epoch):
+        """Tells whether a queued record was dispatched in an earlier epoch, or comes at or after the failed record of its partition."""
+        with self.lock:
+            failed_offset = self.failed_offsets.get(topic_partition)
+            return epoch != self.epochs.get(topic_partition, 0) or (failed_offset is not None and offset >= failed_offset[0])
+
+    def is_failed(self, topic_partition, offset):
+        """Tells whether a record comes at or after the failed record of its partition, and mustn't be processed."""
+        with self.lock:
+            failed_offset = self.failed_offsets.get(topic_partition)
+            return failed_offset is not None and offset >= failed_offset[0]
+
+    def get_failed(self):
+        """Returns the failed partitions, mapped to their failed offset and the monotonic time of the failure."""
+        with self.lock:
+            return dict(self.failed_offsets)
+
+    def pop_committable(self):
+        """Returns and forgets the offsets that can be committed since the last call."""
+        with self.lock:
+            committable, self.committable = self.committable, {}
+            return committable
+
+    def pending_count(self, topic_partitions=None):
+        """Returns the number of records dispatched but not yet processed, of some topic-partitions or of all of them."""
+        with self.lock:
+            return sum(len(offsets) for topic_partition, offsets in self.in_flight.items()
+                       if topic_partitions is None or topic_partition in topic_partitions)
+
+    def forget(self, topic_partitions):
+        """
+        Drops the in-flight, committable and failed offsets of topic-partitions, e.g. revoked by a rebalance,
+        or retried from their failed offset, and starts a new epoch of each one so that their queued records are stale.
+        """
+        with self.lock:
+            for topic_partition in topic_partitions:
+                self.in_flight.pop(topic_partition, None)
+                self.committable.pop(topic_partition, None)
+                self.failed_offsets.pop(topic_partition, None)
+                self.epochs[topic_partition] = self.epochs.get(topic_partition, 0) + 1
+
+class TopicMessageWorkerPool:
+    """
+    A pool of worker threads processing Kafka records concurrently, each over its own ODS connection.
+
+    Every worker owns a FIFO queue and records are routed to a worker by hashing their dispatch key,
+    so the records sharing a key are processed in arrival order.
+    """
+
+    def __init__(self, ods_pool, workers, dispatch_mode='partition', queue_size=1000):
+        """
+        Initializes the TopicMessageWorkerPool and starts its workers.
+
+        :param ods_pool: The DataWarehouseManagerPool the workers borrow their connection from.
+        :param workers: Number of worker threads.
+        :param dispatch_mode: Either 'partition' or 'business'. See get_dispatch_key.
+        :param queue_size: Maximum number of records queued per worker before dispatching blocks. See has_room.
+        """
+        self.ods_pool = ods_pool
+        self.dispatch_mode = dispatch_mode
+        self.offset_tracker = PartitionOffsetTracker()
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self.run_worker, args=(worker_queue,), name=f"ods-worker-{idx}", daemon=True)
+            for idx, worker_queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def dispatch(self, topic_partition, record, message):
+        """
+        Routes a record and its decoded message to the worker owning its dispatch key.
+        A record of a failed partition polled before the partition was paused is dropped, since it is consumed again on retry.
+        """
+        if self.offset_tracker.is_failed(topic_partition, record.offset):
+            return
+        worker_queue = self.queues[hash(get_dispatch_key(record, message, self.dispatch_mode)) % len(self.queues)]
+        epoch = self.offset_tracker.dispatched(topic_partition, record.offset)
+        worker_queue.put((topic_partition, record, message, epoch))
+
+    def has_room(self, records_count):
+        """
+        Tells whether every worker queue can take a number of records without blocking, so that the consumer only
+        polls the records it can dispatch at once, and pauses its partitions otherwise rather than blocking past
+        the max.poll.interval.ms of its group.
+        """
+        return all(worker_queue.maxsize - worker_queue.qsize() >= records_count for worker_queue in self.queues)
+
+    def drain(self, topic_partitions, timeout):
+        """
+        Waits until the dispatched records of topic-partitions are processed.
+
+        :return: True if they were all processed within the timeout in seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while self.offset_tracker.pending_count(topic_partitions):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def skip(self, topic_partition, record):
+        """Registers a record that won't be processed, e.g. an undecodable one, so its offset can be committed."""
+        if self.offset_tracker.is_failed(topic_partition, record.offset):
+            return
+        epoch = self.offset_tracker.dispatched(topic_partition, record.offset)
+        self.offset_tracker.completed(topic_partition, record.offset, epoch)
+
+    def run_worker(self, worker_queue):
+        """
+        Processes the records of a worker queue until it receives the stop sentinel.
+
+        Each record is written in its own transaction and only marked completed once committed. A failed record
+        is marked failed instead, so that its offset isn't committed, and the later records of its partition are dropped.
+        The stale records, see PartitionOffsetTracker, are skipped.
+        """
+        with self.ods_pool.connection() as ods_manager:
+            while True:
+                item = worker_queue.get()
+                if item is None:
+                    break
+
+                topic_partition, record, message, epoch = item
+                if self.offset_tracker.is_stale(topic_partition, record.offset, epoch):
+                    continue
+                try:
+                    with ods_key_cache_scope(), ods_manager.transaction():
+                        execute_ruling_topic_processor(ods_manager, record.topic, message)
+                except Exception as e:
+                    logging.error(f"An error occurred while processing the record at offset {record.offset} of {topic_partition}. The partition is retried from that offset: {e}")
+                    self.offset_tracker.failed(topic_partition, record.offset, epoch)
+                else:
+                    self.offset_tracker.completed(topic_partition, record.offset, epoch)
+
+    def close(self):
+        """Lets the workers drain their queues, then stops them."""
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        for thread in self.threads:
+            thread.join()
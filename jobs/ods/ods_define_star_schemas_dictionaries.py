@@ -1,92 +1,76 @@
-import os
 from dotenv import load_dotenv
+try:
+    from ods_schema_registry import get_queries_ddl
+except ImportError:
+    from .ods_schema_registry import get_queries_ddl
 load_dotenv('../../.env')
 
-dim_queries_ddl = {
-    'part_information': {
-        'fields': {
-            **({'trscPartId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-            'partId': 'INT',
-            'timeToProduce': 'FLOAT',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'id': 'partId' if 'DWH' in os.getenv('DB_NAME').upper() else {}
+def __getattr__(name):
+    """
+    Builds the dim_queries_ddl and fact_queries_ddl dictionaries from the schema registry on access, for the
+    layer of the DB_NAME database, so that importing this module doesn't require the environment variables.
+    """
+    if name == 'dim_queries_ddl':
+        return get_queries_ddl('dim')
+    if name == 'fact_queries_ddl':
+        return get_queries_ddl('fact')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+ods_merge_keys = {
+    'fact_supply_chain': ['trscUnitId', 'materialId'],
+}
+
+# The Kafka consumer writes into every ODS table but dim_time, always with their 'trsc' columns set. The populate job
+# only replaces the rows of its former snapshot, whose 'trsc' columns are null, through 'delete_where', and overwrites dim_time.
+ods_export_profiles = {
+    'default': {
+        'mode': 'append',
+        'batchsize': 10000,
+        'numPartitions': 4,
+        'isolationLevel': 'READ_UNCOMMITTED',
+        'bulk_copy': True,
+        'tableLock': False,
+    },
+    'dim_material': {
+        'delete_where': 'trscMaterialId IS NULL',
+    },
+    'dim_part_information': {
+        'delete_where': 'trscPartId IS NULL',
     },
-    'material': {
-        'fields': {
-            **({'trscMaterialId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),            
-            'materialId': 'INT',
-            'name': 'VARCHAR(255)',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'id': 'materialId' if 'DWH' in os.getenv('DB_NAME').upper() else {}
-    },        
-    'contract': {
-        'fields': {
-            **({'trscContractId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),            
-            'contractId': 'INT',
-            'clientName': 'VARCHAR(255)',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'id': 'contractId' if 'DWH' in os.getenv('DB_NAME').upper() else {}
+    'dim_machine': {
+        'delete_where': 'trscMachineId IS NULL',
     },
-    'machine': {
-        'fields': {
-            **({'trscMachineId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),            
-            'machineId': 'INT',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'id': 'machineId' if 'DWH' in os.getenv('DB_NAME').upper() else {}
+    'dim_contract': {
+        'delete_where': 'trscContractId IS NULL',
+    },
+    'dim_time': {
+        'mode': 'overwrite',
+        'truncate': True,
+        'batchsize': 20000,
+        'numPartitions': 1,
+        'tableLock': True,
+    },
+    'fact_sales': {
+        'delete_where': 'trscContractId IS NULL',
+        'batchsize': 20000,
+        'numPartitions': 4,
+    },
+    'fact_supply_chain': {
+        'delete_where': 'trscMachineId IS NULL',
+        'batchsize': 50000,
+        'numPartitions': 8,
+        'isolationLevel': 'NONE',
     },
-    'time': {
-        'fields': {
-            'timeId': 'INT',
-            'date': 'DATE',
-            'year': 'SMALLINT',
-            'month': 'TINYINT',
-            'day': 'TINYINT',
-            'semester': 'TINYINT',
-            'quarter': 'TINYINT',
-        },
-        'id': 'timeId' if 'DWH' in os.getenv('DB_NAME').upper() else {}
-    }            
 }
 
-fact_queries_ddl = {
-    'supply_chain': {    
-        'fields': {
-            **({'trscMachineId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-            **({'trscPartId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),            
-            **({'trscMaterialId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),                        
-            'machineId': 'INT',
-            'partId': 'INT',
-            'materialId': 'INT',
-            'timeOfProduction': 'DATE',
-            'materialPrice': 'FLOAT',
-            'timeId': 'INT',
-            'materialPriceDate': 'DATE',
-            'partDefaultPrice': 'FLOAT',
-            'isDamaged': 'BIT',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'cluster': {
-            'pk': ['machineId', 'partId', 'unitId', 'materialId' ,'materialPriceId',],
-            'constraint': 'PK_FACT_SUPPLY_CHAIN_INTEGRITY'
-        } if 'DWH' in os.getenv('DB_NAME').upper() else {}
+dwh_export_profiles = {
+    'default': {
+        'mode': 'overwrite',
+        'truncate': True,
+        'batchsize': 50000,
+        'numPartitions': 8,
+        'isolationLevel': 'NONE',
+        'bulk_copy': True,
+        'tableLock': True,
     },
-   'sales': {    
-        'fields': {
-            **({'trscPartId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),            
-            **({'trscContractId': 'INT DEFAULT NULL'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),                        
-            'partId': 'INT',
-            'contractId': 'INT',
-            'cash': 'FLOAT',
-            'date': 'DATE',
-            **({'lastUpdate': 'datetime2(7)'} if 'ODS' in os.getenv('DB_NAME').upper() else {}),
-        },
-        'cluster': {
-            'pk': ['partId', 'clientId',],
-            'constraint': 'PK_FACT_SALES_INTEGRITY'
-        } if 'DWH' in os.getenv('DB_NAME').upper() else {}
-    },
-}
\ No newline at end of file
+}
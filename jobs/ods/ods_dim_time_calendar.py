@@ -0,0 +1,80 @@
+import os
+import logging
+from datetime import date, timedelta
+from pyspark.sql import functions as F
+from pyspark.sql.types import IntegerType
+
+CALENDAR_START_DATE = date(1920, 1, 1)
+CALENDAR_END_DATE = date(2099, 12, 31)
+
+DIM_TIME_COLUMNS = ["timeId", "date", "year", "month", "day", "semester", "quarter"]
+
+def get_time_id_col(date_col):
+    """
+    Returns the 'YYYYMMDD' integer timeId of a date or timestamp column, e.g. 19200101 for January 1, 1920,
+    computed arithmetically rather than by concatenating strings.
+    """
+    return (F.year(date_col) * 10000 + F.month(date_col) * 100 + F.dayofmonth(date_col)).cast(IntegerType())
+
+def build_dim_time_df(spark, start_date, end_date):
+    """
+    Generates one row per day between two dates included, with its timeId, year, month, day, semester and quarter.
+    """
+    dates_df = spark.sql(f"SELECT explode(sequence(DATE'{start_date.isoformat()}', DATE'{end_date.isoformat()}', INTERVAL 1 DAY)) AS date")
+    return dates_df.withColumn("timeId", get_time_id_col(F.col("date"))) \
+                   .withColumn("year", F.year("date")) \
+                   .withColumn("month", F.month("date")) \
+                   .withColumn("day", F.dayofmonth("date")) \
+                   .withColumn("quarter", F.quarter("date")) \
+                   .withColumn("semester", F.when(F.col("quarter") <= 2, 1).otherwise(2)) \
+                   .select(*DIM_TIME_COLUMNS)
+
+def load_dim_time_calendar(spark, calendar_path, start_date=CALENDAR_START_DATE, end_date=CALENDAR_END_DATE):
+    """
+    Loads the daily dim_time calendar persisted as Parquet, generating it on the first run.
+
+    When the requested range grows beyond the persisted one, only the missing days are generated
+    and appended to the Parquet calendar, so the calendar is never rebuilt from scratch.
+
+    :param spark: The Spark session.
+    :param calendar_path: The Parquet directory holding the calendar.
+    :param start_date: The first day the calendar must cover.
+    :param end_date: The last day the calendar must cover.
+    :return: The dim_time DataFrame covering at least the requested range.
+    """
+    if not os.path.exists(calendar_path):
+        logging.info(f"Generating the dim_time calendar from {start_date} to {end_date} into {calendar_path}.")
+        build_dim_time_df(spark, start_date, end_date).coalesce(1).write.mode('overwrite').parquet(calendar_path)
+        return spark.read.parquet(calendar_path)
+
+    calendar_df = spark.read.parquet(calendar_path)
+    first_date, last_date = calendar_df.agg(F.min("date"), F.max("date")).first()
+
+    missing_ranges = []
+    if first_date is None:
+        missing_ranges.append((start_date, end_date))
+    else:
+        if start_date < first_date:
+            missing_ranges.append((start_date, first_date - timedelta(days=1)))
+        if end_date > last_date:
+            missing_ranges.append((last_date + timedelta(days=1), end_date))
+
+    for missing_start, missing_end in missing_ranges:
+        logging.info(f"Extending the dim_time calendar from {missing_start} to {missing_end}.")
+        build_dim_time_df(spark, missing_start, missing_end).coalesce(1).write.mode('append').parquet(calendar_path)
+
+    return spark.read.parquet(calendar_path) if missing_ranges else calendar_df
+
+def lookup_time_id(df, dim_time_df, date_col, time_id_col="timeId"):
+    """
+    Adds the timeId of a date column by joining the broadcast dim_time calendar, rather than
+    recomputing it row by row. Dates outside of the calendar get a null timeId.
+
+    :param df: The DataFrame to enrich.
+    :param dim_time_df: The dim_time calendar DataFrame.
+    :param date_col: The name of the date or timestamp column of `df`.
+    :param time_id_col: The name of the added timeId column.
+    """
+    calendar_df = F.broadcast(dim_time_df.select(F.col("date").alias("calendarDate"), F.col("timeId").alias(time_id_col)))
+    return df.join(calendar_df, F.to_date(df[date_col]) == calendar_df["calendarDate"], 'left') \
+             .drop("calendarDate")
@@ -0,0 +1,157 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse, parse
+from ods_parquet_conversion_utils import hash_file
+
+SPREADSHEET_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIPS_NAMESPACE = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_RELATIONSHIPS_NAMESPACE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def get_sheet_xml_path(workbook_zip, sheet_name=None):
+    """Returns the path inside the workbook archive of the XML part of a sheet, the first sheet when `sheet_name` is None."""
+    sheets = parse(workbook_zip.open('xl/workbook.xml')).getroot().find(f"{SPREADSHEET_NAMESPACE}sheets")
+    relationships = parse(workbook_zip.open('xl/_rels/workbook.xml.rels')).getroot()
+    targets = {relationship.get('Id'): relationship.get('Target') for relationship in relationships.iter(f"{PACKAGE_RELATIONSHIPS_NAMESPACE}Relationship")}
+
+    for sheet in sheets:
+        if sheet_name is None or sheet.get('name') == sheet_name:
+            target = targets[sheet.get(f"{RELATIONSHIPS_NAMESPACE}id")]
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise ValueError(f"The workbook has no {sheet_name} sheet.")
+
+def load_shared_strings(workbook_zip):
+    """Returns the shared strings table of a workbook, read with a streaming parser."""
+    if 'xl/sharedStrings.xml' not in workbook_zip.namelist():
+        return []
+
+    shared_strings = []
+    for _, element in iterparse(workbook_zip.open('xl/sharedStrings.xml')):
+        if element.tag == f"{SPREADSHEET_NAMESPACE}si":
+            shared_strings.append(''.join(text.text or '' for text in element.iter(f"{SPREADSHEET_NAMESPACE}t")))
+            element.clear()
+    return shared_strings
+
+def get_column_index(cell_reference):
+    """Returns the zero-based column index of a cell reference, e.g. 27 for 'AB12'."""
+    index = 0
+    for character in cell_reference:
+        if not character.isalpha():
+            break
+        index = index * 26 + ord(character.upper()) - ord('A') + 1
+    return index - 1
+
+def get_cell_value(cell, shared_strings):
+    """
+    Returns the Python value of a sheet cell. Numbers holding an integer value are returned as int, and the date cells,
+    stored by Excel as numbers, as their serial number.
+    """
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f"{SPREADSHEET_NAMESPACE}t"))
+
+    value = cell.find(f"{SPREADSHEET_NAMESPACE}v")
+    if value is None or value.text is None or cell_type == 'e':
+        return None
+    if cell_type == 's':
+        return shared_strings[int(value.text)]
+    if cell_type == 'b':
+        return value.text == '1'
+    if cell_type == 'n':
+        number = float(value.text)
+        return int(number) if number.is_integer() else number
+    return value.text
+
+def iter_sheet_rows(file_path, sheet_name=None):
+    """
+    Yields the rows of a workbook sheet as lists of values, reading the sheet XML with a streaming parser
+    so that only one row at a time is held in memory. The missing cells of a row are None.
+    """
+    with zipfile.ZipFile(file_path) as workbook_zip:
+        shared_strings = load_shared_strings(workbook_zip)
+        for _, element in iterparse(workbook_zip.open(get_sheet_xml_path(workbook_zip, sheet_name))):
+            if element.tag != f"{SPREADSHEET_NAMESPACE}row":
+                continue
+            row = []
+            for position, cell in enumerate(element.iter(f"{SPREADSHEET_NAMESPACE}c")):
+                column_index = get_column_index(cell.get('r')) if cell.get('r') else position
+                row.extend([None] * (column_index - len(row)))
+                row.append(get_cell_value(cell, shared_strings))
+            element.clear()
+            yield row
+
+def get_staging_key(file_path, sheet_name=None, schema=None):
+    """
+    Returns the key of the staged Parquet copy of a sheet: the content hash of the workbook, combined with the sheet
+    name and the schema it is read with, so that a changed workbook or schema is staged again.
+    """
+    digest = hashlib.sha256(hash_file(file_path).encode())
+    digest.update(str(sheet_name).encode())
+    digest.update((schema.json() if schema is not None else '').encode())
+    return digest.hexdigest()[:32]
+
+def stage_excel_sheet(spark, file_path, staging_path, sheet_name=None, schema=None):
+    """
+    Converts a workbook sheet to Parquet once, and returns the path of the staged Parquet copy.
+
+    The copies are stored under the staging path, in a directory named after the workbook and sheet and keyed by the workbook
+    content hash, so that a later run finds the copy of an unchanged workbook and reads it directly. The copies of the former
+    versions of the workbook are removed. The sheet is streamed into a JSON Lines file, read back by Spark with the
+    explicit `schema` when given, and with an inferred one in the sheet column order otherwise.
+
+    :param spark: The Spark session.
+    :param file_path: The path of the workbook.
+    :param staging_path: The directory holding the staged Parquet copies.
+    :param sheet_name: The sheet to stage, the first one when None.
+    :param schema: The StructType of the sheet columns, None to infer it.
+    :return: The path of the staged Parquet copy, or None if the sheet is empty.
+    """
+    workbook_name = os.path.splitext(os.path.basename(file_path))[0]
+    workbook_staging_path = os.path.join(staging_path, workbook_name, sheet_name or '_first_sheet')
+    staging_key = get_staging_key(file_path, sheet_name, schema)
+    parquet_path = os.path.join(workbook_staging_path, staging_key)
+
+    if os.path.exists(os.path.join(parquet_path, '_SUCCESS')):
+        logging.info(f"Reading the staged Parquet copy of the {workbook_name} workbook, unchanged since it was staged.")
+        return parquet_path
+
+    os.makedirs(workbook_staging_path, exist_ok=True)
+    json_lines_path = os.path.join(workbook_staging_path, f"{staging_key}.jsonl")
+    row_count = 0
+    try:
+        rows = iter_sheet_rows(file_path, sheet_name)
+        header = next(rows, None)
+        if not header:
+            logging.warning(f"The {workbook_name} workbook sheet is empty, nothing to stage.")
+            return None
+
+        column_names = [str(name) if name is not None else f"_c{index}" for index, name in enumerate(header)]
+        with open(json_lines_path, 'w') as json_lines_file:
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                json_lines_file.write(json.dumps(dict(zip(column_names, row))) + '\n')
+                row_count += 1
+
+        if not row_count and schema is None:
+            logging.warning(f"The {workbook_name} workbook sheet has no rows, nothing to stage.")
+            return None
+
+        if schema is not None:
+            df = spark.read.schema(schema).json(json_lines_path)
+        else:
+            df = spark.read.json(json_lines_path).select(*column_names)
+        df.write.mode('overwrite').parquet(parquet_path)
+        logging.info(f"Staged {row_count} rows of the {workbook_name} workbook as Parquet into {parquet_path}.")
+    finally:
+        if os.path.exists(json_lines_path):
+            os.remove(json_lines_path)
+
+    for entry in os.listdir(workbook_staging_path):
+        if entry != staging_key:
+            shutil.rmtree(os.path.join(workbook_staging_path, entry), ignore_errors=True)
+    return parquet_path
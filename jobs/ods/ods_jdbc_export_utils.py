@@ -0,0 +1,227 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MSSQL_SPARK_CONNECTOR = "com.microsoft.sqlserver.jdbc.spark"
+MSSQL_JDBC_DRIVER = "com.microsoft.sqlserver.jdbc.SQLServerDriver"
+
+def get_jdbc_url(server, database, username, password, bulk_copy=False):
+    """
+    Builds the SQL Server JDBC URL. With `bulk_copy`, the driver turns the batched INSERT statements
+    into bulk copy operations (useBulkCopyForBatchInsert, available from mssql-jdbc 9.2).
+    """
+    jdbc_url = (
+        f"jdbc:sqlserver://{server}:1433;"
+        f"databaseName={database};"
+        f"user={username};"
+        f"password={password};"
+    )
+    if bulk_copy:
+        jdbc_url += "useBulkCopyForBatchInsert=true;"
+    return jdbc_url
+
+def get_export_profile(table_name, export_profiles):
+    """Returns the export profile of a table, merged over the default profile."""
+    return {**export_profiles.get('default', {}), **export_profiles.get(table_name, {})}
+
+def is_spark_connector_available(spark):
+    """Tells whether the Apache Spark connector for SQL Server, and its bulk copy write path, is on the classpath."""
+    try:
+        spark._jvm.java.lang.Class.forName(f"{MSSQL_SPARK_CONNECTOR}.DefaultSource")
+        return True
+    except Exception:
+        return False
+
+def count_table_rows(spark, jdbc_url, table_name):
+    """
+    Returns the number of rows of a SQL Server table from its partition statistics, without scanning it.
+    None is returned if the statistics can't be read.
+    """
+    try:
+        query = (
+            f"SELECT CAST(COALESCE(SUM(row_count), 0) AS BIGINT) AS row_count FROM sys.dm_db_partition_stats "
+            f"WHERE object_id = OBJECT_ID('dbo.{table_name}') AND index_id IN (0, 1)"
+        )
+        return spark.read.format("jdbc") \
+                    .option("url", jdbc_url) \
+                    .option("driver", MSSQL_JDBC_DRIVER) \
+                    .option("query", query) \
+                    .load() \
+                    .first()[0]
+    except Exception as e:
+        logging.warning(f"Unable to count the rows of the {table_name} table: {e}")
+        return None
+
+def replace_table_rows(spark, jdbc_url, table_name, staging_table_name, column_names, condition):
+    """
+    Replaces the rows of a SQL Server table matching a condition by the rows of its staging table, in one transaction
+    of a JDBC connection of the driver JVM: the readers see either the former rows or the new ones, and a failed
+    insert rolls the delete back.
+
+    :return: The number of rows deleted and the number of rows inserted.
+    """
+    columns = ', '.join(f"[{column_name}]" for column_name in column_names)
+    connection = spark._jvm.java.sql.DriverManager.getConnection(jdbc_url)
+    try:
+        connection.setAutoCommit(False)
+        statement = connection.createStatement()
+        try:
+            rows_deleted = statement.executeUpdate(f"DELETE FROM {table_name} WHERE {condition}")
+            rows_inserted = statement.executeUpdate(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_table_name}")
+            connection.commit()
+            return rows_deleted, rows_inserted
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            statement.close()
+    finally:
+        connection.close()
+
+def drop_table(spark, jdbc_url, table_name):
+    """Drops a SQL Server table if it exists, through a JDBC connection of the driver JVM."""
+    try:
+        connection = spark._jvm.java.sql.DriverManager.getConnection(jdbc_url)
+        try:
+            statement = connection.createStatement()
+            try:
+                statement.executeUpdate(f"DROP TABLE IF EXISTS {table_name}")
+            finally:
+                statement.close()
+        finally:
+            connection.close()
+    except Exception as e:
+        logging.warning(f"Unable to drop the {table_name} table: {e}")
+
+def get_dataframe_writer(df, jdbc_url, table_name, mode, profile, use_spark_connector):
+    """Builds the writer of a DataFrame into a SQL Server table, tuned by the export profile of the table."""
+    if use_spark_connector and profile.get('numPartitions'):
+        df = df.coalesce(profile['numPartitions'])
+
+    writer = df.write \
+               .format(MSSQL_SPARK_CONNECTOR if use_spark_connector else "jdbc") \
+               .mode(mode) \
+               .option("url", jdbc_url) \
+               .option("dbtable", table_name) \
+               .option("driver", MSSQL_JDBC_DRIVER)
+    for option in ('batchsize', 'numPartitions', 'isolationLevel', 'truncate'):
+        if option in profile:
+            writer = writer.option(option, profile[option])
+    if use_spark_connector:
+        writer = writer.option("tableLock", str(profile.get('tableLock', False)).lower())
+    return writer
+
+def export_data_into_ods_table(df, server, database, username, password, table_name, profile=None, use_spark_connector=False):
+    """
+    Inserts records from a DataFrame into a ODS table persisted in a SQL Server database.
+
+    The write is tuned by the export profile of the table: the write mode, the JDBC batch size, the number of partitions
+    written concurrently, the transaction isolation level, whether an overwrite truncates the table rather than
+    dropping it, and the bulk copy path. With 'delete_where', the DataFrame is written into a staging table first, then
+    the rows of the table matching that condition are replaced by the staged rows in one transaction, so that the rows
+    written by the Kafka consumer are kept and a failed export leaves the former rows in place. Bulk copy goes through
+    the Apache Spark connector for SQL Server when `use_spark_connector` is set, and through the bulk copy mode of the
+    JDBC driver otherwise.
+
+    :param profile: The export profile of the table, see `ods_export_profiles`. The Spark defaults apply when None.
+    :return: A report with the number of rows written, the duration and the rows/s, or None if the write failed.
+    """
+    profile = profile or {}
+    staging_table_name = f"{table_name}_staging"
+    jdbc_url = None
+    try:
+        jdbc_url = get_jdbc_url(server, database, username, password, profile.get('bulk_copy', False) and not use_spark_connector)
+
+        if profile.get('delete_where'):
+            writer = get_dataframe_writer(df, jdbc_url, staging_table_name, 'overwrite', {**profile, 'truncate': False}, use_spark_connector)
+            start = time.perf_counter()
+            writer.save()
+            rows_deleted, rows_written = replace_table_rows(df.sparkSession, jdbc_url, table_name, staging_table_name, df.columns, profile['delete_where'])
+            duration = time.perf_counter() - start
+            logging.info(f"{rows_deleted} rows matching {profile['delete_where']} replaced in the ODS {table_name} table.")
+        else:
+            rows_before = count_table_rows(df.sparkSession, jdbc_url, table_name)
+            writer = get_dataframe_writer(df, jdbc_url, table_name, profile.get('mode', 'errorifexists'), profile, use_spark_connector)
+            start = time.perf_counter()
+            writer.save()
+            duration = time.perf_counter() - start
+
+            rows_after = count_table_rows(df.sparkSession, jdbc_url, table_name)
+            if profile.get('mode') == 'overwrite':
+                rows_written = rows_after
+            else:
+                rows_written = rows_after - rows_before if rows_before is not None and rows_after is not None else None
+        report = {
+            'table': table_name,
+            'rows': rows_written,
+            'seconds': round(duration, 3),
+            'rows_per_second': round(rows_written / duration, 1) if rows_written is not None and duration else None,
+        }
+        logging.info(f"Data inserted into the ODS {table_name} table successfully: {rows_written} rows in {duration:.1f}s ({report['rows_per_second']} rows/s).")
+        return report
+
+    except Exception as e:
+        logging.error(f"An error occurred while inserting {table_name} data into SQL Server: {e}")
+        return None
+
+    finally:
+        if profile.get('delete_where') and jdbc_url:
+            drop_table(df.sparkSession, jdbc_url, staging_table_name)
+
+class OdsExportEngine:
+    """
+    Writes several DataFrames into their ODS tables concurrently, each one from its own driver thread
+    and in its own FAIR scheduler pool, so that the small dimension tables don't queue behind the fact tables.
+    """
+
+    def __init__(self, spark, server, database, username, password, export_profiles, max_workers=4):
+        """
+        Initializes the OdsExportEngine.
+
+        :param spark: The Spark session, created with spark.scheduler.mode set to FAIR.
+        :param export_profiles: Dictionary mapping a table name, or 'default', to its export profile.
+        :param max_workers: Maximum number of tables written at the same time.
+        """
+        self.spark = spark
+        self.server = server
+        self.database = database
+        self.username = username
+        self.password = password
+        self.export_profiles = export_profiles
+        self.max_workers = max_workers
+        self.use_spark_connector = is_spark_connector_available(spark)
+        logging.info(f"Exporting the ODS tables through the {'Spark connector for SQL Server' if self.use_spark_connector else 'JDBC data source'}.")
+
+    def export_table(self, df, table_name, on_written=None):
+        """Writes a DataFrame into its table from the FAIR scheduler pool of that table."""
+        self.spark.sparkContext.setLocalProperty("spark.scheduler.pool", table_name)
+        try:
+            report = export_data_into_ods_table(
+                df, self.server, self.database, self.username, self.password, table_name,
+                get_export_profile(table_name, self.export_profiles), self.use_spark_connector
+            )
+        finally:
+            self.spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+        if on_written:
+            on_written(table_name)
+        return report
+
+    def export_tables(self, target_dfs, on_written=None):
+        """
+        Writes the DataFrames into their tables concurrently and logs the rows/s of each table.
+
+        :param target_dfs: Dictionary mapping each table name to its DataFrame. The tables must be independent,
+                           as the ODS tables are since they carry no foreign keys.
+        :param on_written: Optional callback receiving the name of each table once written.
+        :return: Dictionary mapping each table name to its export report, None for a failed export.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ods-export') as executor:
+            futures = {table_name: executor.submit(self.export_table, df, table_name, on_written) for table_name, df in target_dfs.items()}
+            reports = {table_name: future.result() for table_name, future in futures.items()}
+
+        for table_name, report in reports.items():
+            if report:
+                logging.info(f"Export of {table_name}: {report['rows']} rows in {report['seconds']}s, {report['rows_per_second']} rows/s.")
+            else:
+                logging.error(f"Export of {table_name} failed.")
+        return reports
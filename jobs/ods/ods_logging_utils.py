@@ -0,0 +1,51 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOGS_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs'))
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+log_listener = None
+
+def configure_logging(log_file_name, level=logging.INFO, asynchronous=False, log_format=LOG_FORMAT):
+    """
+    Configures the root logger of a job to write into the logs folder and the console.
+
+    Only the entry point of a job calls it, so that importing a module never reconfigures the root logger.
+    Calling it again once the root logger is configured has no effect.
+
+    :param log_file_name: The name of the log file, e.g. 'kafka_consume_topics_messages.log'.
+    :param level: The level of the root logger, either a logging constant or its name.
+    :param asynchronous: If True, the records are put on a queue by a QueueHandler and written by a QueueListener
+                         background thread, so that the logging threads never wait on the file or console I/O.
+    :param log_format: The format of the written records.
+    """
+    global log_listener
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        return
+
+    formatter = logging.Formatter(log_format)
+    handlers = [logging.FileHandler(os.path.join(LOGS_DIRECTORY, log_file_name)), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if asynchronous:
+        log_queue = queue.SimpleQueue()
+        log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(stop_logging)
+        handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    for handler in handlers:
+        root_logger.addHandler(handler)
+    root_logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+def stop_logging():
+    """Writes the records still queued and stops the background writer of the asynchronous mode."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
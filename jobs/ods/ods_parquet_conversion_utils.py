@@ -0,0 +1,195 @@
+import os
+import json
+import math
+import shutil
+import hashlib
+import logging
+from pyspark.sql.types import StructType
+
+MANIFEST_FILE_NAME = "_manifest.json"
+DEFAULT_TARGET_FILE_SIZE = 128 * 1024 * 1024
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of the content of a file, read by chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_directory_size(path):
+    """Returns the total size in bytes of the Parquet data files under a directory."""
+    total_size = 0
+    for root, _, file_names in os.walk(path):
+        total_size += sum(os.path.getsize(os.path.join(root, file_name)) for file_name in file_names if file_name.endswith('.parquet'))
+    return total_size
+
+def load_manifest(manifest_path):
+    """
+    Loads the conversion manifest, mapping each converted CSV file name to its path, size, mtime, content hash
+    and Parquet output. An empty manifest is returned on the first run or if the manifest is unreadable.
+    """
+    if not os.path.exists(manifest_path):
+        return {'schema': None, 'files': {}}
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Unable to read the conversion manifest {manifest_path}, every CSV file will be converted: {e}")
+        return {'schema': None, 'files': {}}
+
+def save_manifest(manifest_path, manifest):
+    """Writes the conversion manifest atomically, so that an interrupted run never leaves it half written."""
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+def is_file_changed(file_path, entry):
+    """
+    Tells whether a CSV file differs from its manifest entry. The size and mtime are compared first, the content
+    hash only when they differ, so that a file merely touched or copied again isn't converted again.
+
+    :return: A tuple of the changed flag and the up to date manifest fields of the file.
+    """
+    stat = os.stat(file_path)
+    fields = {'path': os.path.abspath(file_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return False, {**fields, 'hash': entry['hash']}
+
+    content_hash = hash_file(file_path)
+    return not entry or entry['hash'] != content_hash, {**fields, 'hash': content_hash}
+
+def infer_csv_schema(spark, file_path, delimiter=",", header=True, sampling_ratio=1.0):
+    """
+    Infers the schema of CSV files, from every one of their rows by default: the inferred schema is kept for the following
+    files, so a type inferred from a sample, e.g. an integer column whose decimals are further down, would mangle them.
+
+    :param file_path: A CSV file, or a list of them.
+    """
+    return spark.read.format("csv") \
+                .option("inferSchema", True) \
+                .option("samplingRatio", sampling_ratio) \
+                .option("header", header) \
+                .option("sep", delimiter) \
+                .load(file_path) \
+                .schema
+
+def write_csv_to_parquet(spark, file_path, output_file_path, schema, delimiter=",", header=True, partitionBy=None):
+    """Converts a CSV file read with an explicit schema to Parquet, failing on the first row that doesn't fit the schema."""
+    df = spark.read.format("csv") \
+            .schema(schema) \
+            .option("header", header) \
+            .option("sep", delimiter) \
+            .option("mode", "FAILFAST") \
+            .load(file_path)
+
+    writer = df.write.mode('overwrite')
+    if partitionBy:
+        writer = writer.partitionBy(partitionBy)
+    writer.parquet(output_file_path)
+
+def convert_csv_to_parquet(spark, input_path, output_path, delimiter=",", header=True, schema=None, partitionBy=None):
+    """
+    Converts the new or changed CSV files of the input path to Parquet, each one into its own directory of the output path.
+
+    The files already converted are tracked in a manifest stored in the output path with their size, mtime and content hash,
+    so that the unchanged ones are skipped. The Parquet output of a CSV file removed from the input path is removed as well.
+    The CSV files are read with an explicit schema instead of inferring it, which would scan every file twice: the given one,
+    or else the one inferred from the first converted file and kept in the manifest for the following runs. The rows are read
+    in FAILFAST mode rather than nulling the values that don't fit the schema. When a file doesn't fit the inferred schema,
+    it is inferred again from every CSV file, and all of them are converted again if it changed.
+
+    :param spark: The Spark session.
+    :param schema: The StructType of the CSV files, None to infer it once.
+    :return: The list of the CSV file names converted or removed by this run, or None if the input path doesn't exist.
+    """
+    if not os.path.exists(input_path):
+        logging.error(f"Input path {input_path} does not exist.")
+        return None
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    manifest_path = os.path.join(output_path, MANIFEST_FILE_NAME)
+    manifest = load_manifest(manifest_path)
+    given_schema = schema
+    if schema is None and manifest.get('schema'):
+        schema = StructType.fromJson(manifest['schema'])
+
+    csv_file_names = sorted(file_name for file_name in os.listdir(input_path) if file_name.endswith(".csv"))
+    converted_file_names = []
+
+    for file_name in set(manifest['files']) - set(csv_file_names):
+        logging.info(f"The {file_name} CSV file was removed, removing its Parquet output.")
+        shutil.rmtree(manifest['files'].pop(file_name)['output'], ignore_errors=True)
+        converted_file_names.append(file_name)
+
+    for file_name in csv_file_names:
+        file_path = os.path.join(input_path, file_name)
+        try:
+            changed, fields = is_file_changed(file_path, manifest['files'].get(file_name))
+            output_file_path = os.path.join(output_path, file_name.replace('.csv', ''))
+            if not changed and os.path.exists(output_file_path):
+                manifest['files'][file_name].update(fields)
+                logging.debug(f"The {file_name} CSV file is unchanged, skipping its conversion.")
+                continue
+
+            logging.info(f"Starting to convert {file_name} CSV file to Parquet format.")
+            if schema is None:
+                schema = infer_csv_schema(spark, file_path, delimiter, header)
+                manifest['schema'] = json.loads(schema.json())
+
+            try:
+                write_csv_to_parquet(spark, file_path, output_file_path, schema, delimiter, header, partitionBy)
+            except Exception as e:
+                if given_schema is not None:
+                    raise
+                inferred_schema = infer_csv_schema(spark, [os.path.join(input_path, csv_file_name) for csv_file_name in csv_file_names], delimiter, header)
+                if inferred_schema == schema:
+                    raise
+                logging.warning(f"The {file_name} CSV file doesn't fit the inferred schema, converting every CSV file again with the schema "
+                                f"inferred from all of them: {e}")
+                save_manifest(manifest_path, {'schema': json.loads(inferred_schema.json()), 'files': {}})
+                return sorted(set(converted_file_names) | set(convert_csv_to_parquet(spark, input_path, output_path, delimiter, header, None, partitionBy)))
+
+            manifest['files'][file_name] = {**fields, 'output': os.path.abspath(output_file_path)}
+            converted_file_names.append(file_name)
+            logging.info(f"Converted {file_name} to Parquet format successfully.")
+        except Exception as e:
+            logging.error(f"Failed to convert {file_name}: {e}")
+
+    save_manifest(manifest_path, manifest)
+    logging.info(f"{len(converted_file_names)} CSV files converted or removed, {len(csv_file_names)} CSV files in {input_path}.")
+    return converted_file_names
+
+def compact_parquet_files(spark, input_path, output_file, target_file_size=DEFAULT_TARGET_FILE_SIZE, force=False):
+    """
+    Compacts the Parquet outputs listed in the conversion manifest of the input path into files of about the target size,
+    rather than into a single file written by a single task, so that the downstream reads stay parallel.
+
+    :param spark: The Spark session.
+    :param input_path: The output path of `convert_csv_to_parquet`, holding the manifest.
+    :param output_file: The directory of the compacted Parquet files.
+    :param target_file_size: The targeted size in bytes of each compacted file.
+    :param force: Compacts even if the compacted output already exists, e.g. when `convert_csv_to_parquet` converted new files.
+    """
+    if os.path.exists(output_file) and not force:
+        logging.info(f"The compacted Parquet files of {output_file} are up to date, skipping the compaction.")
+        return
+
+    converted_paths = [entry['output'] for entry in load_manifest(os.path.join(input_path, MANIFEST_FILE_NAME))['files'].values()]
+    if not converted_paths:
+        logging.warning(f"No converted Parquet files to compact in {input_path}.")
+        return
+
+    total_size = sum(get_directory_size(path) for path in converted_paths)
+    file_count = max(1, math.ceil(total_size / target_file_size))
+
+    df = spark.read.format("parquet").load(converted_paths)
+    if file_count < df.rdd.getNumPartitions():
+        df = df.coalesce(file_count)
+    else:
+        df = df.repartition(file_count)
+
+    df.write.mode('overwrite').format("parquet").save(output_file)
+    logging.info(f"Compacted {total_size / 1024 / 1024:.1f} MB of parquet files into {file_count} files of {output_file}")
@@ -1,12 +1,24 @@
 from pyspark.sql import SparkSession
 from pyspark.sql import functions as F
-from pyspark.sql.functions import udf, from_json, explode, col, to_date, count, monotonically_increasing_id, regexp_replace, lit, date_format, year, sum as sum_, max as max_, expr, month, dayofmonth, quarter
+from pyspark.sql.functions import udf, from_json, explode, col, to_date, count, monotonically_increasing_id, regexp_replace, lit, date_format, year, sum as sum_, max as max_, expr, month, quarter
 from pyspark.sql.types import ArrayType, StructType, StructField, StringType, DoubleType, DateType, ShortType, LongType, IntegerType, TimestampType
 import os
+import sys
 import logging
 from py4j.protocol import Py4JJavaError
 from dotenv import load_dotenv
-from ods_prototype_udf_utils import parse_date, string_to_int_list, convert_timestamp_to_date, generate_random_date, get_current_datetime
+from ods_logging_utils import configure_logging
+from ods_dim_time_calendar import load_dim_time_calendar, lookup_time_id, get_time_id_col
+from ods_spark_join_utils import DEFAULT_BROADCAST_THRESHOLD, broadcast_if_small, log_join_plan, bucket_by_key
+from ods_spark_persistence_utils import DataFramePersistenceManager, get_storage_level
+from ods_spark_stage_runner import SparkStageRunner
+from ods_jdbc_export_utils import OdsExportEngine
+from ods_parquet_conversion_utils import convert_csv_to_parquet, compact_parquet_files
+from ods_schema_registry import get_spark_schema
+from ods_excel_staging_utils import stage_excel_sheet
+from ods_define_star_schemas_dictionaries import ods_export_profiles
+from ods_prototype_udf_utils import string_to_int_list, convert_timestamp_to_date, generate_random_date, \
+                                    string_to_int_list_expr, convert_timestamp_to_date_expr, generate_random_date_expr, get_current_datetime_lit
 
 def create_spark_session():
     """
@@ -21,54 +33,13 @@ def create_spark_session():
                 .config("spark.driver.memory", "2g") \
                 .config("spark.sql.shuffle.partitions", "50") \
                 .config("spark.executor.cores", "4") \
+                .config("spark.scheduler.mode", "FAIR") \
                 .getOrCreate()
         logging.info("Spark session created successfully.")
         return spark
     except Exception as e:
         logging.error(f'An unexpected error occurred while initializing the Spark Session: {e}')
 
-def convert_csv_to_parquet(input_path, output_path, delimiter=",", header=True, inferSchema=True, partitionBy=None):
-    """
-    Convert all CSV files in the specified input path to Parquet format with various options and save them to the output path.
-    """
-    if not os.path.exists(input_path):
-        logging.error(f"Input path {input_path} does not exist.")
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-
-    for file_name in os.listdir(input_path):
-        if file_name.endswith(".csv"):
-            try:
-                logging.info(f"Starting to convert {file_name} CSV file to Parquet format.")
-                
-                file_path = os.path.join(input_path, file_name)
-                df = spark.read.format("csv") \
-                        .option("inferSchema", inferSchema) \
-                        .option("header", header) \
-                        .option("sep", delimiter) \
-                        .load(file_path)
-                
-                output_file_path = os.path.join(output_path, file_name.replace('.csv', ''))
-                if partitionBy:
-                    df.write.mode('overwrite').partitionBy(partitionBy).parquet(output_file_path)
-                else:
-                    df.write.mode('overwrite').parquet(output_file_path)
-                logging.info(f"Converted {file_name} to Parquet format successfully.")
-            except Exception as e:
-                logging.error(f"Failed to convert {file_name}: {e}")
-
-def concatenate_parquet_files(input_path, output_file):
-    """
-    Read all Parquet files in the specified input path and concatenate them into a single DataFrame,
-    then save it to the specified output file in Parquet format.
-    """
-    df = spark.read.format("parquet").load(input_path + "/*")
-    df_single_partition = df.repartition(1)
-
-    df_single_partition.write.mode('overwrite').format("parquet").save(output_file)
-    logging.info(f"Concatenated parquet files into {output_file}")
-
-
 def read_parquet_with_spark(file_path, file_name):
     """
     Reads a Parquet file into a Spark DataFrame.
@@ -83,16 +54,32 @@ def read_parquet_with_spark(file_path, file_name):
         logging.error(f"An unexpected error occurred while reading the {file_name} Parquet file from {file_path}: {e}")
         return None
 
-def read_excel_with_spark(file_path, file_name, sheet_name=None):
+def read_excel_with_spark(file_path, file_name, sheet_name=None, schema=None, staging_path=None):
     """
     Reads an Excel file into a Spark DataFrame.
+    The columns are read with the explicit `schema` StructType when given, and inferred otherwise.
+
+    When `staging_path` is set, the sheet is read from its Parquet copy staged there, which is only converted again
+    when the workbook changes, rather than parsed by the Excel connector on every run.
     """
     try:
         logging.info(f"Starting to read the {file_name} Excel file.")
+
+        if staging_path:
+            parquet_path = stage_excel_sheet(spark, file_path, staging_path, sheet_name, schema)
+            if parquet_path is None:
+                logging.warning(f"The {file_name} Excel file is empty. Skipping file processing.")
+                return None
+            df = spark.read.parquet(parquet_path)
+            logging.info(f"Successfully read the {file_name} Excel file into a Spark DataFrame.")
+            return df
         
         read_excel_query = spark.read.format("com.crealytics.spark.excel") \
-            .option("header", "true") \
-            .option("inferSchema", "true")
+            .option("header", "true")
+        if schema is not None:
+            read_excel_query = read_excel_query.schema(schema)
+        else:
+            read_excel_query = read_excel_query.option("inferSchema", "true")
         
         if sheet_name:
             read_excel_query = read_excel_query.option("dataAddress", f"{sheet_name}!")
@@ -112,38 +99,61 @@ def read_excel_with_spark(file_path, file_name, sheet_name=None):
         logging.error(f"An unexpected error occurred while reading the {file_name} Excel file: {e}")
         return None
 
-def populate_fact_supply_chain_table(fact_supply_chain_df, part_df, material_price_df, machine_df):
+def populate_fact_supply_chain_table(fact_supply_chain_df, part_df, material_price_df, machine_df, use_python_udfs=False, dim_time_df=None,
+                                     broadcast_threshold=DEFAULT_BROADCAST_THRESHOLD, bucket_count=None):
     """
     Transforms and populates the fact_supply_chain_table with data from multiple source DataFrames.
     Applies necessary transformations and joins to create a final DataFrame with the required schema.
+    The timestamps are converted with a native Spark expression unless `use_python_udfs` is set.
+    The timeId is looked up in the broadcast `dim_time_df` calendar when given, computed from the date otherwise.
+
+    The join plan keeps the fact side from being shuffled: the production and price years are materialised as
+    'productionYear' and 'priceYear' columns so that the material price join is a plain equi-join, and the part,
+    material price and machine DataFrames are broadcast when their estimated size is under `broadcast_threshold` bytes.
+    When `bucket_count` is set, the fact DataFrame is first bucketed and sorted by partId. The plan of each join is logged.
     """
     try:
         logging.info("Starting to transform DataFrame for fact_supply_chain table.")
-        convert_timestamp_to_date_udf = udf(convert_timestamp_to_date, TimestampType())
+        convert_timestamp_to_date_col = udf(convert_timestamp_to_date, TimestampType()) if use_python_udfs else convert_timestamp_to_date_expr
         
-        fact_supply_chain_df = fact_supply_chain_df.withColumn("timeOfProduction", convert_timestamp_to_date_udf(col("timeOfProduction"))) \
-                                                .withColumn("timeOfProduction", date_format("timeOfProduction", "yyyy-MM-dd")) \
-                                                .withColumn("timeId", expr("concat(year(timeOfProduction), lpad(month(timeOfProduction), 2, '0'), lpad(day(timeOfProduction), 2, '0'))").cast("int"))
+        fact_supply_chain_df = fact_supply_chain_df.withColumn("timeOfProduction", convert_timestamp_to_date_col(col("timeOfProduction"))) \
+                                                .withColumn("timeOfProduction", date_format("timeOfProduction", "yyyy-MM-dd"))
+        if dim_time_df is not None:
+            fact_supply_chain_df = lookup_time_id(fact_supply_chain_df, dim_time_df, "timeOfProduction")
+        else:
+            fact_supply_chain_df = fact_supply_chain_df.withColumn("timeId", get_time_id_col(col("timeOfProduction")))
+        fact_supply_chain_df = fact_supply_chain_df.withColumn("productionYear", year(col("timeOfProduction")))
 
+        if bucket_count:
+            fact_supply_chain_df = bucket_by_key(fact_supply_chain_df, "fact_supply_chain_bucketed", "partId", bucket_count)
+
+        part_info_df = broadcast_if_small(part_df.select('partId', 'materialId', 'machineId', 'defaultPrice'), 'part_info', broadcast_threshold)
         fact_supply_chain_df = fact_supply_chain_df.alias('fact').join(
-            part_df.select('partId', 'materialId', 'machineId', 'defaultPrice').alias('part_info'),
+            part_info_df.alias('part_info'),
             (col('fact.partId') == col('part_info.partId')) &
             (col('fact.machineId') == col('part_info.machineId')),
             'inner'
         )
-        
+        log_join_plan(fact_supply_chain_df, 'fact_supply_chain x part_info')
+
+        material_price_year_df = material_price_df.select('id', 'materialId', 'date', 'price') \
+                                                  .withColumn('priceYear', year(col('date')))
+        material_price_year_df = broadcast_if_small(material_price_year_df, 'material_price', broadcast_threshold)
         fact_supply_chain_df = fact_supply_chain_df.join(
-            material_price_df.select('id', 'materialId', 'date', 'price').alias('material_price'),
-            (col('part_info.materialId') == col('material_price.materialId')) & 
-            (year(col('material_price.date')) == year(col('fact.timeOfProduction'))),
+            material_price_year_df.alias('material_price'),
+            (col('part_info.materialId') == col('material_price.materialId')) &
+            (col('material_price.priceYear') == col('fact.productionYear')),
             'inner'
         )
+        log_join_plan(fact_supply_chain_df, 'fact_supply_chain x material_price')
 
+        machine_id_df = broadcast_if_small(machine_df.select('machineId'), 'machine', broadcast_threshold)
         fact_supply_chain_df = fact_supply_chain_df.join(
-            machine_df.select('machineId').alias('machine'),
+            machine_id_df.alias('machine'),
             col('fact.machineId') == col('machine.machineId'),
             'inner'
         )
+        log_join_plan(fact_supply_chain_df, 'fact_supply_chain x machine')
 
         output_df = fact_supply_chain_df.select(
             F.col('machine.machineId'),
@@ -183,11 +193,9 @@ def populate_dim_material_price_table(material_df, price_col='prices', date_form
         transformed_material_df = material_df.withColumn(price_col, from_json(col(price_col), dim_schema)) \
                                              .withColumn("exploded", explode(col(price_col)))
         
-        parse_date_udf = udf(parse_date, DateType())
-        
         final_df = transformed_material_df.withColumn("price", col("exploded.price")) \
                                          .withColumn("date", to_date(col("exploded.d"), date_format)) \
-                                         .withColumn("lastUpdate", current_datetime_udf()) \
+                                         .withColumn("lastUpdate", current_datetime_col) \
                                          .select(
                                              monotonically_increasing_id().alias("id"),
                                              "name",
@@ -203,18 +211,19 @@ def populate_dim_material_price_table(material_df, price_col='prices', date_form
     except Exception as e:
         logging.error("An error occurred while transforming the DataFrame for dim_material_price table: %s", e)
 
-def populate_dim_part_information_table(part_information_df, material_col='meterials', machine_col='machine'):
+def populate_dim_part_information_table(part_information_df, material_col='meterials', machine_col='machine', use_python_udfs=False):
     """
     Transforms and enriches the part information DataFrame by exploding the 'machine' and 'meterials' columns.
+    The list columns are parsed with a native Spark expression unless `use_python_udfs` is set.
     """
     try:
         logging.info("Starting to transform DataFrame for dim_part_information table.")
 
-        string_to_int_list_udf = udf(string_to_int_list, ArrayType(IntegerType()))
+        string_to_int_list_col = udf(string_to_int_list, ArrayType(IntegerType())) if use_python_udfs else string_to_int_list_expr
         part_information_df = part_information_df \
             .withColumn(material_col, regexp_replace(col(material_col), "'", "")) \
-            .withColumn(material_col, string_to_int_list_udf(col(material_col))) \
-            .withColumn(machine_col, string_to_int_list_udf(col(machine_col)))
+            .withColumn(material_col, string_to_int_list_col(col(material_col))) \
+            .withColumn(machine_col, string_to_int_list_col(col(machine_col)))
 
         part_information_df = part_information_df \
             .withColumn(material_col, explode(col(material_col))) \
@@ -248,16 +257,22 @@ def populate_dim_machine_table(part_information_df):
     except Exception as e:
         logging.error(f"An error occurred while transforming the DataFrame for dim_machine table: {e}")
 
-def populate_fact_sales_table(supply_chain_df, part_df):
+def populate_fact_sales_table(supply_chain_df, part_df, use_python_udfs=False, seed=42):
     """
     Transforms and prepares a DataFrame for the dim_sales table. This function performs
     several operations including counting quantities of parts, calculating total cash,
     determining the maximum production year, and generating formatted client names.
+    The timestamps and random contract dates are computed with native Spark expressions, the latter from `seed`,
+    unless `use_python_udfs` is set.
     """
     try:
         logging.info("Starting to transform DataFrame for dim_sales table.")
-        random_date_udf = udf(generate_random_date, DateType())
-        convert_timestamp_to_date_udf = udf(convert_timestamp_to_date, TimestampType())
+        if use_python_udfs:
+            random_date_col = udf(generate_random_date, DateType())
+            convert_timestamp_to_date_col = udf(convert_timestamp_to_date, TimestampType())
+        else:
+            random_date_col = lambda year_col: generate_random_date_expr(year_col, seed)
+            convert_timestamp_to_date_col = convert_timestamp_to_date_expr
 
         quantity_df = supply_chain_df.groupBy("order", "partId").agg(count("*").alias("quantity"))
 
@@ -265,15 +280,15 @@ def populate_fact_sales_table(supply_chain_df, part_df):
                              .groupBy("order") \
                              .agg(sum_(col("defaultPrice") * col("quantity")).alias("cash"))
 
-        max_year_df = supply_chain_df.withColumn("timeOfProduction", convert_timestamp_to_date_udf(col("timeOfProduction"))) \
+        max_year_df = supply_chain_df.withColumn("timeOfProduction", convert_timestamp_to_date_col(col("timeOfProduction"))) \
                                     .withColumn("timeOfProduction", date_format("timeOfProduction", "yyyy-MM-dd HH:mm:ss.SSS")) \
                                     .groupBy("order", "partId") \
                                     .agg(max_(year(col("timeOfProduction"))).alias("maxYear"))
 
         sales_df = cost_df.join(max_year_df, "order")
-        sales_df = sales_df.withColumn("date", random_date_udf(col("maxYear")))
+        sales_df = sales_df.withColumn("date", random_date_col(col("maxYear")))
         sales_df = sales_df.withColumn("clientName", F.expr("concat('CLIENT NO_', order)"))
-        sales_df = sales_df.withColumn("lastUpdate",  current_datetime_udf())
+        sales_df = sales_df.withColumn("lastUpdate", current_datetime_col)
         
         final_sales_df = sales_df.select(
             col("order").alias("contractId"),
@@ -291,97 +306,111 @@ def populate_fact_sales_table(supply_chain_df, part_df):
         logging.error(f"An error occurred while transforming the DataFrame for dim_sales table: {e}")
         return None
 
-def populate_dim_time_table():
+def populate_dim_time_table(calendar_path):
     """
-    Generates a 'dim_time' table with IDs ranging from January 1, 1920 to January 1, 2099.
+    Loads the daily 'dim_time' table with IDs ranging from January 1, 1920 to December 31, 2099.
     The ID is formatted as 'YYYYMMDD'. For example, January 1, 1920 would be 19200101.
-    Additional fields for year, month, day, semester, and quarter are derived from the ID.
+    Additional fields for year, month, day, semester, and quarter are derived from the date.
+
+    The calendar is generated once and persisted as Parquet in `calendar_path`, then reused and only
+    extended by the following runs.
     """
     try:
-        logging.info('Starting to initialize DataFrame for dim_time table.')
-        start_date = '1920-01-01'
-        end_date = '2099-01-01'
-        
-        dates_df = spark.range(start=0, end=365*179+44).select(F.expr(f"add_months(date '{start_date}', int(id))").alias('date')).withColumn('date', col('date').cast(DateType()))
-
-        dim_time_df = dates_df.withColumn("year", year(col("date"))) \
-                            .withColumn("month", month(col("date"))) \
-                            .withColumn("day", dayofmonth(col("date"))) \
-                            .withColumn("quarter", quarter(col("date"))) \
-                            .withColumn("semester", expr("CASE WHEN quarter IN (1, 2) THEN 1 ELSE 2 END")) \
-                            .withColumn("timeId", expr("concat(year(date), lpad(month(date), 2, '0'), lpad(day(date), 2, '0'))").cast("int"))
-
-        dim_time_df = dim_time_df.select("timeId", "date", "year", "month", "day", "semester", "quarter")
-        logging.info('Successfully transformer DataFrame for dim_time table.')
+        logging.info('Starting to load DataFrame for dim_time table.')
+        dim_time_df = load_dim_time_calendar(spark, calendar_path)
+        logging.info('Successfully loaded DataFrame for dim_time table.')
         return dim_time_df
     except Exception as e:
-        logging.error(f"An error occurred while transforming the DataFrame for dim_time table: {e}")
-
-def export_data_into_ods_table(df, server, database, username, password, table_name):
+        logging.error(f"An error occurred while loading the DataFrame for dim_time table: {e}")
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+MACHINES_PATH = os.path.join(DATA_PATH, 'machines')
+MACHINES_PARQUET_PATH = os.path.join(DATA_PATH, 'machines_parquet')
+EXCEL_STAGING_PATH = os.path.join(DATA_PATH, 'excel_parquet')
+# The sales.xlsx workbook isn't a source: the fact_sales rows are generated from the supply chain and the parts.
+SOURCE_WORKBOOKS = {
+    'material_df': ('material-data.xlsx', 'Material', 'material'),
+    'part_information_df': ('part-reference.xlsx', 'Part Information', 'part_information'),
+}
+
+def set_job_context(spark_session, current_datetime=None):
     """
-    Inserts records from a DataFrame into a ODS table persisted in a SQL Server database.
+    Sets the Spark session and the 'lastUpdate' literal read by the readers and populate functions of this module,
+    the latter computed once per population so that every row of a run shares it.
     """
-    try:
-        jdbc_url = (
-            f"jdbc:sqlserver://{server}:1433;"
-            f"databaseName={database};"
-            f"user={username};"
-            f"password={password};"
-        )
-
-        df.write \
-          .format("jdbc") \
-          .option("url", jdbc_url) \
-          .option("dbtable", table_name) \
-          .option("driver", "com.microsoft.sqlserver.jdbc.SQLServerDriver") \
-          .save()
-        
-        logging.info(f"Data inserted into the ODS {table_name} table successfully.")
-
-    except Exception as e:
-        logging.error(f"An error occurred while inserting {table_name} data into SQL Server: {e}")
-
-if __name__ == "__main__":
-    log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'ods_populate_tables_star_schema.log'))
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-                    logging.FileHandler(log_file_path),
-                    logging.StreamHandler()
-                ]
-        )
-    
-    load_dotenv('../../.env')
-    server = os.getenv('DB_HOST')
-    database = os.getenv('DB_NAME')
-    username = os.getenv('DB_USER')
-    password = os.getenv('DB_PASSWORD')
-
-    input_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'machines')
-    output_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'machines_parquet')
-    final_output_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'machines_parquet', 'machines_all_parquet')
+    global spark, current_datetime_col
+    spark = spark_session
+    current_datetime_col = current_datetime if current_datetime is not None else get_current_datetime_lit()
 
-    current_datetime_udf = udf(get_current_datetime, StringType())
+def get_files_key(path, file_names=None):
+    """Returns the names, sizes and modification times of the files of a directory, the version of a stage reading them."""
+    if not os.path.isdir(path):
+        return None
+    file_names = sorted(file_names if file_names is not None else os.listdir(path))
+    return [(file_name, os.path.getsize(os.path.join(path, file_name)), os.path.getmtime(os.path.join(path, file_name)))
+            for file_name in file_names if os.path.isfile(os.path.join(path, file_name))]
+
+def stage_convert_machine_files(runner):
+    """Converts the new or changed machine CSV files to Parquet and compacts them."""
+    set_job_context(runner.spark)
+    output_path = MACHINES_PARQUET_PATH
+    converted_file_names = convert_csv_to_parquet(runner.spark, MACHINES_PATH, output_path)
+    target_file_size = int(float(os.getenv('ODS_PARQUET_TARGET_FILE_SIZE_MB', 128)) * 1024 * 1024)
+    compact_parquet_files(runner.spark, output_path, os.path.join(output_path, 'machines_all_parquet'), target_file_size, force=bool(converted_file_names))
+    return {'converted_file_names': converted_file_names}
+
+def stage_load_sources(runner):
+    """
+    Reads the Excel and compacted machine sources, without their 'lastUpdate' column, and caches them
+    so that the following populations of a warm runner don't read them again.
 
-    spark = create_spark_session()
-    convert_csv_to_parquet(input_path, output_path)
-    concatenate_parquet_files(output_path, final_output_path)
+    :raises ValueError: If a source couldn't be read.
+    """
+    set_job_context(runner.spark)
+    storage_level = get_storage_level(os.getenv('ODS_PERSIST_STORAGE_LEVEL', 'MEMORY_AND_DISK_SER'))
+
+    source_dfs = {}
+    for df_name, (file_name, sheet_name, schema_name) in SOURCE_WORKBOOKS.items():
+        source_dfs[df_name] = read_excel_with_spark(os.path.join(DATA_PATH, file_name), sheet_name,
+                                                    schema=get_spark_schema(schema_name), staging_path=EXCEL_STAGING_PATH)
+    source_dfs['supply_chain_df'] = read_parquet_with_spark(os.path.join(MACHINES_PARQUET_PATH, 'machines_all_parquet'), 'Supply Chain')
+
+    missing_sources = [df_name for df_name, df in source_dfs.items() if df is None]
+    if missing_sources:
+        raise ValueError(f"The sources {missing_sources} couldn't be read.")
+    return {df_name: df.persist(storage_level) for df_name, df in source_dfs.items()}
+
+def stage_load_dim_time(runner):
+    """Loads the dim_time calendar, broadcast by the timeId lookups, and caches it."""
+    set_job_context(runner.spark)
+    time_df = populate_dim_time_table(os.path.join(DATA_PATH, 'dim_time_parquet'))
+    if time_df is None:
+        raise ValueError("The dim_time calendar couldn't be loaded.")
+    return {'time_df': time_df.cache()}
+
+def stage_populate_ods_tables(runner):
+    """Transforms the cached sources into the DataFrames of the ODS tables, with the 'lastUpdate' of this population."""
+    set_job_context(runner.spark)
+    material_df = runner.get('load_sources', 'material_df').withColumn("lastUpdate", current_datetime_col)
+    part_information_df = runner.get('load_sources', 'part_information_df').withColumn("lastUpdate", current_datetime_col)
+    supply_chain_df = runner.get('load_sources', 'supply_chain_df').withColumn("lastUpdate", current_datetime_col)
+    time_df = runner.get('load_dim_time', 'time_df')
 
-    material_df = read_excel_with_spark(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'material-data.xlsx') , "Material") \
-                    .withColumn("lastUpdate", current_datetime_udf())
-    part_information_df = read_excel_with_spark(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'part-reference.xlsx'), "Part Information") \
-                            .withColumn("lastUpdate", current_datetime_udf())
-    sales_df = read_excel_with_spark(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'sales.xlsx'), "Sales")
-    supply_chain_df = read_parquet_with_spark(final_output_path, 'Supply Chain').withColumn("lastUpdate", current_datetime_udf())
-    
     material_price_df = populate_dim_material_price_table(material_df)
     part_df = populate_dim_part_information_table(part_information_df)
     machine_df = populate_dim_machine_table(part_df)
     sales_df = populate_fact_sales_table(supply_chain_df, part_df)
-
-    time_df = populate_dim_time_table()
-    supply_chain_df = populate_fact_supply_chain_table(supply_chain_df, part_df, material_price_df, machine_df)
+    intermediate_dfs = {
+        'material_price': material_price_df,
+        'part': part_df,
+        'machine': machine_df,
+        'sales': sales_df,
+    }
+
+    broadcast_threshold = int(float(os.getenv('ODS_BROADCAST_THRESHOLD_MB', 64)) * 1024 * 1024)
+    bucket_count = int(os.getenv('ODS_SUPPLY_CHAIN_BUCKETS')) if os.getenv('ODS_SUPPLY_CHAIN_BUCKETS') else None
+    supply_chain_df = populate_fact_supply_chain_table(supply_chain_df, part_df, material_price_df, machine_df, dim_time_df=time_df,
+                                                       broadcast_threshold=broadcast_threshold, bucket_count=bucket_count)
 
     material_df = material_df.withColumn('id', col('id').cast(ShortType())) \
                             .select(col('id').alias('materialId'), 'name', 'lastUpdate')
@@ -390,11 +419,64 @@ if __name__ == "__main__":
     contract_df = sales_df.select("contractId", "clientName", "lastUpdate").distinct()
     sales_df = sales_df.select('partId', 'contractId', 'cash', 'date', 'lastUpdate')
 
-    try: 
-        target_df = [material_df, part_information_df, machine_df, contract_df, time_df, sales_df, supply_chain_df]
-        target_tables = ['dim_material', 'dim_part_information', 'dim_machine', 'dim_contract', 'dim_time', 'fact_sales', 'fact_supply_chain']
+    target_df = [material_df, part_information_df, machine_df, contract_df, time_df, sales_df, supply_chain_df]
+    target_tables = ['dim_material', 'dim_part_information', 'dim_machine', 'dim_contract', 'dim_time', 'fact_sales', 'fact_supply_chain']
+    failed_tables = [table_name for table_name, df in zip(target_tables, target_df) if df is None]
+    if failed_tables:
+        raise ValueError(f"The DataFrames of the ODS tables {failed_tables} couldn't be populated.")
+    return {'target_dfs': dict(zip(target_tables, target_df)), 'intermediate_dfs': intermediate_dfs}
+
+def stage_export_ods_tables(runner):
+    """
+    Exports the populated DataFrames into the ODS tables, persisting the intermediate DataFrames shared by several of them.
+
+    :raises RuntimeError: If the export of a table failed.
+    """
+    server = os.getenv('DB_HOST')
+    database = os.getenv('DB_NAME')
+    username = os.getenv('DB_USER')
+    password = os.getenv('DB_PASSWORD')
+    target_dfs = runner.get('populate_ods_tables', 'target_dfs')
 
-        for t_df, t_name in zip(target_df, target_tables):
-            export_data_into_ods_table(t_df, server, database, username, password, t_name)
+    persistence_manager = DataFramePersistenceManager(runner.spark, get_storage_level(os.getenv('ODS_PERSIST_STORAGE_LEVEL', 'MEMORY_AND_DISK_SER')))
+    export_engine = OdsExportEngine(runner.spark, server, database, username, password, ods_export_profiles, int(os.getenv('ODS_EXPORT_WORKERS', 4)))
+
+    try: 
+        persistence_manager.persist_shared(runner.get('populate_ods_tables', 'intermediate_dfs'), target_dfs)
+        reports = export_engine.export_tables(target_dfs, on_written=persistence_manager.output_written)
     except Exception as e:
-        logging.error(f'Failed to serialize the values of the {t_df} DataFrame in the {t_name} table: {e}')
+        logging.error(f'Failed to serialize the values of the DataFrames in the ODS tables: {e}')
+        raise
+    finally:
+        persistence_manager.unpersist_all()
+
+    failed_tables = [table_name for table_name, report in reports.items() if report is None]
+    if failed_tables:
+        raise RuntimeError(f"The export of the ODS tables {failed_tables} failed.")
+    return {'reports': reports}
+
+def register_populate_stages(runner):
+    """
+    Registers the stages of the ODS population on a SparkStageRunner. The converted machine files, the sources
+    and the dim_time calendar are cached until their files change, the population and export run on every submission.
+    """
+    runner.register('convert_machine_files', stage_convert_machine_files, key=lambda _: get_files_key(MACHINES_PATH))
+    runner.register('load_sources', stage_load_sources, depends_on=['convert_machine_files'],
+                    key=lambda _: get_files_key(DATA_PATH, [file_name for file_name, _, _ in SOURCE_WORKBOOKS.values()]))
+    runner.register('load_dim_time', stage_load_dim_time)
+    runner.register('populate_ods_tables', stage_populate_ods_tables, depends_on=['load_sources', 'load_dim_time'], cache=False)
+    runner.register('export_ods_tables', stage_export_ods_tables, depends_on=['populate_ods_tables'], cache=False)
+
+if __name__ == "__main__":
+    configure_logging('ods_populate_tables_star_schema.log', log_format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    load_dotenv('../../.env')
+
+    runner = SparkStageRunner(create_spark_session())
+    register_populate_stages(runner)
+    try:
+        report = runner.run(['export_ods_tables'])
+    finally:
+        runner.close()
+    if any(result['status'] == 'failed' for result in report.values()):
+        sys.exit(1)
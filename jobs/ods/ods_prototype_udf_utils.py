@@ -1,7 +1,8 @@
 import datetime
-from datetime import datetime
 import ast
 import random
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, IntegerType
 
 def parse_date(date_str):
     """
@@ -15,9 +16,9 @@ def parse_date(date_str):
 
 def string_to_int_list(string_list):
     """
-    A UDF (User Defined Function) to convert a string representation of a list into an actual list of integers. 
-    This function is particularly useful when dealing with data where lists are inconsistently represented as strings, 
-    such as "['1', '2', '3']". It safely evaluates the string to a Python list using ast.literal_eval, returning an 
+    A UDF (User Defined Function) to convert a string representation of a list into an actual list of integers.
+    This function is particularly useful when dealing with data where lists are inconsistently represented as strings,
+    such as "['1', '2', '3']". It safely evaluates the string to a Python list using ast.literal_eval, returning an
     empty list in case of any ValueError.
     """
     try:
@@ -27,8 +28,8 @@ def string_to_int_list(string_list):
 
 def convert_timestamp_to_date(timestamp):
     """
-    A UDF (User Defined Function) for converting a timestamp in milliseconds to a datetime object. This function takes 
-    an integer timestamp (representing the number of milliseconds since the Unix epoch, January 1, 1970) and converts it
+    A UDF (User Defined Function) for converting a timestamp in seconds to a datetime object. This function takes
+    an integer timestamp (representing the number of seconds since the Unix epoch, January 1, 1970) and converts it
     into a human-readable datetime format.
     """
     return datetime.datetime.fromtimestamp(timestamp)
@@ -44,4 +45,44 @@ def generate_random_date(year):
 
 def get_current_datetime():
     """Return the current date and time as a string in 'YYYY-MM-DD HH:MM:SS' format."""
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
\ No newline at end of file
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_date_expr(date_col, date_format='MM-dd-yyyy'):
+    """
+    Native Spark expression equivalent of the `parse_date` UDF. A string not matching the format is parsed to null.
+    """
+    return F.to_date(date_col, date_format)
+
+def string_to_int_list_expr(list_col):
+    """
+    Native Spark expression equivalent of the `string_to_int_list` UDF. The single quotes of a list such as
+    "['1', '2', '3']" are dropped so that it parses as a JSON array, and an unparsable string gives an empty list.
+    """
+    int_list_type = ArrayType(IntegerType())
+    return F.coalesce(
+        F.from_json(F.regexp_replace(list_col, "'", ""), int_list_type),
+        F.array().cast(int_list_type)
+    )
+
+def convert_timestamp_to_date_expr(timestamp_col):
+    """
+    Native Spark expression equivalent of the `convert_timestamp_to_date` UDF, converting a number of seconds
+    since the Unix epoch into a timestamp of the session time zone.
+    """
+    return F.timestamp_seconds(timestamp_col)
+
+def generate_random_date_expr(year_col, seed=42):
+    """
+    Native Spark expression equivalent of the `generate_random_date` UDF. The day of the year is drawn with
+    `rand(seed)`, so that the generated dates are reproducible for a given seed and partitioning.
+    """
+    start_date = F.make_date(year_col, F.lit(1), F.lit(1))
+    days_in_year = F.datediff(F.make_date(year_col, F.lit(12), F.lit(31)), start_date) + 1
+    return F.date_add(start_date, F.floor(F.rand(seed) * days_in_year).cast(IntegerType()))
+
+def get_current_datetime_lit():
+    """
+    Native Spark literal equivalent of the `get_current_datetime` UDF. The current date and time is computed once,
+    so that every row of a run shares the same 'lastUpdate' value.
+    """
+    return F.lit(get_current_datetime())
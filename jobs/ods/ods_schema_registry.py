@@ -0,0 +1,269 @@
+import os
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+ODS_LAYER = 'ODS'
+DWH_LAYER = 'DWH'
+
+class ColumnDefinition(NamedTuple):
+    name: str
+    sql_type: str
+    ods_only: bool = False
+
+class IndexDefinition(NamedTuple):
+    columns: Tuple[str, ...]
+    include: Tuple[str, ...] = ()
+    ods_only: bool = False
+
+class TableDefinition(NamedTuple):
+    name: str
+    kind: str
+    columns: Tuple[ColumnDefinition, ...]
+    primary_key: Optional[str] = None
+    cluster: Optional[dict] = None
+    indexes: Tuple[IndexDefinition, ...] = ()
+
+    @property
+    def table_name(self):
+        return f"{self.kind}_{self.name}"
+
+    def get_columns(self, layer):
+        """Returns the columns of the table in a layer, the ODS one adding the operational 'trsc' ids and 'lastUpdate'."""
+        return [column for column in self.columns if layer == ODS_LAYER or not column.ods_only]
+
+def ods_id(name):
+    return ColumnDefinition(name, 'INT DEFAULT NULL', ods_only=True)
+
+LAST_UPDATE = ColumnDefinition('lastUpdate', 'datetime2(7)', ods_only=True)
+# Bumped by SQL Server on every insert and update of an ODS fact record, see the DWH incremental refresh.
+ROW_VERSION = ColumnDefinition('rowVersion', 'rowversion', ods_only=True)
+
+STAR_SCHEMA_TABLES = (
+    TableDefinition('part_information', 'dim', (
+        ods_id('trscPartId'),
+        ColumnDefinition('partId', 'INT'),
+        ColumnDefinition('timeToProduce', 'FLOAT'),
+        LAST_UPDATE,
+    ), primary_key='partId'),
+    TableDefinition('material', 'dim', (
+        ods_id('trscMaterialId'),
+        ColumnDefinition('materialId', 'INT'),
+        ColumnDefinition('name', 'VARCHAR(255)'),
+        LAST_UPDATE,
+    ), primary_key='materialId'),
+    TableDefinition('contract', 'dim', (
+        ods_id('trscContractId'),
+        ColumnDefinition('contractId', 'INT'),
+        ColumnDefinition('clientName', 'VARCHAR(255)'),
+        LAST_UPDATE,
+    ), primary_key='contractId'),
+    TableDefinition('machine', 'dim', (
+        ods_id('trscMachineId'),
+        ColumnDefinition('machineId', 'INT'),
+        LAST_UPDATE,
+    ), primary_key='machineId'),
+    TableDefinition('time', 'dim', (
+        ColumnDefinition('timeId', 'INT'),
+        ColumnDefinition('date', 'DATE'),
+        ColumnDefinition('year', 'SMALLINT'),
+        ColumnDefinition('month', 'TINYINT'),
+        ColumnDefinition('day', 'TINYINT'),
+        ColumnDefinition('semester', 'TINYINT'),
+        ColumnDefinition('quarter', 'TINYINT'),
+    ), primary_key='timeId'),
+    TableDefinition('supply_chain', 'fact', (
+        ods_id('trscMachineId'),
+        ods_id('trscPartId'),
+        ods_id('trscMaterialId'),
+        ColumnDefinition('trscUnitId', 'VARCHAR(36) DEFAULT NULL', ods_only=True),
+        ColumnDefinition('machineId', 'INT'),
+        ColumnDefinition('partId', 'INT'),
+        ColumnDefinition('materialId', 'INT'),
+        ColumnDefinition('timeOfProduction', 'DATE'),
+        ColumnDefinition('materialPrice', 'FLOAT'),
+        ColumnDefinition('timeId', 'INT'),
+        ColumnDefinition('materialPriceDate', 'DATE'),
+        ColumnDefinition('partDefaultPrice', 'FLOAT'),
+        ColumnDefinition('isDamaged', 'BIT'),
+        LAST_UPDATE,
+        ROW_VERSION,
+    ), cluster={
+        'pk': ['machineId', 'partId', 'unitId', 'materialId', 'materialPriceId'],
+        'constraint': 'PK_FACT_SUPPLY_CHAIN_INTEGRITY'
+    }, indexes=(
+        IndexDefinition(('trscUnitId', 'materialId')),
+        IndexDefinition(('rowVersion',)),
+        IndexDefinition(('timeId',)),
+        # Sought by the Kafka consumer for the material and part default prices of a part over a production year.
+        IndexDefinition(('partId', 'materialPriceDate'), include=('materialId', 'materialPrice', 'partDefaultPrice'), ods_only=True),
+    )),
+    TableDefinition('sales', 'fact', (
+        ods_id('trscPartId'),
+        ods_id('trscContractId'),
+        ColumnDefinition('partId', 'INT'),
+        ColumnDefinition('contractId', 'INT'),
+        ColumnDefinition('cash', 'FLOAT'),
+        ColumnDefinition('date', 'DATE'),
+        LAST_UPDATE,
+        ROW_VERSION,
+    ), cluster={
+        'pk': ['partId', 'clientId'],
+        'constraint': 'PK_FACT_SALES_INTEGRITY'
+    }, indexes=(
+        IndexDefinition(('rowVersion',)),
+    )),
+)
+
+SOURCE_SCHEMAS = {
+    'material': (
+        ColumnDefinition('id', 'INT'),
+        ColumnDefinition('name', 'VARCHAR(255)'),
+        ColumnDefinition('prices', 'VARCHAR(MAX)'),
+    ),
+    'part_information': (
+        ColumnDefinition('id', 'INT'),
+        ColumnDefinition('defaultPrice', 'FLOAT'),
+        ColumnDefinition('meterials', 'VARCHAR(MAX)'),
+        ColumnDefinition('timeToProduce', 'FLOAT'),
+        ColumnDefinition('machine', 'VARCHAR(MAX)'),
+    ),
+}
+
+def get_schema_layer(database=None):
+    """
+    Returns the layer of a database, ODS or DWH, from its name. The database defaults to the DB_NAME
+    environment variable, read on the call rather than on import. None is returned for another database.
+    """
+    database = (database if database is not None else os.getenv('DB_NAME', '')).upper()
+    return ODS_LAYER if ODS_LAYER in database else DWH_LAYER if DWH_LAYER in database else None
+
+@lru_cache(maxsize=None)
+def get_star_schema():
+    """Returns the table definitions of the star schema keyed by their table name, e.g. 'dim_machine', built on the first call."""
+    return {table.table_name: table for table in STAR_SCHEMA_TABLES}
+
+def get_table_definition(table_name):
+    """Returns the definition of a dim_ or fact_ table, or None for a table outside of the star schema."""
+    return get_star_schema().get(table_name)
+
+@lru_cache(maxsize=None)
+def get_layer_table_fields(table_name, layer):
+    """Builds, once per table and layer, the fields and SQL types of a table."""
+    table = get_table_definition(table_name)
+    if table is None:
+        return {}
+    return {column.name: column.sql_type for column in table.get_columns(layer)}
+
+def get_table_fields(table_name, layer=None):
+    """
+    Returns the fields and SQL types of a dim_ or fact_ table in a layer, empty for an unknown table.
+    The layer defaults to the one of the DB_NAME database. The returned dictionary is shared and must not be modified.
+    """
+    return get_layer_table_fields(table_name, layer or get_schema_layer())
+
+def get_column_names(table_name, layer=None):
+    """Returns the column names of a dim_ or fact_ table in a layer, in their DDL order."""
+    return list(get_table_fields(table_name, layer))
+
+def validate_column_names(table_name, column_names, layer=None):
+    """
+    Checks that every column written into a table is declared in the registry.
+
+    :return: The column names, unchanged.
+    :raises ValueError: If a column isn't declared for the table.
+    """
+    unknown_columns = [column for column in column_names if column not in get_table_fields(table_name, layer)]
+    if unknown_columns:
+        raise ValueError(f"Columns {unknown_columns} are not declared for the {table_name} table.")
+    return column_names
+
+def get_table_indexes(table_name, layer=None):
+    """
+    Returns the nonclustered indexes of a dim_ or fact_ table in a layer, those whose columns, included ones too,
+    all exist in it, the ODS-only ones being left out of the DWH.
+    """
+    table = get_table_definition(table_name)
+    fields = get_table_fields(table_name, layer)
+    layer = layer or get_schema_layer()
+    return [index for index in (table.indexes if table else ())
+            if (layer == ODS_LAYER or not index.ods_only) and all(column in fields for column in index.columns + index.include)]
+
+def get_queries_ddl(kind, layer=None):
+    """
+    Returns the DDL dictionary of the dim or fact tables of a layer, in the format of the DDL generators:
+    each table name, without its prefix, maps to its 'fields', its nonclustered 'indexes' and its DWH 'id' or 'cluster'.
+    """
+    layer = layer or get_schema_layer()
+    queries_ddl = {}
+    for table in STAR_SCHEMA_TABLES:
+        if table.kind != kind:
+            continue
+        queries_ddl[table.name] = {'fields': dict(get_table_fields(table.table_name, layer)), 'indexes': get_table_indexes(table.table_name, layer)}
+        if kind == 'dim':
+            queries_ddl[table.name]['id'] = table.primary_key if layer == DWH_LAYER else {}
+        else:
+            queries_ddl[table.name]['cluster'] = table.cluster if layer == DWH_LAYER else {}
+    return queries_ddl
+
+def get_sql_base_type(sql_type):
+    """Returns the base SQL type of a declared column type, e.g. 'VARCHAR' for 'VARCHAR(255)' and 'INT' for 'INT DEFAULT NULL'."""
+    return sql_type.split()[0].split('(')[0].upper()
+
+def get_spark_type(sql_type):
+    """Converts a SQL Server column type into the equivalent Spark SQL data type."""
+    from pyspark.sql import types
+
+    spark_types = {
+        'INT': types.IntegerType,
+        'SMALLINT': types.ShortType,
+        'TINYINT': types.ByteType,
+        'FLOAT': types.DoubleType,
+        'BIT': types.BooleanType,
+        'VARCHAR': types.StringType,
+        'DATE': types.DateType,
+        'DATETIME2': types.TimestampType,
+        'ROWVERSION': types.BinaryType,
+    }
+    return spark_types[get_sql_base_type(sql_type)]()
+
+def get_spark_schema(table_name, layer=None):
+    """
+    Returns the explicit Spark StructType of a source file, e.g. 'material', or of a dim_ or fact_ table,
+    so that the readers don't need any schema inference pass.
+    """
+    from pyspark.sql.types import StructType, StructField
+
+    if table_name in SOURCE_SCHEMAS:
+        columns = [(column.name, column.sql_type) for column in SOURCE_SCHEMAS[table_name]]
+    else:
+        columns = get_table_fields(table_name, layer).items()
+    return StructType([StructField(name, get_spark_type(sql_type), True) for name, sql_type in columns])
+
+def get_sql_input_size(sql_type):
+    """
+    Converts a SQL Server column type into a pyodbc input size.
+
+    DATE and datetime2 columns are left undeclared (None) since the Kafka messages carry them as ISO strings
+    that are converted by SQL Server itself.
+    """
+    import pyodbc
+
+    base_type = get_sql_base_type(sql_type)
+    if base_type == 'VARCHAR':
+        length = sql_type.split()[0]
+        length = int(length[length.index('(') + 1:length.index(')')]) if '(' in length and 'MAX' not in length.upper() else 0
+        return (pyodbc.SQL_VARCHAR, length, 0)
+
+    input_sizes = {
+        'INT': (pyodbc.SQL_INTEGER, 0, 0),
+        'SMALLINT': (pyodbc.SQL_SMALLINT, 0, 0),
+        'TINYINT': (pyodbc.SQL_TINYINT, 0, 0),
+        'FLOAT': (pyodbc.SQL_DOUBLE, 0, 0),
+        'BIT': (pyodbc.SQL_BIT, 0, 0),
+    }
+    return input_sizes.get(base_type)
+
+def get_input_sizes(table_name, column_names, layer=None):
+    """Returns the pyodbc input sizes of a column list of a dim_ or fact_ table, None for the undeclared columns."""
+    fields = get_table_fields(table_name, layer)
+    return [get_sql_input_size(fields[column]) if column in fields else None for column in column_names]
@@ -0,0 +1,66 @@
+import logging
+from pyspark.sql import functions as F
+
+DEFAULT_BROADCAST_THRESHOLD = 64 * 1024 * 1024
+
+def estimate_size_in_bytes(df):
+    """
+    Returns the size of a DataFrame estimated by the Catalyst optimizer, without running any job.
+    None is returned when the estimate is unavailable, or unknown as for the Excel sources whose
+    relation reports the default size.
+    """
+    try:
+        size_in_bytes = int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+        default_size = int(df.sparkSession.conf.get("spark.sql.defaultSizeInBytes", str(2 ** 63 - 1)))
+        return None if size_in_bytes >= default_size else size_in_bytes
+    except Exception as e:
+        logging.warning(f"Unable to estimate the size of a DataFrame: {e}")
+        return None
+
+def broadcast_if_small(df, df_name, threshold=DEFAULT_BROADCAST_THRESHOLD):
+    """
+    Hints a dimension DataFrame to be broadcast to every executor when its estimated size is under the threshold,
+    so that joining it doesn't shuffle the fact side. A dimension whose size can't be estimated is broadcast as well,
+    a dimension over the threshold is left to the planner.
+
+    :param df: The dimension DataFrame.
+    :param df_name: The name of the DataFrame used in the logs.
+    :param threshold: The maximum estimated size in bytes of a broadcast DataFrame. None disables the broadcast hints.
+    """
+    if threshold is None:
+        return df
+
+    size_in_bytes = estimate_size_in_bytes(df)
+    if size_in_bytes is not None and size_in_bytes > threshold:
+        logging.info(f"Not broadcasting {df_name}: its estimated size of {size_in_bytes} bytes exceeds {threshold} bytes.")
+        return df
+
+    logging.info(f"Broadcasting {df_name} (estimated size: {size_in_bytes if size_in_bytes is not None else 'unknown'} bytes).")
+    return F.broadcast(df)
+
+def log_join_plan(df, join_name):
+    """Logs the physical plan chosen for a join, e.g. BroadcastHashJoin or SortMergeJoin, without running it."""
+    try:
+        logging.info(f"Physical plan of the {join_name} join:\n{df._jdf.queryExecution().executedPlan().toString()}")
+    except Exception as e:
+        logging.warning(f"Unable to log the physical plan of the {join_name} join: {e}")
+
+def bucket_by_key(df, table_name, key, bucket_count, path=None):
+    """
+    Persists a DataFrame as a table bucketed and sorted by a join key, then reads it back, so that the joins on
+    that key reuse its layout instead of shuffling it. The table is replaced on each run.
+
+    The table is written to an explicit path, the directory of the Spark warehouse by default, rather than as a managed
+    table: the in-memory catalog forgets the table with its session, and a managed table can't be created again over
+    the directory left by a former run.
+
+    :param df: The DataFrame to bucket.
+    :param table_name: The name of the bucketed table.
+    :param key: The column the table is bucketed and sorted by.
+    :param bucket_count: The number of buckets.
+    :param path: The directory of the table, `<spark.sql.warehouse.dir>/<table_name>` when None.
+    """
+    path = path or f"{df.sparkSession.conf.get('spark.sql.warehouse.dir').rstrip('/')}/{table_name}"
+    logging.info(f"Bucketing {table_name} by {key} into {bucket_count} buckets in {path}.")
+    df.write.mode('overwrite').option('path', path).bucketBy(bucket_count, key).sortBy(key).saveAsTable(table_name)
+    return df.sparkSession.table(table_name)
@@ -0,0 +1,118 @@
+import logging
+import threading
+from pyspark import StorageLevel
+
+def plan_contains(plan, target_plan):
+    """
+    Tells whether a Catalyst logical plan contains a subtree computing the same result as a target plan,
+    as the Spark cache manager does to substitute a persisted DataFrame.
+    """
+    target_hash = target_plan.semanticHash()
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node.semanticHash() == target_hash and node.sameResult(target_plan):
+            return True
+        children = node.children()
+        nodes.extend(children.apply(idx) for idx in range(children.size()))
+    return False
+
+def get_cache_usage(spark):
+    """
+    Returns the memory and disk bytes used by the persisted DataFrames of the Spark application.
+    """
+    storage_infos = spark.sparkContext._jsc.sc().getRDDStorageInfo()
+    memory_bytes = sum(storage_info.memSize() for storage_info in storage_infos)
+    disk_bytes = sum(storage_info.diskSize() for storage_info in storage_infos)
+    return memory_bytes, disk_bytes
+
+def get_storage_level(storage_level_name):
+    """
+    Returns the StorageLevel of a name such as 'MEMORY_AND_DISK'. The '_SER' suffix of the Scala levels is accepted
+    and ignored, since PySpark always stores the persisted partitions serialized.
+    """
+    return getattr(StorageLevel, storage_level_name.upper().replace('_SER', ''))
+
+class DataFramePersistenceManager:
+    """
+    Persists the intermediate DataFrames reused by several outputs of a batch job, so that each write action
+    doesn't recompute their whole lineage, and unpersists each of them once its last consumer is written.
+
+    The consumers of a DataFrame are found from the lineage of the outputs: an output consumes an intermediate
+    DataFrame when its logical plan contains the plan of that DataFrame.
+    """
+
+    def __init__(self, spark, storage_level=StorageLevel.MEMORY_AND_DISK):
+        """
+        Initializes the DataFramePersistenceManager.
+
+        :param spark: The Spark session.
+        :param storage_level: The storage level of the persisted DataFrames. PySpark's MEMORY_AND_DISK level
+                              stores the partitions serialized, spilling them to disk when they don't fit in memory.
+        """
+        self.spark = spark
+        self.storage_level = storage_level
+        self.persisted = {}
+        self.pending_consumers = {}
+        self.lock = threading.Lock()
+
+    def find_consumers(self, intermediate_dfs, output_dfs):
+        """
+        Maps the name of each intermediate DataFrame to the names of the outputs consuming it.
+
+        :param intermediate_dfs: Dictionary mapping a name to each candidate intermediate DataFrame.
+        :param output_dfs: Dictionary mapping an output name, e.g. the target table, to its DataFrame.
+        """
+        output_plans = {output_name: output_df._jdf.queryExecution().analyzed() for output_name, output_df in output_dfs.items() if output_df is not None}
+        consumers = {}
+        for df_name, df in intermediate_dfs.items():
+            if df is None:
+                continue
+            plan = df._jdf.queryExecution().analyzed()
+            consumers[df_name] = {output_name for output_name, output_plan in output_plans.items() if plan_contains(output_plan, plan)}
+        return consumers
+
+    def persist_shared(self, intermediate_dfs, output_dfs):
+        """
+        Persists the intermediate DataFrames consumed by more than one output. The lineage analysis
+        failing only disables the persistence, the outputs being computed as before.
+        """
+        try:
+            consumers = self.find_consumers(intermediate_dfs, output_dfs)
+        except Exception as e:
+            logging.warning(f"Unable to analyze the lineage of the outputs. No DataFrame is persisted: {e}")
+            return
+
+        for df_name, output_names in consumers.items():
+            if len(output_names) > 1:
+                intermediate_dfs[df_name].persist(self.storage_level)
+                self.persisted[df_name] = intermediate_dfs[df_name]
+                self.pending_consumers[df_name] = set(output_names)
+                logging.info(f"Persisting the {df_name} DataFrame at {self.storage_level} for its consumers {sorted(output_names)}.")
+
+    def output_written(self, output_name):
+        """Unpersists the persisted DataFrames whose every consumer is now written. Outputs may be written concurrently."""
+        self.log_cache_usage()
+        with self.lock:
+            for df_name in list(self.pending_consumers):
+                self.pending_consumers[df_name].discard(output_name)
+                if not self.pending_consumers[df_name]:
+                    self.persisted.pop(df_name).unpersist()
+                    del self.pending_consumers[df_name]
+                    logging.info(f"Unpersisted the {df_name} DataFrame after its last consumer {output_name}.")
+
+    def log_cache_usage(self):
+        """Logs the memory and disk used by the persisted DataFrames."""
+        try:
+            memory_bytes, disk_bytes = get_cache_usage(self.spark)
+            logging.info(f"Persisted DataFrames {sorted(self.persisted)} use {memory_bytes / 1024 / 1024:.1f} MB of memory and {disk_bytes / 1024 / 1024:.1f} MB of disk.")
+        except Exception as e:
+            logging.warning(f"Unable to report the cache usage: {e}")
+
+    def unpersist_all(self):
+        """Unpersists every DataFrame still persisted, e.g. when an output failed to be written."""
+        with self.lock:
+            for df in self.persisted.values():
+                df.unpersist()
+            self.persisted.clear()
+            self.pending_consumers.clear()
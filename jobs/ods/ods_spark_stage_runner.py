@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import socketserver
+from socket import create_connection
+
+DEFAULT_RUNNER_HOST = '127.0.0.1'
+DEFAULT_RUNNER_PORT = 8790
+
+class SparkStage:
+    """
+    A named stage of a Spark batch job, e.g. 'load_sources'.
+
+    :param name: The name the stage is submitted with.
+    :param func: The function running the stage, called with the runner and returning a dictionary of its outputs.
+    :param depends_on: The names of the stages whose outputs the stage reads.
+    :param cache: Keeps the outputs of the stage for the following submissions. A stage writing to a database doesn't.
+    :param key: A function of the runner returning the version of the inputs of a cached stage, e.g. the hash of its
+                source files. The stage runs again when the key changes.
+    """
+
+    def __init__(self, name, func, depends_on=(), cache=True, key=None):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.cache = cache
+        self.key = key
+
+class SparkStageRunner:
+    """
+    Runs the named stages of the Spark batch jobs on a single Spark session, kept alive between the submissions.
+
+    The outputs of a stage, e.g. its cached DataFrames or the broadcast dim_time calendar, are kept by the runner and read
+    by the following stages through `get`. A submitted stage runs its dependencies first, reusing the outputs of the cached
+    stages whose key didn't change, so that a warm runner only pays the JVM startup, the Excel staging and the source reads
+    once. A stage runs again when a dependency ran again, and the DataFrames cached by its former outputs are unpersisted.
+    One submission runs at a time.
+    """
+
+    def __init__(self, spark):
+        """
+        Initializes the SparkStageRunner.
+
+        :param spark: The Spark session shared by every stage.
+        """
+        self.spark = spark
+        self.stages = {}
+        self.outputs = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, func, depends_on=(), cache=True, key=None):
+        """Registers a stage, see `SparkStage`."""
+        unknown_stages = [dependency for dependency in depends_on if dependency not in self.stages]
+        if unknown_stages:
+            raise ValueError(f"The stage {name} depends on the unregistered stages {unknown_stages}.")
+        self.stages[name] = SparkStage(name, func, depends_on, cache, key)
+
+    def get(self, stage_name, output_name):
+        """Returns an output of a stage that already ran, e.g. runner.get('load_sources', 'material_df')."""
+        return self.outputs[stage_name][output_name]
+
+    def get_stages_order(self, stage_names):
+        """Returns the submitted stages and their dependencies, each one after its dependencies."""
+        order = []
+
+        def visit(name):
+            if name not in self.stages:
+                raise ValueError(f"The stage {name} isn't registered.")
+            if name in order:
+                return
+            for dependency in self.stages[name].depends_on:
+                visit(dependency)
+            order.append(name)
+
+        for name in stage_names:
+            visit(name)
+        return order
+
+    def release(self, stage_name):
+        """Drops the outputs of a stage, unpersisting its cached DataFrames that aren't outputs of another stage too."""
+        shared_outputs = {id(output) for name, outputs in self.outputs.items() if name != stage_name for output in outputs.values()}
+        for output in (self.outputs.pop(stage_name, None) or {}).values():
+            if getattr(output, 'is_cached', False) and id(output) not in shared_outputs:
+                output.unpersist()
+        self.keys.pop(stage_name, None)
+
+    def run(self, stage_names, refresh=False):
+        """
+        Runs the submitted stages, after their dependencies.
+
+        :param stage_names: The names of the stages to run.
+        :param refresh: Runs every stage again, rather than reusing the outputs of the cached ones.
+        :return: Dictionary mapping each stage to its 'status', ran, reused or failed, and its 'wall_time_s'.
+                 The stages after a failed one aren't run.
+        """
+        with self.lock:
+            report = {}
+            ran_stages = set()
+            for name in self.get_stages_order(stage_names):
+                stage = self.stages[name]
+                started_at = time.perf_counter()
+                try:
+                    key = stage.key(self) if stage.key else None
+                    if (not refresh and stage.cache and name in self.outputs and self.keys.get(name) == key
+                            and not ran_stages.intersection(stage.depends_on)):
+                        report[name] = {'status': 'reused', 'wall_time_s': 0.0}
+                        logging.info(f"Reusing the outputs of the {name} stage.")
+                        continue
+
+                    self.release(name)
+                    logging.info(f"Running the {name} stage.")
+                    self.outputs[name] = stage.func(self) or {}
+                    self.keys[name] = key
+                    ran_stages.add(name)
+                    report[name] = {'status': 'ran', 'wall_time_s': round(time.perf_counter() - started_at, 3)}
+                    logging.info(f"The {name} stage ran in {report[name]['wall_time_s']}s.")
+                except Exception as e:
+                    self.release(name)
+                    report[name] = {'status': 'failed', 'wall_time_s': round(time.perf_counter() - started_at, 3), 'error': str(e)}
+                    logging.error(f"An error occurred while running the {name} stage: {e}")
+                    break
+            return report
+
+    def run_function(self, func, *args, **kwargs):
+        """Runs an ad hoc function with the shared Spark session, between the stage submissions."""
+        with self.lock:
+            return func(self.spark, *args, **kwargs)
+
+    def close(self):
+        """Unpersists the outputs of every stage and stops the Spark session."""
+        with self.lock:
+            for name in list(self.outputs):
+                self.release(name)
+            self.spark.stop()
+
+class StageRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a submission to a runner served on a local port: a JSON line such as {"stages": ["export_ods_tables"], "refresh": false},
+    answered by the JSON line of the run report, or {"command": "list"} and {"command": "shutdown"}.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get('command') == 'list':
+                response = {name: list(stage.depends_on) for name, stage in self.server.runner.stages.items()}
+            elif request.get('command') == 'shutdown':
+                response = {'status': 'shutting down'}
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                response = self.server.runner.run(request['stages'], request.get('refresh', False))
+        except Exception as e:
+            logging.error(f"An error occurred while handling a stage submission: {e}")
+            response = {'error': str(e)}
+        self.wfile.write((json.dumps(response) + '\n').encode())
+
+class StageServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, runner, host=DEFAULT_RUNNER_HOST, port=DEFAULT_RUNNER_PORT):
+        super().__init__((host, port), StageRequestHandler)
+        self.runner = runner
+
+def serve_stages(runner, host=DEFAULT_RUNNER_HOST, port=DEFAULT_RUNNER_PORT):
+    """Serves the stages of a runner on a local port until a shutdown command, then closes the runner."""
+    with StageServer(runner, host, port) as server:
+        logging.info(f"Serving the stages {sorted(runner.stages)} on {host}:{port}.")
+        try:
+            server.serve_forever()
+        finally:
+            runner.close()
+
+def submit_request(request, host=DEFAULT_RUNNER_HOST, port=DEFAULT_RUNNER_PORT):
+    """Sends a request to a served runner and returns its response. The call lasts as long as the submitted stages run."""
+    with create_connection((host, port)) as connection:
+        connection.sendall((json.dumps(request) + '\n').encode())
+        with connection.makefile('r') as response_file:
+            return json.loads(response_file.readline())
+
+def register_batch_stages(runner):
+    """Registers the stages of the ODS population and DWH build jobs."""
+    from ods_populate_tables_star_schema import register_populate_stages
+    register_populate_stages(runner)
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dwh'))
+    from dwh_build_fact_tables import register_dwh_stages
+    register_dwh_stages(runner)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from ods_logging_utils import configure_logging
+
+    load_dotenv('../../.env')
+    parser = argparse.ArgumentParser(description="Run the Spark batch stages on a warm Spark session kept alive between submissions.")
+    parser.add_argument('command', choices=['serve', 'submit', 'run', 'list', 'shutdown'],
+                        help="serve the stages, submit stages to the served runner, run stages in a one-shot process, list the stages or shut the runner down.")
+    parser.add_argument('stages', nargs='*', help="The stages to submit or run.")
+    parser.add_argument('--refresh', action='store_true', help="Run every stage again, rather than reusing the cached outputs.")
+    parser.add_argument('--host', default=os.getenv('SPARK_RUNNER_HOST', DEFAULT_RUNNER_HOST))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SPARK_RUNNER_PORT') or DEFAULT_RUNNER_PORT))
+    args = parser.parse_args()
+
+    configure_logging('ods_spark_stage_runner.log', log_format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command in ('submit', 'list', 'shutdown'):
+        request = {'stages': args.stages, 'refresh': args.refresh} if args.command == 'submit' else {'command': args.command}
+        response = submit_request(request, args.host, args.port)
+        print(json.dumps(response, indent=2))
+        sys.exit(1 if 'error' in response or any(isinstance(result, dict) and result.get('status') == 'failed' for result in response.values()) else 0)
+
+    from ods_populate_tables_star_schema import create_spark_session
+    runner = SparkStageRunner(create_spark_session())
+    register_batch_stages(runner)
+    if args.command == 'serve':
+        serve_stages(runner, args.host, args.port)
+    else:
+        try:
+            report = runner.run(args.stages, args.refresh)
+        finally:
+            runner.close()
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if any(result['status'] == 'failed' for result in report.values()) else 0)
@@ -1,10 +1,26 @@
 import pyodbc
 import logging
+from contextlib import contextmanager
+from functools import lru_cache
 from dotenv import load_dotenv
 import os
+import sys
+import queue
+import zlib
+try:
+    from ods_define_star_schemas_dictionaries import ods_merge_keys
+    from ods_schema_registry import get_schema_layer, get_table_fields, get_input_sizes
+except ImportError:
+    from .ods_define_star_schemas_dictionaries import ods_merge_keys
+    from .ods_schema_registry import get_schema_layer, get_table_fields, get_input_sizes
+
+@lru_cache(maxsize=1024)
+def get_statement_kind(query):
+    """Returns the leading keyword of a SQL statement in lower case, parsed once per distinct query text."""
+    return query.strip().split(None, 1)[0].lower() if query.strip() else ''
 
 class DataWarehouseManager:
-    def __init__(self, server, database, username, password):
+    def __init__(self, server, database, username, password, layer=None):
         """
         Initializes the DataWarehouseManager with database connection details.
 
@@ -12,24 +28,25 @@ class DataWarehouseManager:
         :param database: The name of the database to connect to.
         :param username: The username for database authentication.
         :param password: The password for database authentication.
+        :param layer: The schema registry layer of the database, ODS or DWH, giving the column types and merge keys
+                      of its tables. Resolved from the database name when None.
+        :raises ValueError: If the layer isn't given and can't be resolved from the database name.
         """
+        self.layer = layer or get_schema_layer(database or '')
+        if self.layer is None:
+            raise ValueError(f"The schema layer of the {database} database can't be resolved from its name. Pass the layer explicitly.")
 
         self.connection = None
+        self.cursor = None
+        self.insert_cursor = None
+        self.insert_statements = {}
+        self.staging_tables = {}
+        self.in_transaction = False
         self.server = server
         self.database = database
         self.username = username
         self.password = password
 
-        log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'logs', 'ods_structure_tables_star_schema.log'))
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file_path),
-                logging.StreamHandler()
-            ]
-        )
-
     def connect(self):
         try:
             self.connection = pyodbc.connect(
@@ -39,6 +56,9 @@ class DataWarehouseManager:
                 f'UID={self.username};'
                 f'PWD={self.password};'
             )
+            self.cursor = self.connection.cursor()
+            self.insert_cursor = self.connection.cursor()
+            self.insert_cursor.fast_executemany = True
             logging.info("Connection to the ODS (Operational Data Store) established successfully.")
         except Exception as e:
             logging.error(f"An error occurred while connecting to the ODS (Operational Data Store): {e}")
@@ -52,6 +72,10 @@ class DataWarehouseManager:
         it logs the error.
         """
         if self.connection:
+            for cursor in (self.cursor, self.insert_cursor):
+                if cursor:
+                    cursor.close()
+            self.cursor = self.insert_cursor = None
             self.connection.close()
             logging.info("Connection to the ODS (Operational Data Store) closed.")
 
@@ -74,7 +98,7 @@ class DataWarehouseManager:
             logging.error(f"Error checking existence of table {dim_name}: {e}")
             return False
 
-    def execute_query(self, query, params=None):
+    def execute_query(self, query, params=None, commit=True):
         """
         Executes a given SQL query on the connected ODS (Operational Data Store).
 
@@ -85,36 +109,81 @@ class DataWarehouseManager:
 
         :param query: The SQL query to be executed.
         :param params: Optional parameters for the query (default is None).
+        :param commit: Whether to commit after a non 'SELECT' query. When False, or inside a transaction(),
+                       the caller owns the transaction and any error is re-raised so that it can roll back.
         :return: The result of 'SELECT' queries, None for others.
         """
         if not self.connection:
             logging.warning("Connection not established. Please connect to the ODS (Operational Data Store) first.")
             return
 
-        if query.strip().lower().startswith('create'):
+        commit = commit and not self.in_transaction
+        statement_kind = get_statement_kind(query)
+        if statement_kind == 'create':
             dim_name = query.split()[2]
             if self.check_table_exists(dim_name):
                 logging.info(f"Table {dim_name} already exists. Skipping creation.")
                 return
-            else:
-                logging.info(f"Table {dim_name} created successfully.")   
 
         try:
-            cursor = self.connection.cursor()
+            cursor = self.get_cursor()
             cursor.execute(query, params) if params else cursor.execute(query)
 
-            if query.strip().lower().startswith('select'):
-                rows = cursor.fetchall()
-                cursor.close()
-                return rows
+            if statement_kind == 'select':
+                return cursor.fetchall()
             else:
-                self.connection.commit()
-                cursor.close()
-                logging.info("Query executed successfully.")
+                if commit:
+                    self.connection.commit()
+                if statement_kind == 'create':
+                    logging.info(f"Table {dim_name} created successfully.")
+                logging.debug("Query executed successfully.")
 
         except Exception as e:
             logging.error(f"An error occurred while executing the query: {e}")
-        
+            if not commit:
+                raise
+
+    def get_cursor(self):
+        """Returns the long-lived cursor of the connection, reopening it if it was closed."""
+        if self.cursor is None:
+            self.cursor = self.connection.cursor()
+        return self.cursor
+
+    @contextmanager
+    def transaction(self):
+        """
+        Opens a unit of work on the ODS (Operational Data Store) connection.
+
+        Every query and massive insert executed inside the block is committed once when the block exits,
+        or rolled back if an exception escapes it.
+
+        Usage:
+            with ods_manager.transaction():
+                ods_manager.generate_and_execute_massive_insert(...)
+        """
+        if self.in_transaction:
+            yield self
+            return
+
+        self.in_transaction = True
+        try:
+            yield self
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            self.staging_tables.clear()
+            raise
+        finally:
+            self.in_transaction = False
+
+    def commit(self):
+        """Commits the pending transaction on the ODS (Operational Data Store) connection."""
+        self.connection.commit()
+
+    def rollback(self):
+        """Rolls back the pending transaction on the ODS (Operational Data Store) connection."""
+        self.connection.rollback()
+
     def prepare_dimension_table_sql(self, table_name, fields, primary_key):
         """
         Generate a SQL CREATE TABLE statement for a dimension table.
@@ -150,33 +219,276 @@ class DataWarehouseManager:
         create_table_sql = f"CREATE TABLE fact_{table_name.lower()} (\n    {fields_str}\n)"
         return create_table_sql
 
-    def generate_and_execute_massive_insert(self, table_name, column_names, records):
+    def prepare_add_column_sql(self, table_name, field, data_type):
+        """
+        Generate a SQL statement adding a column declared in the schema registry to a table created before it was declared.
+
+        :param table_name: Name of the table, with its dim_ or fact_ prefix.
+        :param field: The name of the column.
+        :param data_type: The SQL type of the column.
+        :return: A SQL ALTER TABLE statement as a string, skipped by SQL Server when the column exists.
+        """
+        return f"IF COL_LENGTH('{table_name}', '{field}') IS NULL\nALTER TABLE {table_name} ADD {field} {data_type}"
+
+    def prepare_index_sql(self, table_name, columns, include_columns=()):
+        """
+        Generate a SQL statement creating a nonclustered index of a table, e.g. on the merge keys of its upserts.
+
+        :param table_name: Name of the table, with its dim_ or fact_ prefix.
+        :param columns: List of the indexed columns.
+        :param include_columns: List of the columns stored in the leaf level of the index, so that it covers the lookups reading them.
+        :return: A SQL CREATE INDEX statement as a string, skipped by SQL Server when the index exists.
+        """
+        index_name = f"IX_{table_name}_{'_'.join(columns)}"
+        include_sql = f" INCLUDE ({', '.join(include_columns)})" if include_columns else ""
+        return (
+            f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{index_name}' AND object_id = OBJECT_ID('{table_name}'))\n"
+            f"CREATE NONCLUSTERED INDEX {index_name} ON {table_name} ({', '.join(columns)}){include_sql}"
+        )
+
+    def get_insert_statement(self, table_name, column_names, fields_table_name=None):
+        """
+        Returns the INSERT statement and the pyodbc input sizes of a table and column list.
+        Both are built once and cached for the lifetime of the manager.
+
+        :param fields_table_name: The table whose declared fields give the input sizes, when it differs
+                                  from the target table, e.g. for a staging table.
+        """
+        statement_key = (table_name, tuple(column_names))
+        if statement_key not in self.insert_statements:
+            placeholders = ', '.join('?' * len(column_names))
+            insert_query = f"INSERT INTO {table_name} ({', '.join(column_names)}) VALUES ({placeholders})"
+
+            input_sizes = get_input_sizes(fields_table_name or table_name, column_names, self.layer)
+            self.insert_statements[statement_key] = (insert_query, input_sizes)
+        return self.insert_statements[statement_key]
+
+    def generate_and_execute_massive_insert(self, table_name, column_names, records, commit=True):
         """
         Generates and executes a SQL query for a massive bulk insertion using executemany.
 
         This function creates an INSERT INTO SQL statement and uses executemany to 
         insert multiple records into the specified table in a single operation. 
-        This is more efficient for large volumes of data compared to executing 
-        individual INSERT statements for each record.
+        The insert cursor enables pyodbc fast_executemany, so the records are sent as parameter arrays
+        rather than row by row.
 
         :param table_name: Name of the table to insert into.
         :param column_names: List of column names in the order corresponding to the records.
         :param records: List of tuples, each tuple representing a record to be inserted.
+        :param commit: Whether to commit the insertion. When False, or inside a transaction(), the caller
+                       owns the transaction and any error is re-raised so that it can roll back.
         """
+        commit = commit and not self.in_transaction
+        if not records:
+            return
+
         try:
-            placeholders = ', '.join('?' * len(column_names))
-            insert_query = f"INSERT INTO {table_name} ({', '.join(column_names)}) VALUES ({placeholders})"
-            cursor = self.connection.cursor()
-            cursor.executemany(insert_query, records)
-            self.connection.commit()
-            logging.info(f"Successfully executed massive insert for table {table_name} with {len(records)} records.")
+            insert_query, input_sizes = self.get_insert_statement(table_name, column_names)
+            self.insert_cursor.setinputsizes(input_sizes)
+            self.insert_cursor.executemany(insert_query, records)
+            if commit:
+                self.connection.commit()
+            logging.debug(f"Successfully executed massive insert for table {table_name} with {len(records)} records.")
         except Exception as e:
             logging.error(f"Error executing massive insert query: {str(e)}")
+            if not commit:
+                raise
             self.connection.rollback()
+
+    def get_staging_table(self, table_name, column_names):
+        """
+        Returns the session temp table used to stage the upserts of a table and column list,
+        creating it on the first use of the connection.
+        """
+        staging_key = (table_name, tuple(column_names))
+        if staging_key not in self.staging_tables:
+            staging_table = f"#staging_{table_name}_{zlib.crc32(','.join(column_names).encode()):08x}"
+            fields = get_table_fields(table_name, self.layer)
+            columns_sql = ",\n    ".join(
+                f"{column} {fields[column].split(' DEFAULT')[0] if column in fields else 'NVARCHAR(MAX)'}"
+                for column in column_names
+            )
+            self.get_cursor().execute(
+                f"IF OBJECT_ID('tempdb..{staging_table}') IS NULL\n"
+                f"CREATE TABLE {staging_table} (\n    rowSeq INT IDENTITY(1, 1),\n    {columns_sql}\n)"
+            )
+            self.staging_tables[staging_key] = staging_table
+        return self.staging_tables[staging_key]
+
+    def prepare_merge_sql(self, table_name, staging_table, column_names, key_columns):
+        """
+        Generate a SQL MERGE statement upserting the staged records into a table.
+
+        The staged records are deduplicated per key, keeping the latest 'lastUpdate' then the latest staged row.
+        A matched row is only updated when the staged record isn't older than it, so that stale records lose.
+        The staging table is truncated in the same statement batch.
+
+        :param table_name: Name of the target table.
+        :param staging_table: Name of the staging temp table.
+        :param column_names: List of the staged column names.
+        :param key_columns: List of the columns identifying a record.
+        :return: A SQL MERGE statement as a string.
+        """
+        columns_str = ', '.join(column_names)
+        has_last_update = 'lastUpdate' in column_names
+        ranking_order = 'lastUpdate DESC, rowSeq DESC' if has_last_update else 'rowSeq DESC'
+        on_sql = ' AND '.join(f"target.{column} = source.{column}" for column in key_columns)
+        update_columns = [column for column in column_names if column not in key_columns]
+
+        merge_sql = (
+            f"WITH ranked AS (\n"
+            f"    SELECT {columns_str}, ROW_NUMBER() OVER (PARTITION BY {', '.join(key_columns)} ORDER BY {ranking_order}) AS rowRank\n"
+            f"    FROM {staging_table}\n"
+            f")\n"
+            f"MERGE INTO {table_name} WITH (HOLDLOCK) AS target\n"
+            f"USING (SELECT {columns_str} FROM ranked WHERE rowRank = 1) AS source\n"
+            f"ON {on_sql}\n"
+        )
+        if update_columns:
+            stale_guard = " AND (target.lastUpdate IS NULL OR source.lastUpdate >= target.lastUpdate)" if has_last_update else ""
+            update_sql = ', '.join(f"{column} = source.{column}" for column in update_columns)
+            merge_sql += f"WHEN MATCHED{stale_guard} THEN\n    UPDATE SET {update_sql}\n"
+        merge_sql += (
+            f"WHEN NOT MATCHED BY TARGET THEN\n"
+            f"    INSERT ({columns_str}) VALUES ({', '.join(f'source.{column}' for column in column_names)});\n"
+            f"TRUNCATE TABLE {staging_table};"
+        )
+        return merge_sql
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records, commit=True):
+        """
+        Upserts a batch of records with a staging temp table and a single MERGE statement.
+
+        The records are streamed into a session temp table with fast_executemany, then merged into the table
+        on its merge keys: the 'trsc' columns declared in the schema registry, unless ods_merge_keys
+        overrides them. Whatever the number of updates in the batch, it costs one insert and one MERGE.
+        Tables without merge keys among the columns fall back to a massive insert.
+
+        :param table_name: Name of the table to upsert into.
+        :param column_names: List of column names in the order corresponding to the records.
+        :param records: List of tuples, each tuple representing a record to be upserted.
+        :param commit: Whether to commit the upsert. When False, or inside a transaction(), the caller
+                       owns the transaction and any error is re-raised so that it can roll back.
+        """
+        key_columns = get_table_merge_keys(table_name, column_names, self.layer)
+        if not key_columns:
+            return self.generate_and_execute_massive_insert(table_name, column_names, records, commit)
+
+        commit = commit and not self.in_transaction
+        if not records:
+            return
+
+        try:
+            staging_table = self.get_staging_table(table_name, column_names)
+            insert_query, input_sizes = self.get_insert_statement(staging_table, column_names, table_name)
+            self.insert_cursor.setinputsizes(input_sizes)
+            self.insert_cursor.executemany(insert_query, records)
+            self.get_cursor().execute(self.prepare_merge_sql(table_name, staging_table, column_names, key_columns))
+            if commit:
+                self.connection.commit()
+            logging.debug(f"Successfully executed massive upsert for table {table_name} with {len(records)} records.")
+        except Exception as e:
+            logging.error(f"Error executing massive upsert query: {str(e)}")
+            self.staging_tables.clear()
+            if not commit:
+                raise
+            self.connection.rollback()
+
+    def generate_and_execute_massive_delete(self, table_name, key_columns, keys, commit=True):
+        """
+        Deletes the records matching a batch of keys with a single set-based DELETE statement.
+
+        A single key is deleted with a plain parameterized DELETE. Several keys are streamed into a session
+        temp table with fast_executemany and joined to the table, rather than being sent as a huge IN list.
+
+        :param table_name: Name of the table to delete from.
+        :param key_columns: List of the columns identifying the records to delete.
+        :param keys: List of tuples, each tuple holding the values of the key columns.
+        :param commit: Whether to commit the deletion. When False, or inside a transaction(), the caller
+                       owns the transaction and any error is re-raised so that it can roll back.
+        """
+        commit = commit and not self.in_transaction
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        if not keys:
+            return
+
+        try:
+            if len(keys) == 1:
+                where_sql = ' AND '.join(f"{column} = ?" for column in key_columns)
+                self.get_cursor().execute(f"DELETE FROM {table_name} WHERE {where_sql}", keys[0])
+            else:
+                staging_table = self.get_staging_table(table_name, key_columns)
+                insert_query, input_sizes = self.get_insert_statement(staging_table, key_columns, table_name)
+                self.insert_cursor.setinputsizes(input_sizes)
+                self.insert_cursor.executemany(insert_query, keys)
+
+                on_sql = ' AND '.join(f"target.{column} = source.{column}" for column in key_columns)
+                self.get_cursor().execute(
+                    f"DELETE target FROM {table_name} AS target\n"
+                    f"INNER JOIN {staging_table} AS source ON {on_sql};\n"
+                    f"TRUNCATE TABLE {staging_table};"
+                )
+            if commit:
+                self.connection.commit()
+            logging.debug(f"Successfully executed massive delete for table {table_name} with {len(keys)} keys.")
+        except Exception as e:
+            logging.error(f"Error executing massive delete query: {str(e)}")
+            self.staging_tables.clear()
+            if not commit:
+                raise
+            self.connection.rollback()
+
+class DataWarehouseManagerPool:
+    """
+    A small pool of connected DataWarehouseManager instances, one per concurrent worker,
+    since a pyodbc connection must not be shared between threads.
+    """
+
+    def __init__(self, server, database, username, password, size, layer=None):
+        """
+        Initializes the pool and opens its connections.
+
+        :param size: Number of connections kept in the pool.
+        :param layer: The schema registry layer of the database, see DataWarehouseManager.
+        """
+        self.managers = queue.Queue()
+        self.all_managers = []
+        for _ in range(size):
+            manager = DataWarehouseManager(server, database, username, password, layer)
+            manager.connect()
+            self.all_managers.append(manager)
+            self.managers.put(manager)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a DataWarehouseManager from the pool, waiting until one is available."""
+        manager = self.managers.get()
+        try:
+            yield manager
         finally:
-            cursor.close()
+            self.managers.put(manager)
+
+    def close(self):
+        """Closes every connection of the pool."""
+        for manager in self.all_managers:
+            manager.close_connection()
+
+def get_table_merge_keys(table_name, column_names, layer):
+    """
+    Returns the columns identifying a record of a table in an upsert: the ods_merge_keys override of the table,
+    e.g. the unit and material of a fact_supply_chain record, or else its 'trsc' columns. Only the keys present among
+    the given columns are returned. An empty override declares a table whose records have no identity, so they are inserted.
+    """
+    if table_name in ods_merge_keys:
+        merge_keys = ods_merge_keys[table_name]
+    else:
+        merge_keys = [field for field in get_table_fields(table_name, layer) if field.startswith('trsc')]
+    return [column for column in merge_keys if column in column_names]
 
 if __name__ == "__main__":
+    from ods_logging_utils import configure_logging
+    configure_logging('ods_structure_tables_star_schema.log')
+
     load_dotenv('../../.env')
     server = os.getenv('DB_HOST')
     database = os.getenv('DB_NAME')
@@ -185,18 +497,29 @@ if __name__ == "__main__":
 
     db_manager = DataWarehouseManager(server, database, username, password)
     db_manager.connect()
+    if not db_manager.connection:
+        sys.exit(1)
 
     from ods_define_star_schemas_dictionaries import dim_queries_ddl, fact_queries_ddl
-    
-    for dim_table, dim_fields in dim_queries_ddl.items():
-        dim_query = db_manager.prepare_dimension_table_sql(dim_table, dim_fields['fields'], dim_fields['id'])
-        db_manager.execute_query(dim_query)
-    
-    for fact_table, fact_fields in fact_queries_ddl.items():
-        fact_query = db_manager.prepare_fact_table_sql(fact_table, fact_fields['fields'], fact_fields['cluster'])
-        db_manager.execute_query(fact_query)
-        
-    db_manager.close_connection()
-else:
-        from .ods_define_star_schemas_dictionaries import dim_queries_ddl, fact_queries_ddl
 
+    try:
+        with db_manager.transaction():
+            for dim_table, dim_fields in dim_queries_ddl.items():
+                dim_query = db_manager.prepare_dimension_table_sql(dim_table, dim_fields['fields'], dim_fields['id'])
+                db_manager.execute_query(dim_query)
+
+            for fact_table, fact_fields in fact_queries_ddl.items():
+                fact_query = db_manager.prepare_fact_table_sql(fact_table, fact_fields['fields'], fact_fields['cluster'])
+                db_manager.execute_query(fact_query)
+
+            # The tables created by an earlier version of the registry get its new columns and indexes.
+            for table_name, table_ddl in [(f"dim_{name}", ddl) for name, ddl in dim_queries_ddl.items()] + [(f"fact_{name}", ddl) for name, ddl in fact_queries_ddl.items()]:
+                for field, data_type in table_ddl['fields'].items():
+                    db_manager.execute_query(db_manager.prepare_add_column_sql(table_name, field, data_type))
+                for index in table_ddl['indexes']:
+                    db_manager.execute_query(db_manager.prepare_index_sql(table_name, index.columns, index.include))
+    except Exception as e:
+        logging.error(f"An error occurred while creating the star schema tables, none of them was created: {e}")
+        sys.exit(1)
+    finally:
+        db_manager.close_connection()
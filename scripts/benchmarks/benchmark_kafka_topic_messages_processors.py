@@ -0,0 +1,324 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'jobs', 'kafka-consumer')))
+from kafka_process_data_schema_topics_messages import execute_ruling_topic_processor, execute_ruling_topic_processor_batch
+from kafka_topic_messages_key_cache import ODS_DIMENSION_KEYS, ods_key_caches, preload_ods_key_caches
+from kafka_topic_messages_logging import ErrorCountingHandler
+from kafka_topic_messages_schemas import decode_topic_message
+
+TOPIC_WEIGHTS = {'supply_chain': 0.5, 'sales': 0.2, 'part_information': 0.1, 'machine': 0.1, 'material': 0.1}
+
+TABLE_NAME_PATTERN = re.compile(r"\[dbo\]\.\[(\w+)\]")
+
+class TopicMessageGenerator:
+    """
+    Generates seeded, reproducible JSON payloads shaped like the messages of every consumed topic.
+
+    The transactional ids are drawn from a fixed population, so that the messages keep hitting the same parts,
+    machines, materials and contracts as the stream grows, and a share of them are `isDeleted` messages.
+    """
+
+    def __init__(self, seed=42, parts=500, machines=50, materials=100, contracts=2000, delete_ratio=0.05):
+        """
+        Initializes the TopicMessageGenerator.
+
+        :param seed: The seed of the random generator.
+        :param parts: Number of distinct parts. The machines, materials and contracts counts work the same way.
+        :param delete_ratio: Share of the messages flagged as deleted.
+        """
+        self.random = random.Random(seed)
+        self.parts = parts
+        self.machines = machines
+        self.materials = materials
+        self.contracts = contracts
+        self.delete_ratio = delete_ratio
+        self.start_date = datetime(2023, 1, 1)
+
+    def random_datetime(self):
+        return self.start_date + timedelta(seconds=self.random.randrange(365 * 24 * 3600), milliseconds=self.random.randrange(1000))
+
+    def last_update(self):
+        return f"{self.random_datetime().isoformat(timespec='milliseconds')}Z"
+
+    def is_deleted(self):
+        return self.random.random() < self.delete_ratio
+
+    def part_information(self):
+        return {'id': self.random.randint(1, self.parts), 'isDeleted': self.is_deleted(), 'timeToProduce': round(self.random.uniform(1, 120), 2), 'lastUpdate': self.last_update()}
+
+    def machine(self):
+        return {'id': self.random.randint(1, self.machines), 'isDeleted': self.is_deleted(), 'lastUpdate': self.last_update()}
+
+    def material(self):
+        material_id = self.random.randint(1, self.materials)
+        return {'id': material_id, 'isDeleted': self.is_deleted(), 'name': f"material_{material_id}", 'lastUpdate': self.last_update()}
+
+    def supply_chain(self):
+        return {
+            'id': str(uuid.UUID(int=self.random.getrandbits(128), version=4)),
+            'machineId': self.random.randint(1, self.machines),
+            'partId': self.random.randint(1, self.parts),
+            'timeOfProduction': f"{self.random_datetime().isoformat(timespec='milliseconds')}Z",
+            'isDeleted': self.is_deleted(),
+            'var5': self.random.random() < 0.1,
+            'lastUpdate': self.last_update(),
+        }
+
+    def sales(self):
+        parts_count = self.random.randint(1, 5)
+        return {
+            'contract_number': self.random.randint(1, self.contracts),
+            'isDeleted': self.is_deleted(),
+            'parts': [self.random.randint(1, self.parts) for _ in range(parts_count)],
+            'cash': [round(self.random.uniform(10, 5000), 2) for _ in range(parts_count)],
+            'client_name': f"client_{self.random.randint(1, 300)}",
+            'date': self.random_datetime().date().isoformat(),
+            'lastUpdate': self.last_update(),
+        }
+
+    def generate(self, messages_count, topic_weights=TOPIC_WEIGHTS):
+        """
+        Generates the raw Kafka messages of a mixed stream.
+
+        :return: List of (topic name, JSON encoded value) tuples.
+        """
+        topic_names = list(topic_weights)
+        weights = list(topic_weights.values())
+        return [
+            (topic_name, json.dumps(getattr(self, topic_name)()).encode())
+            for topic_name in self.random.choices(topic_names, weights, k=messages_count)
+        ]
+
+class RecordingDataWarehouseManager:
+    """
+    An in-memory stand-in of the DataWarehouseManager recording the round-trips the real one would make.
+
+    The dimension tables keep their transactional to surrogate id mapping so that the lookups resolve
+    like against the ODS, the fact tables only keep a row count, and the supply chain enrichment query
+    answers the machine and part surrogate ids and two materials per requested key. Round-trips are counted per statement sent to SQL Server:
+    the staging temp table creation on its first use, the fast_executemany insert, the MERGE or DELETE,
+    and the commits outside of a transaction.
+    """
+
+    def __init__(self, materials=100):
+        self.materials = materials
+        self.dimensions = {table_name: {} for table_name in ODS_DIMENSION_KEYS}
+        self.fact_rows = {}
+        self.staging_tables = set()
+        self.in_transaction = False
+        self.round_trips = 0
+        self.calls = {}
+
+    def count(self, call, round_trips):
+        self.calls[call] = self.calls.get(call, 0) + 1
+        self.round_trips += round_trips
+
+    def commit_round_trips(self, commit):
+        return 1 if commit and not self.in_transaction else 0
+
+    @contextmanager
+    def transaction(self):
+        if self.in_transaction:
+            yield self
+            return
+        self.in_transaction = True
+        try:
+            yield self
+        finally:
+            self.in_transaction = False
+            self.count('commit', 1)
+
+    def execute_query(self, query, params=None, commit=True):
+        table_match = TABLE_NAME_PATTERN.search(query)
+        table_name = table_match.group(1) if table_match else None
+        statement_kind = query.split(None, 1)[0].lower()
+        if '[fact_supply_chain]' in query:
+            table_name = 'fact_supply_chain'
+        self.count(f"{statement_kind} {table_name}", 1 + (self.commit_round_trips(commit) if statement_kind != 'select' else 0))
+        if statement_kind != 'select':
+            return None
+
+        if 'VALUES' in query and '[fact_supply_chain]' in query:
+            return self.fetch_supply_chain_materials(params)
+        mapping = self.dimensions.get(table_name, {})
+        if 'MAX(' in query:
+            return [(max(mapping.values(), default=0) + 1,)]
+        if 'IS NOT NULL' in query:
+            return list(mapping.items())
+        surrogate_id = mapping.get(int(params)) if params is not None else None
+        return [(surrogate_id,)] if surrogate_id is not None else []
+
+    def fetch_supply_chain_materials(self, params):
+        material_mapping = self.dimensions['dim_material']
+        next_trsc_material_id = max(material_mapping, default=0) + 1
+        rows = []
+        for machine_id, part_id, production_year in zip(params[0::3], params[1::3], params[2::3]):
+            machine_surrogate_id = self.dimensions['dim_machine'].get(machine_id)
+            part_surrogate_id = self.dimensions['dim_part_information'].get(part_id)
+            for material_id in ((part_id * 7) % self.materials + 1, (part_id * 13) % self.materials + 1):
+                trsc_material_id = next((trsc_id for trsc_id, surrogate_id in material_mapping.items() if surrogate_id == material_id), None)
+                rows.append((machine_id, part_id, production_year, machine_surrogate_id, part_surrogate_id,
+                             material_id, 10.0 + material_id, date(production_year, 1, 1), 100.0 + part_id, 1, trsc_material_id, next_trsc_material_id))
+        return rows
+
+    def staging_round_trips(self, table_name, column_names):
+        staging_key = (table_name, tuple(column_names))
+        if staging_key in self.staging_tables:
+            return 0
+        self.staging_tables.add(staging_key)
+        return 1
+
+    def apply_records(self, table_name, column_names, records):
+        if table_name not in self.dimensions:
+            self.fact_rows[table_name] = self.fact_rows.get(table_name, 0) + len(records)
+            return
+        id = ODS_DIMENSION_KEYS[table_name]
+        trsc_id = f"trsc{id[0].upper()}{id[1:]}"
+        trsc_position, id_position = column_names.index(trsc_id), column_names.index(id)
+        for record in records:
+            self.dimensions[table_name][int(record[trsc_position])] = record[id_position]
+
+    def generate_and_execute_massive_insert(self, table_name, column_names, records, commit=True):
+        if records:
+            self.count(f"insert {table_name}", 1 + self.commit_round_trips(commit))
+            self.apply_records(table_name, column_names, records)
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records, commit=True):
+        if records:
+            self.count(f"upsert {table_name}", self.staging_round_trips(table_name, column_names) + 2 + self.commit_round_trips(commit))
+            self.apply_records(table_name, column_names, records)
+
+    def generate_and_execute_massive_delete(self, table_name, key_columns, keys, commit=True):
+        keys = list(dict.fromkeys(tuple(key) for key in keys))
+        if not keys:
+            return
+        round_trips = 1 if len(keys) == 1 else self.staging_round_trips(table_name, key_columns) + 2
+        self.count(f"delete {table_name}", round_trips + self.commit_round_trips(commit))
+        if table_name in self.dimensions and len(key_columns) == 1:
+            for (trsc_id,) in keys:
+                self.dimensions[table_name].pop(int(trsc_id), None)
+
+def get_percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def replay_messages(raw_messages, batch_size=None, key_cache_size=None):
+    """
+    Replays raw Kafka messages through the real decoding and topic processors against a fresh RecordingDataWarehouseManager.
+
+    :param batch_size: If set, the messages are written in batches of this size as by consume_messages_in_batches,
+                       otherwise one by one as by consume_messages.
+    :param key_cache_size: If set, the surrogate key caches are preloaded with this size, as the consumer does on start.
+    :return: The RecordingDataWarehouseManager and the latencies in seconds of each message or batch.
+    """
+    ods_manager = RecordingDataWarehouseManager()
+    ods_key_caches.clear()
+    if key_cache_size:
+        preload_ods_key_caches(ods_manager, key_cache_size)
+        ods_manager.round_trips, ods_manager.calls = 0, {}
+
+    latencies = []
+    step = batch_size or 1
+    for batch_start in range(0, len(raw_messages), step):
+        start = time.perf_counter()
+        if batch_size:
+            messages_by_topic = {}
+            for topic_name, raw_value in raw_messages[batch_start:batch_start + step]:
+                messages_by_topic.setdefault(topic_name, []).append(decode_topic_message(topic_name, raw_value))
+            execute_ruling_topic_processor_batch(ods_manager, messages_by_topic)
+        else:
+            topic_name, raw_value = raw_messages[batch_start]
+            execute_ruling_topic_processor(ods_manager, topic_name, decode_topic_message(topic_name, raw_value))
+        latencies.append(time.perf_counter() - start)
+    return ods_manager, latencies
+
+def run_benchmark(messages_count, seed=42, delete_ratio=0.05, batch_size=None, key_cache_size=None, measure_memory=True):
+    """
+    Benchmarks the Kafka to ODS path over a seeded synthetic stream and returns its report.
+
+    The timed replay runs without tracing, the peak memory is measured by a second replay under tracemalloc.
+    """
+    raw_messages = TopicMessageGenerator(seed, delete_ratio=delete_ratio).generate(messages_count)
+    error_counter = ErrorCountingHandler()
+    logging.getLogger().addHandler(error_counter)
+    try:
+        ods_manager, latencies = replay_messages(raw_messages, batch_size, key_cache_size)
+        peak_memory = None
+        if measure_memory:
+            tracemalloc.start()
+            replay_messages(raw_messages, batch_size, key_cache_size)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        logging.getLogger().removeHandler(error_counter)
+
+    elapsed = sum(latencies)
+    sorted_latencies = sorted(latencies)
+    return {
+        'messages': messages_count,
+        'seed': seed,
+        'delete_ratio': delete_ratio,
+        'batch_size': batch_size,
+        'key_cache_size': key_cache_size,
+        'elapsed_seconds': round(elapsed, 4),
+        'messages_per_second': round(messages_count / elapsed, 1) if elapsed else 0.0,
+        'round_trips': ods_manager.round_trips,
+        'round_trips_per_message': round(ods_manager.round_trips / messages_count, 3),
+        'latency_unit': 'batch' if batch_size else 'message',
+        'p50_ms': round(get_percentile(sorted_latencies, 0.5) * 1000, 3),
+        'p99_ms': round(get_percentile(sorted_latencies, 0.99) * 1000, 3),
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 2) if peak_memory is not None else None,
+        'errors_logged': error_counter.errors // (2 if measure_memory else 1),
+        'calls': dict(sorted(ods_manager.calls.items())),
+    }
+
+def compare_with_baseline(report, baseline, tolerance):
+    """
+    Lists the metrics of the report that regressed beyond the tolerance against a baseline report.
+    """
+    regressions = []
+    if report['messages_per_second'] < baseline['messages_per_second'] * (1 - tolerance):
+        regressions.append(f"messages_per_second dropped from {baseline['messages_per_second']} to {report['messages_per_second']}")
+    for metric in ('round_trips_per_message', 'p99_ms', 'peak_memory_mb'):
+        if report.get(metric) is not None and baseline.get(metric) and report[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(f"{metric} rose from {baseline[metric]} to {report[metric]}")
+    return regressions
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Benchmark the Kafka topic processors offline against an in-memory ODS stand-in.")
+    parser.add_argument('--messages', type=int, default=10000, help="Number of synthetic messages to replay.")
+    parser.add_argument('--seed', type=int, default=42, help="Seed of the message generator.")
+    parser.add_argument('--delete-ratio', type=float, default=0.05, help="Share of isDeleted messages.")
+    parser.add_argument('--batch-size', type=int, default=None, help="Replay in batches of this size instead of one message at a time.")
+    parser.add_argument('--key-cache-size', type=int, default=None, help="Preload the surrogate key caches with this size.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the peak memory measurement replay.")
+    parser.add_argument('--output', help="Write the JSON report into this file.")
+    parser.add_argument('--baseline', help="A previous JSON report to compare with. Exits with status 1 on a regression.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Relative regression tolerated against the baseline.")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.messages, args.seed, args.delete_ratio, args.batch_size, args.key_cache_size, not args.no_memory)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            logging.error(f"Regression against {args.baseline}: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import shutil
+import tarfile
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+
+ARCHIVE_PREFIX = "machines_"
+ARCHIVE_EXTENSION = ".tar.xz"
+MANIFEST_EXTENSION = ".json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def get_archive_paths(archives_path, day):
+    """Returns the paths of the archive of a day, e.g. 'machines_20240114.tar.xz', and of its manifest."""
+    archive_name = f"{ARCHIVE_PREFIX}{day}"
+    return os.path.join(archives_path, f"{archive_name}{ARCHIVE_EXTENSION}"), os.path.join(archives_path, f"{archive_name}{MANIFEST_EXTENSION}")
+
+def load_archive_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+def save_archive_manifest(manifest_path, manifest):
+    """Writes an archive manifest atomically, once its archive is in place."""
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+def group_files_by_day(input_path):
+    """Returns the machine CSV files of a directory grouped by the day they were written, e.g. {'20240114': ['a.csv', ...]}."""
+    days = {}
+    for file_name in sorted(os.listdir(input_path)):
+        file_path = os.path.join(input_path, file_name)
+        if file_name.endswith('.csv') and os.path.isfile(file_path):
+            day = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y%m%d')
+            days.setdefault(day, []).append(file_name)
+    return days
+
+def get_tar_info(tar, file_path, file_name):
+    """Returns the archive entry of a file without its owner, so that the same files always give the same archive."""
+    tar_info = tar.gettarinfo(file_path, arcname=file_name)
+    tar_info.uid = tar_info.gid = 0
+    tar_info.uname = tar_info.gname = ''
+    return tar_info
+
+def pack_day(input_path, archives_path, day, file_names):
+    """
+    Packs the machine CSV files of a day into a xz compressed tarball, along with a JSON manifest of the size, modification time
+    and SHA-256 of every packed file.
+
+    The day is only packed again when one of its files is new or changed since its manifest. The files of the former archive
+    that are no longer in the input directory, e.g. once pruned after being archived, are carried over into the new one.
+
+    :return: True if the archive was written, False if it was already up to date.
+    """
+    archive_path, manifest_path = get_archive_paths(archives_path, day)
+    manifest = load_archive_manifest(manifest_path) if os.path.exists(archive_path) else {'files': {}}
+
+    changed_file_names = []
+    for file_name in file_names:
+        stat = os.stat(os.path.join(input_path, file_name))
+        entry = manifest['files'].get(file_name)
+        if not entry or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            changed_file_names.append(file_name)
+    if not changed_file_names:
+        logging.info(f"The archive of {day} is up to date with its {len(file_names)} files.")
+        return False
+
+    files = {name: entry for name, entry in manifest['files'].items() if name not in file_names}
+    temporary_path = f"{archive_path}.tmp"
+    with tarfile.open(temporary_path, 'w:xz') as tar:
+        if files:
+            with tarfile.open(archive_path, 'r:xz') as former_tar:
+                for member in former_tar.getmembers():
+                    if member.name in files:
+                        tar.addfile(member, former_tar.extractfile(member))
+        for file_name in file_names:
+            file_path = os.path.join(input_path, file_name)
+            stat = os.stat(file_path)
+            with open(file_path, 'rb') as file:
+                tar.addfile(get_tar_info(tar, file_path, file_name), file)
+            files[file_name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': hash_file_sha256(file_path)}
+    os.replace(temporary_path, archive_path)
+
+    save_archive_manifest(manifest_path, {
+        'day': day,
+        'archive': os.path.basename(archive_path),
+        'archive_size': os.path.getsize(archive_path),
+        'files': files,
+    })
+    raw_size = sum(entry['size'] for entry in files.values())
+    logging.info(f"Packed {len(files)} files of {day} ({len(changed_file_names)} new or changed) into {archive_path}: "
+                 f"{raw_size} bytes compressed to {os.path.getsize(archive_path)} bytes.")
+    return True
+
+def pack_machine_files(input_path, archives_path):
+    """
+    Packs the machine CSV files into one compressed archive per day, so that the blob storage only receives the archives
+    of the new or changed days instead of every raw CSV file.
+
+    :param input_path: The directory of the machine CSV files, e.g. data/machines.
+    :param archives_path: The directory of the archives and their manifests.
+    :return: The list of the days packed again, and the list of the days that failed to be packed.
+    """
+    if not os.path.isdir(input_path):
+        logging.warning(f"No machine files to pack, {input_path} doesn't exist.")
+        return [], []
+
+    os.makedirs(archives_path, exist_ok=True)
+    packed_days = []
+    failed_days = []
+    for day, file_names in group_files_by_day(input_path).items():
+        try:
+            if pack_day(input_path, archives_path, day, file_names):
+                packed_days.append(day)
+        except Exception as e:
+            logging.error(f"An error occurred while packing the machine files of {day}: {e}")
+            failed_days.append(day)
+            temporary_path = f"{get_archive_paths(archives_path, day)[0]}.tmp"
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+    return packed_days, failed_days
+
+def restore_day(archive_path, manifest_path, output_path):
+    """
+    Unpacks the machine CSV files of an archive into the output directory with their modification time, and checks
+    them against the SHA-256 of the manifest. The files already holding the same content are left untouched.
+
+    :return: The number of restored files.
+    """
+    manifest = load_archive_manifest(manifest_path)
+    restored_count = 0
+    with tarfile.open(archive_path, 'r:xz') as tar:
+        for member in tar.getmembers():
+            entry = manifest['files'].get(member.name)
+            if not member.isfile() or entry is None or os.path.basename(member.name) != member.name:
+                logging.warning(f"Skipping the unexpected entry {member.name} of {archive_path}.")
+                continue
+
+            file_path = os.path.join(output_path, member.name)
+            if os.path.exists(file_path) and hash_file_sha256(file_path) == entry['sha256']:
+                continue
+            temporary_path = f"{file_path}.tmp"
+            with tar.extractfile(member) as source, open(temporary_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            if hash_file_sha256(temporary_path) != entry['sha256']:
+                os.remove(temporary_path)
+                raise ValueError(f"The file {member.name} of {archive_path} doesn't match its manifest hash.")
+            os.replace(temporary_path, file_path)
+            os.utime(file_path, (entry['mtime'], entry['mtime']))
+            restored_count += 1
+    return restored_count
+
+def download_archives(blob_service_client, container_name, archives_path, days=None):
+    """Downloads the machine archives and manifests of the container into the archives directory, all days when `days` is None."""
+    os.makedirs(archives_path, exist_ok=True)
+    container_client = blob_service_client.get_container_client(container_name)
+    for blob in container_client.list_blobs(name_starts_with=ARCHIVE_PREFIX):
+        day = blob.name[len(ARCHIVE_PREFIX):].split('.')[0]
+        if days and day not in days:
+            continue
+        logging.info(f"Downloading {blob.name}...")
+        file_path = os.path.join(archives_path, blob.name)
+        with open(f"{file_path}.tmp", 'wb') as file:
+            container_client.download_blob(blob.name).readinto(file)
+        os.replace(f"{file_path}.tmp", file_path)
+
+def restore_machine_files(archives_path, output_path, days=None):
+    """
+    Restores the machine CSV files of the archived days into the output directory.
+
+    :param archives_path: The directory of the archives and their manifests.
+    :param output_path: The directory the files are restored into, e.g. data/machines.
+    :param days: The days to restore, e.g. ['20240114'], all the archived ones when None.
+    :return: The number of restored files.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    archive_days = sorted(file_name[len(ARCHIVE_PREFIX):-len(ARCHIVE_EXTENSION)] for file_name in os.listdir(archives_path)
+                          if file_name.startswith(ARCHIVE_PREFIX) and file_name.endswith(ARCHIVE_EXTENSION))
+    restored_count = 0
+    for day in archive_days:
+        if days and day not in days:
+            continue
+        archive_path, manifest_path = get_archive_paths(archives_path, day)
+        if not os.path.exists(manifest_path):
+            logging.error(f"The archive of {day} has no manifest, skipping it.")
+            continue
+        day_count = restore_day(archive_path, manifest_path, output_path)
+        logging.info(f"Restored {day_count} machine files of {day} into {output_path}.")
+        restored_count += day_count
+    return restored_count
+
+if __name__ == "__main__":
+    log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'logs', 'pack_machine_files.log'))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+                    logging.FileHandler(log_file_path),
+                    logging.StreamHandler()
+                ]
+        )
+
+    data_directory = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data')
+    parser = argparse.ArgumentParser(description="Pack the machine CSV files into daily compressed archives, or restore them.")
+    parser.add_argument('command', choices=['pack', 'restore'])
+    parser.add_argument('--machines-path', default=os.path.join(data_directory, 'machines'), help="The directory of the machine CSV files.")
+    parser.add_argument('--archives-path', default=os.path.join(data_directory, 'archives', 'machines'), help="The directory of the archives.")
+    parser.add_argument('--day', action='append', help="A day to restore, as YYYYMMDD. Can be repeated, every archived day by default.")
+    parser.add_argument('--download', action='store_true', help="Download the archives from the Azure container before restoring them.")
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        _, failed_days = pack_machine_files(args.machines_path, args.archives_path)
+        if failed_days:
+            sys.exit(1)
+    else:
+        if args.download:
+            from store_files_into_blob_container_azure import get_blob_service_client
+
+            load_dotenv('../../../.env')
+            blob_service_client = get_blob_service_client(os.getenv('AZURE_BLOB_STORAGE_ACCOUNT'), os.getenv('AZURE_BLOB_ACCESS_KEY'),
+                                                          os.getenv('AZURE_BLOB_ACCOUNT_URL') or None)
+            download_archives(blob_service_client, os.getenv('AZURE_CONTAINER_NAME'), args.archives_path, args.day)
+        try:
+            restore_machine_files(args.archives_path, args.machines_path, args.day)
+        except Exception as e:
+            logging.error(f"An error occurred while restoring the machine files: {e}")
+            sys.exit(1)
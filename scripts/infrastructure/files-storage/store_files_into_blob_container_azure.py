@@ -1,51 +1,224 @@
-import logging
 import os
+import sys
+import json
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from pack_machine_files import pack_machine_files, ARCHIVE_EXTENSION, MANIFEST_EXTENSION
+
+MANIFEST_FILE_NAME = "_blob_upload_manifest.json"
+# The source files and the machine archives, the only files uploaded from the data directory. The Spark outputs
+# written next to them, e.g. the part files, _SUCCESS and .crc of the Parquet directories, can be regenerated.
+UPLOADED_FILE_EXTENSIONS = ('.xlsx', '.csv', ARCHIVE_EXTENSION, MANIFEST_EXTENSION)
+# The directories of the data directory rebuilt from the source files: the machine CSV files, packed into the
+# archives, and the Spark outputs of the populate job.
+DERIVED_DIRECTORY_NAMES = ('machines', 'machines_parquet', 'excel_parquet', 'dim_time_parquet')
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TIMEOUT = 10 * 60
 
-def upload_to_azure_blob(account_name, account_key, container_name, blob_name, file_path):
+def get_blob_service_client(account_name, account_key, account_url=None, block_size=DEFAULT_BLOCK_SIZE):
     """
-    Uploads a file to an Azure Blob Storage container with logging. It will persist all the files version history of the
-    supply chain and sales CSV/Excel data in a cool level storage tier in order to prioritize high availability against
-    low latency access to the resources. This will ensure that none of the files are corrupted in addition of the replication
-    in a LRS (Local Redundant Storage) strategy.
+    Returns the Blob service client shared by every upload.
+
+    The files larger than `block_size` are uploaded as staged blocks of that size, committed once all of them are sent,
+    instead of a single stream. The account URL defaults to the Azure one of the account, and can point to a local
+    Azurite emulator instead, e.g. http://127.0.0.1:10000/devstoreaccount1.
     """
+    return BlobServiceClient(
+        account_url=account_url or f"https://{account_name}.blob.core.windows.net",
+        credential=account_key,
+        max_block_size=block_size,
+        max_single_put_size=block_size
+    )
+
+def hash_file_md5(file_path):
+    """Returns the MD5 digest of a file, the hash stored by Azure in the Content-MD5 property of a blob."""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.digest()
 
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
     try:
-        logging.info("Connecting to Azure Blob Storage...")
-        blob_service_client = BlobServiceClient(
-            account_url=f"https://{account_name}.blob.core.windows.net", 
-            credential=account_key
-        )
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring the unreadable upload manifest {manifest_path}: {e}")
+        return {}
+
+def save_manifest(manifest_path, manifest):
+    """Writes the upload manifest atomically, so that an interrupted run leaves the former one intact."""
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+class BlobDirectoryUploader:
+    """
+    Uploads the files of a directory tree to an Azure Blob Storage container with a single shared client, a bounded pool
+    of concurrent file uploads, and the large files split into blocks uploaded in parallel.
+
+    It will persist all the files version history of the supply chain and sales CSV/Excel data in a cool level storage tier
+    in order to prioritize high availability against low latency access to the resources: before a changed file replaces
+    its blob, the former content is kept as a snapshot of the blob, listed along with it. The unchanged files are skipped:
+    a local manifest keeps the size, modification time and MD5 of every uploaded file, so that only the new or modified
+    files are hashed again, and a file is only sent when its MD5 differs from the Content-MD5 property of its blob.
+    """
 
-        logging.info(f"Creating blob client for container: {container_name}, blob: {blob_name}...")
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    def __init__(self, blob_service_client, container_name, manifest_path, max_workers=4, block_concurrency=4):
+        """
+        Initializes the BlobDirectoryUploader.
 
-        timeout = 10 * 60
+        :param blob_service_client: The Blob service client, or any object with the same interface, e.g. a local stand-in.
+        :param container_name: The name of the container the files are uploaded to.
+        :param manifest_path: The path of the local JSON manifest of the uploaded files.
+        :param max_workers: The number of files uploaded concurrently.
+        :param block_concurrency: The number of blocks of a large file uploaded in parallel.
+        """
+        self.blob_service_client = blob_service_client
+        self.container_name = container_name
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.block_concurrency = block_concurrency
+        self.manifest = load_manifest(manifest_path)
+        self.lock = threading.Lock()
 
-        logging.info(f"Uploading file '{file_path}' to Azure Blob Storage...")
-        with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, blob_type="BlockBlob", timeout=timeout)
-        
-        logging.info(f"File '{file_path}' successfully uploaded as '{blob_name}' in container '{container_name}'.")
-    
-    except ResourceExistsError:
-        logging.info(f"File '{file_path}' already exists in container '{container_name}'. Skipping upload.")
+    def get_local_md5(self, blob_name, file_path):
+        """Returns the MD5 of a file, read from the manifest when its size and modification time didn't change."""
+        stat = os.stat(file_path)
+        with self.lock:
+            entry = self.manifest.get(blob_name)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return base64.b64decode(entry['md5']), stat
+        return hash_file_md5(file_path), stat
 
-    except Exception as e:
-        logging.error(f"Error occurred during blob upload: {e}")
+    def get_blob_properties(self, blob_client):
+        """Returns the properties of a blob, None if the blob doesn't exist."""
+        try:
+            return blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
 
-def upload_directory(account_name, account_key, container_name, directory_path):
-    for item_name in os.listdir(directory_path):
-        item_path = os.path.join(directory_path, item_name)
+    def get_blob_md5(self, blob_properties):
+        """Returns the Content-MD5 property of a blob, None if the blob doesn't exist or has none."""
+        content_md5 = blob_properties.content_settings.content_md5 if blob_properties is not None else None
+        return bytes(content_md5) if content_md5 else None
 
-        if os.path.isfile(item_path):
-            logging.info(f"Uploading file: {item_name}...")
-            upload_to_azure_blob(account_name, account_key, container_name, item_name, item_path)
-        elif os.path.isdir(item_path):
-            logging.info(f"Entering directory: {item_name}...")
-            upload_directory(account_name, account_key, container_name, item_path)
+    def upload_file(self, blob_name, file_path):
+        """
+        Uploads a file as a block blob, unless the blob already holds the same content. When the blob holds another content,
+        a snapshot of it is taken first, so that replacing it keeps the former version.
+
+        The MD5 of the file is set as the Content-MD5 of the blob, since Azure doesn't compute it for a blob committed from blocks.
+
+        :return: True if the file was uploaded, False if it was skipped as unchanged.
+        """
+        local_md5, stat = self.get_local_md5(blob_name, file_path)
+        blob_client = self.blob_service_client.get_blob_client(container=self.container_name, blob=blob_name)
+
+        blob_properties = self.get_blob_properties(blob_client)
+        if self.get_blob_md5(blob_properties) == local_md5:
+            logging.info(f"File '{file_path}' is unchanged in container '{self.container_name}'. Skipping upload.")
+            uploaded = False
+        else:
+            if blob_properties is not None:
+                snapshot = blob_client.create_snapshot()
+                logging.info(f"Kept the former version of '{blob_name}' as its snapshot {snapshot['snapshot']}.")
+            logging.info(f"Uploading file '{file_path}' to Azure Blob Storage...")
+            with open(file_path, "rb") as data:
+                blob_client.upload_blob(
+                    data,
+                    blob_type="BlockBlob",
+                    overwrite=blob_properties is not None,
+                    length=stat.st_size,
+                    max_concurrency=self.block_concurrency,
+                    content_settings=ContentSettings(content_md5=bytearray(local_md5)),
+                    timeout=UPLOAD_TIMEOUT
+                )
+            logging.info(f"File '{file_path}' successfully uploaded as '{blob_name}' in container '{self.container_name}'.")
+            uploaded = True
+
+        with self.lock:
+            self.manifest[blob_name] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'md5': base64.b64encode(local_md5).decode(),
+            }
+        return uploaded
+
+    def list_files(self, directory_path, excluded_paths=(), included_extensions=None):
+        """
+        Returns the (blob name, file path) pairs of the files of a directory tree, out of the excluded directories, and
+        restricted to the `included_extensions` when given. The blobs are named after the file names, as the former uploads
+        were, so a file name found again in another directory is skipped.
+        """
+        excluded_paths = {os.path.abspath(path) for path in excluded_paths}
+        files = {}
+        for root, directory_names, file_names in os.walk(directory_path):
+            directory_names[:] = sorted(name for name in directory_names if os.path.abspath(os.path.join(root, name)) not in excluded_paths)
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root, file_name)
+                if os.path.abspath(file_path) in (os.path.abspath(self.manifest_path), os.path.abspath(f"{self.manifest_path}.tmp")):
+                    continue
+                if included_extensions is not None and not file_name.endswith(tuple(included_extensions)):
+                    continue
+                if file_name in files:
+                    logging.warning(f"Skipping '{file_path}': the blob '{file_name}' is already uploaded from '{files[file_name]}'.")
+                    continue
+                files[file_name] = file_path
+        return list(files.items())
+
+    def create_container(self):
+        try:
+            self.blob_service_client.create_container(self.container_name)
+            logging.info(f"Created container '{self.container_name}'.")
+        except ResourceExistsError:
+            pass
+
+    def upload_directory(self, directory_path, excluded_paths=(), included_extensions=None):
+        """
+        Uploads the files of a directory tree concurrently, then saves the manifest.
+
+        :param directory_path: The directory to upload.
+        :param excluded_paths: The directories of the tree not to upload.
+        :param included_extensions: The extensions of the files to upload, every file when None.
+        :return: Dictionary with the number of 'uploaded', 'skipped' and 'failed' files.
+        """
+        self.create_container()
+        counts = {'uploaded': 0, 'skipped': 0, 'failed': 0}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.upload_file, blob_name, file_path): file_path for blob_name, file_path in self.list_files(directory_path, excluded_paths, included_extensions)}
+            for future in as_completed(futures):
+                try:
+                    counts['uploaded' if future.result() else 'skipped'] += 1
+                except Exception as e:
+                    counts['failed'] += 1
+                    logging.error(f"Error occurred during blob upload of '{futures[future]}': {e}")
+
+        save_manifest(self.manifest_path, self.manifest)
+        logging.info(f"Uploaded {counts['uploaded']} files, skipped {counts['skipped']} unchanged files, {counts['failed']} failed.")
+        return counts
+
+def upload_directory(account_name, account_key, container_name, directory_path, account_url=None, manifest_path=None,
+                     max_workers=4, block_size=DEFAULT_BLOCK_SIZE, block_concurrency=4, excluded_paths=(), included_extensions=None):
+    blob_service_client = get_blob_service_client(account_name, account_key, account_url, block_size)
+    uploader = BlobDirectoryUploader(
+        blob_service_client,
+        container_name,
+        manifest_path or os.path.join(directory_path, MANIFEST_FILE_NAME),
+        max_workers=max_workers,
+        block_concurrency=block_concurrency
+    )
+    return uploader.upload_directory(directory_path, excluded_paths, included_extensions)
 
 if __name__ == "__main__":
     log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'logs', 'store_files_into_blob_container_azure.log'))
@@ -62,6 +235,21 @@ if __name__ == "__main__":
     account_name = os.getenv('AZURE_BLOB_STORAGE_ACCOUNT')
     account_key = os.getenv('AZURE_BLOB_ACCESS_KEY')
     container_name = os.getenv('AZURE_CONTAINER_NAME')
+    account_url = os.getenv('AZURE_BLOB_ACCOUNT_URL') or None
+    max_workers = int(os.getenv('AZURE_UPLOAD_WORKERS') or 4)
+    block_size = int(float(os.getenv('AZURE_UPLOAD_BLOCK_SIZE_MB') or 8) * 1024 * 1024)
+    block_concurrency = int(os.getenv('AZURE_UPLOAD_BLOCK_CONCURRENCY') or 4)
     data_directory = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data')
+    machines_directory = os.path.join(data_directory, 'machines')
+
+    # The machine CSV files are only uploaded through their archives, so a day that failed to be packed fails the job.
+    _, failed_days = pack_machine_files(machines_directory, os.path.join(data_directory, 'archives', 'machines'))
+    counts = upload_directory(account_name, account_key, container_name, data_directory, account_url,
+                              max_workers=max_workers, block_size=block_size, block_concurrency=block_concurrency,
+                              excluded_paths=[os.path.join(data_directory, name) for name in DERIVED_DIRECTORY_NAMES],
+                              included_extensions=UPLOADED_FILE_EXTENSIONS)
+    if failed_days:
+        logging.error(f"The machine files of {', '.join(failed_days)} couldn't be packed, and weren't uploaded.")
+    if counts['failed'] or failed_days:
+        sys.exit(1)
 
-    upload_directory(account_name, account_key, container_name, data_directory)
@@ -1,27 +1,202 @@
 import argparse
+import json
 import logging
 import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 import os
 
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+def load_jobs_dag(dag_path):
+    """
+    Loads the jobs DAG declared in a JSON file, mapping each job name to its script 'path', the jobs it 'depends_on',
+    and the 'cpus' and 'memory_mb' it needs.
+
+    :raises ValueError: If a job depends on an undeclared job, or if the dependencies form a cycle.
+    """
+    with open(dag_path, 'r') as dag_file:
+        jobs = json.load(dag_file)['jobs']
+    for name, job in jobs.items():
+        job.setdefault('depends_on', [])
+        job.setdefault('cpus', 1)
+        job.setdefault('memory_mb', 0)
+        unknown_jobs = [dependency for dependency in job['depends_on'] if dependency not in jobs]
+        if unknown_jobs:
+            raise ValueError(f"The job {name} depends on the undeclared jobs {unknown_jobs}.")
+    get_jobs_order(jobs)
+    return jobs
+
+def get_jobs_order(jobs):
+    """Returns the job names in a topological order of their dependencies, keeping the declaration order otherwise."""
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"The job {name} is part of a dependency cycle.")
+        visiting.add(name)
+        for dependency in jobs[name]['depends_on']:
+            visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in jobs:
+        visit(name)
+    return order
+
+def get_exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
 def run_job(job_path, job_args):
-    """Executes a Python job with additional arguments."""
+    """
+    Executes a Python job with additional arguments, and measures its wall time and, where the platform reports the
+    resource usage of a child process, its CPU time and peak memory.
+
+    :return: Dictionary of the job 'status', 'returncode', 'wall_time_s', 'cpu_time_s' and 'max_rss_mb'.
+    """
+    started_at = time.perf_counter()
+    result = {'status': FAILED, 'returncode': None, 'wall_time_s': None, 'cpu_time_s': None, 'max_rss_mb': None}
     try:
-        subprocess.run([sys.executable, job_path] + job_args, check=True)
-        logging.info(f"Executed {job_path} successfully with arguments {job_args}.")
-    except subprocess.CalledProcessError as e:
+        process = subprocess.Popen([sys.executable, job_path] + job_args)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = get_exit_code(status)
+            result['cpu_time_s'] = round(usage.ru_utime + usage.ru_stime, 3)
+            result['max_rss_mb'] = round(usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+        else:
+            process.wait()
+        result['returncode'] = process.returncode
+        if process.returncode == 0:
+            result['status'] = SUCCEEDED
+            logging.info(f"Executed {job_path} successfully with arguments {job_args}.")
+        else:
+            logging.error(f"Error executing {job_path}: {subprocess.CalledProcessError(process.returncode, [sys.executable, job_path] + job_args)}")
+    except OSError as e:
         logging.error(f"Error executing {job_path}: {e}")
-        return e
+    result['wall_time_s'] = round(time.perf_counter() - started_at, 3)
+    return result
+
+class JobScheduler:
+    """
+    Runs the jobs of a DAG as subprocesses, each one once all of its dependencies succeeded, and the independent ones
+    concurrently as long as their declared CPUs and memory fit in the budget. A job needing more than the whole budget
+    runs alone.
+
+    When a job fails, its dependents are skipped while the other jobs go on, or with `halt_on_failure` no job is started
+    anymore. The status, wall time and resource usage of every job are saved into a state file after each job, so that
+    a resumed run only executes the jobs that didn't succeed in the former one.
+    """
+
+    def __init__(self, jobs, job_args, state_path, max_cpus=None, max_memory_mb=None, halt_on_failure=False):
+        """
+        Initializes the JobScheduler.
+
+        :param jobs: The jobs DAG, as returned by `load_jobs_dag`.
+        :param job_args: The arguments passed to every job.
+        :param state_path: The path of the JSON file recording the result of every job.
+        :param max_cpus: The number of CPUs the running jobs can declare in total, the machine CPU count by default.
+        :param max_memory_mb: The memory in MB the running jobs can declare in total, unbounded when None.
+        :param halt_on_failure: Stops starting jobs after the first failure, instead of only skipping its dependents.
+        """
+        self.jobs = jobs
+        self.job_args = job_args
+        self.state_path = state_path
+        self.max_cpus = max_cpus or os.cpu_count() or 1
+        self.max_memory_mb = max_memory_mb
+        self.halt_on_failure = halt_on_failure
+        self.results = {}
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r') as state_file:
+            return json.load(state_file).get('jobs', {})
+
+    def save_state(self):
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, 'w') as state_file:
+            json.dump({'jobs': self.results}, state_file, indent=2)
+        os.replace(temporary_path, self.state_path)
+
+    def fits_budget(self, job, used_cpus, used_memory_mb, running_count):
+        if running_count == 0:
+            return True
+        if used_cpus + job['cpus'] > self.max_cpus:
+            return False
+        return self.max_memory_mb is None or used_memory_mb + job['memory_mb'] <= self.max_memory_mb
+
+    def skip_dependents(self, failed_name):
+        for name in get_jobs_order(self.jobs):
+            if name not in self.results and any(self.results.get(dependency, {}).get('status') in (FAILED, SKIPPED)
+                                                 for dependency in self.jobs[name]['depends_on']):
+                self.results[name] = {'status': SKIPPED}
+                logging.warning(f"Skipping {name}: its dependency {failed_name} didn't succeed.")
+
+    def run(self, resume=False):
+        """
+        Runs the jobs DAG.
+
+        :param resume: Keeps the jobs that succeeded in the former run, and only runs the other ones.
+        :return: Dictionary mapping each job name to its result, with a 'status' of succeeded, failed or skipped.
+        """
+        self.results = {}
+        if resume:
+            self.results = {name: result for name, result in self.load_state().items() if name in self.jobs and result.get('status') == SUCCEEDED}
+            if self.results:
+                logging.info(f"Resuming the run, keeping the succeeded jobs {list(self.results)}.")
+
+        order = get_jobs_order(self.jobs)
+        running = {}
+        halted = False
+        with ThreadPoolExecutor(max_workers=len(self.jobs) or 1) as executor:
+            while True:
+                used_cpus = sum(self.jobs[name]['cpus'] for name in running.values())
+                used_memory_mb = sum(self.jobs[name]['memory_mb'] for name in running.values())
+                for name in order if not halted else []:
+                    job = self.jobs[name]
+                    if name in self.results or name in running.values():
+                        continue
+                    if not all(self.results.get(dependency, {}).get('status') == SUCCEEDED for dependency in job['depends_on']):
+                        continue
+                    if not self.fits_budget(job, used_cpus, used_memory_mb, len(running)):
+                        continue
+                    logging.info(f"Starting {name} ({job['path']}).")
+                    running[executor.submit(run_job, job['path'], self.job_args)] = name
+                    used_cpus += job['cpus']
+                    used_memory_mb += job['memory_mb']
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+                    logging.info(f"{name} {self.results[name]['status']} in {self.results[name]['wall_time_s']}s "
+                                 f"(CPU time: {self.results[name]['cpu_time_s']}s, max RSS: {self.results[name]['max_rss_mb']}MB).")
+                    if self.results[name]['status'] == FAILED:
+                        if self.halt_on_failure:
+                            halted = True
+                            logging.error(f"Halting the run after the failure of {name}.")
+                        self.skip_dependents(name)
+                self.save_state()
 
-def execute_jobs_concurrently(jobs, job_args):
-    """Executes jobs concurrently using ThreadPoolExecutor."""
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(run_job, job, job_args) for job in jobs]
+        for name in order:
+            if name not in self.results:
+                self.results[name] = {'status': SKIPPED}
+        self.save_state()
+        return self.results
 
-        for future in futures:
-            future.result()
+def get_flat_jobs_dag(job_paths):
+    """Returns a DAG of jobs without any dependency between them, as the jobs passed on the command line."""
+    return {job_path: {'path': job_path, 'depends_on': [], 'cpus': 1, 'memory_mb': 0} for job_path in job_paths}
 
 if __name__ == "__main__":
     log_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'logs', 'setup.log'))
@@ -37,9 +212,19 @@ if __name__ == "__main__":
     env_path = os.path.join(os.path.dirname(__file__), '.env')
     load_dotenv(dotenv_path=env_path)
 
-    parser = argparse.ArgumentParser(description="Run child Python jobs with optional arguments using concurrent threading.")
-    parser.add_argument('jobs', nargs='+', help="List of jobs to run concurrently.")
+    parser = argparse.ArgumentParser(description="Run child Python jobs with optional arguments, following the dependencies of a jobs DAG.")
+    parser.add_argument('jobs', nargs='*', help="List of independent jobs to run concurrently, instead of the jobs DAG.")
+    parser.add_argument('--dag', default=os.path.join(os.path.dirname(__file__), 'jobs_dag.json'), help="The JSON file declaring the jobs DAG.")
     parser.add_argument('--job_args', nargs='*', help="Optional arguments to pass to each job.", default=[])
+    parser.add_argument('--max_cpus', type=int, default=int(os.getenv('JOBS_MAX_CPUS') or 0) or None, help="The CPU budget of the running jobs.")
+    parser.add_argument('--max_memory_mb', type=int, default=int(os.getenv('JOBS_MAX_MEMORY_MB') or 0) or None, help="The memory budget in MB of the running jobs.")
+    parser.add_argument('--halt_on_failure', action='store_true', help="Start no more jobs after a failure, instead of only skipping its dependents.")
+    parser.add_argument('--resume', action='store_true', help="Only run the jobs that didn't succeed in the former run.")
     args = parser.parse_args()
 
-    execute_jobs_concurrently(args.jobs, args.job_args)
+    jobs = get_flat_jobs_dag(args.jobs) if args.jobs else load_jobs_dag(args.dag)
+    state_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'logs', 'setup_state.json'))
+    scheduler = JobScheduler(jobs, args.job_args, state_path, args.max_cpus, args.max_memory_mb, args.halt_on_failure)
+    results = scheduler.run(resume=args.resume)
+    if any(result['status'] != SUCCEEDED for result in results.values()):
+        sys.exit(1)
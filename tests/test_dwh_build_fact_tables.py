@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import sys
+from datetime import date
+
+import pytest
+
+pytest.importorskip('pyspark')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'dwh'))
+from pyspark.sql import SparkSession
+from dwh_build_fact_tables import build_fact_supply_chain, build_fact_sales
+from dwh_fact_measures_sql import get_supply_chain_measures_sql, get_sales_measures_sql
+
+SUPPLY_CHAIN_SCHEMA = ('machineId INT, partId INT, materialId INT, timeId INT, materialPrice DOUBLE, materialPriceDate DATE, '
+                       'partDefaultPrice DOUBLE, timeOfProduction STRING, isDamaged BOOLEAN')
+SALES_SCHEMA = 'partId INT, contractId INT, cash DOUBLE, date DATE'
+PRICE_DATE = date(2024, 1, 1)
+ODS_DATABASE = 'ODS_PRODUCTION'
+
+@pytest.fixture(scope='module')
+def spark():
+    spark = SparkSession.builder \
+                        .appName("NamkinProductionDwhFactTablesTests") \
+                        .master("local[1]") \
+                        .config("spark.sql.shuffle.partitions", "1") \
+                        .getOrCreate()
+    yield spark
+    spark.stop()
+
+@pytest.fixture
+def supply_chain_df(spark):
+    return spark.createDataFrame([
+        # 20240101 holds a damaged unit, and a unit without machine.
+        (1, 1, 1, 20240101, 2.0, PRICE_DATE, 10.0, '08:00:00', False),
+        (1, 2, 1, 20240101, 2.0, PRICE_DATE, 5.0, '09:00:00', True),
+        (None, 1, 1, 20240101, 2.0, PRICE_DATE, 10.0, '10:00:00', False),
+        # 20240102 holds no damaged unit.
+        (2, 1, 1, 20240102, 2.0, PRICE_DATE, 10.0, '08:00:00', False),
+        # A damaged unit without timeId.
+        (1, 1, 1, None, 2.0, PRICE_DATE, 10.0, '11:00:00', True),
+    ], SUPPLY_CHAIN_SCHEMA)
+
+@pytest.fixture
+def sales_df(spark):
+    return spark.createDataFrame([
+        (1, 1, 100.0, date(2024, 1, 1)),
+        (1, 1, 100.0, date(2024, 1, 1)),
+        (1, 3, 40.0, date(2024, 1, 2)),
+        (2, 2, 50.0, date(2024, 1, 3)),
+        (1, 1, 20.0, None),
+    ], SALES_SCHEMA)
+
+def to_sql_value(value):
+    return value.isoformat() if isinstance(value, date) else int(value) if isinstance(value, bool) else value
+
+def normalize_rows(rows):
+    """Sorts rows with their dates as ISO strings and their doubles rounded, so that Spark and SQLite rows compare."""
+    return sorted(tuple(round(value, 6) if isinstance(value, float) else to_sql_value(value) for value in row) for row in rows)
+
+def run_measures_sql(query, supply_chain_df, sales_df, time_ids=None):
+    """
+    Runs a SQL measures query on an in-memory SQLite copy of the ODS fact DataFrames. SQLite reads the bracketed
+    T-SQL identifiers as is, the ODS database prefix is dropped and YEAR is registered as a function.
+    """
+    connection = sqlite3.connect(':memory:')
+    connection.create_function('YEAR', 1, lambda value: int(value[:4]) if value is not None else None)
+    for table_name, df in (('fact_supply_chain', supply_chain_df), ('fact_sales', sales_df)):
+        connection.execute(f"CREATE TABLE {table_name} ({', '.join(df.columns)})")
+        connection.executemany(f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(df.columns))})",
+                               [tuple(to_sql_value(value) for value in row) for row in df.collect()])
+    connection.execute("CREATE TABLE refresh_time_ids (timeId INT)")
+    connection.executemany("INSERT INTO refresh_time_ids VALUES (?)", [(time_id,) for time_id in time_ids or ()])
+    try:
+        return connection.execute(query.replace(f"[{ODS_DATABASE}].[dbo].", '')).fetchall()
+    finally:
+        connection.close()
+
+def test_build_fact_supply_chain(supply_chain_df):
+    rows = build_fact_supply_chain(supply_chain_df).collect()
+
+    assert sorted(tuple(row) for row in rows) == [
+        (1, 1, 1, 20240101, 2.0, PRICE_DATE, 10.0, 2, 2, 1),
+        (1, 2, 1, 20240101, 2.0, PRICE_DATE, 5.0, 2, 1, 1),
+    ]
+
+def test_build_fact_supply_chain_distinct_rows(spark, supply_chain_df):
+    duplicated_df = supply_chain_df.unionAll(supply_chain_df.where("timeId = 20240101 AND partId = 2"))
+    rows = build_fact_supply_chain(duplicated_df).collect()
+
+    assert sorted(tuple(row) for row in rows) == [
+        (1, 1, 1, 20240101, 2.0, PRICE_DATE, 10.0, 3, 2, 2),
+        (1, 2, 1, 20240101, 2.0, PRICE_DATE, 5.0, 3, 2, 2),
+    ]
+
+def test_build_fact_sales(sales_df, supply_chain_df):
+    rows = build_fact_sales(sales_df, supply_chain_df).collect()
+
+    # The duplicate sales are both kept and counted, the sales of a day without production or without date are dropped.
+    assert sorted(tuple(row) for row in rows) == [
+        (1, 1, 20240101, 100.0, date(2024, 1, 1), 2, 100.0 - (2.0 + 25.0)),
+        (1, 1, 20240101, 100.0, date(2024, 1, 1), 2, 100.0 - (2.0 + 25.0)),
+        (1, 3, 20240102, 40.0, date(2024, 1, 2), 1, 40.0 - (2.0 + 10.0)),
+    ]
+
+def test_builders_match_the_sql_measures(supply_chain_df, sales_df):
+    supply_chain_rows = run_measures_sql(get_supply_chain_measures_sql(ODS_DATABASE), supply_chain_df, sales_df)
+    sales_rows = run_measures_sql(get_sales_measures_sql(ODS_DATABASE), supply_chain_df, sales_df)
+
+    assert normalize_rows(build_fact_supply_chain(supply_chain_df).collect()) == normalize_rows(supply_chain_rows)
+    assert normalize_rows(build_fact_sales(sales_df, supply_chain_df).collect()) == normalize_rows(sales_rows)
+    assert len(supply_chain_rows) == 2 and len(sales_rows) == 3
+
+def test_builders_match_the_sql_measures_of_refreshed_slices(supply_chain_df, sales_df):
+    # The measures restricted to some timeIds, as recomputed by the incremental refresh, are the slices of the full build.
+    time_ids = [20240101]
+    supply_chain_rows = run_measures_sql(get_supply_chain_measures_sql(ODS_DATABASE, 'refresh_time_ids'), supply_chain_df, sales_df, time_ids)
+    sales_rows = run_measures_sql(get_sales_measures_sql(ODS_DATABASE, 'refresh_time_ids'), supply_chain_df, sales_df, time_ids)
+
+    built_supply_chain_rows = [row for row in build_fact_supply_chain(supply_chain_df).collect() if row['timeId'] in time_ids]
+    built_sales_rows = [row for row in build_fact_sales(sales_df, supply_chain_df).collect() if row['timeId'] in time_ids]
+    assert normalize_rows(built_supply_chain_rows) == normalize_rows(supply_chain_rows)
+    assert normalize_rows(built_sales_rows) == normalize_rows(sales_rows)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pyodbc')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'dwh'))
+from dwh_refresh_fact_tables import DwhIncrementalRefresher
+from ods.ods_schema_registry import ODS_LAYER, DWH_LAYER, get_table_indexes
+
+class FakeDwhManager:
+    """A stand-in of a DataWarehouseManager answering the rowVersion column checks and recording the other statements."""
+
+    def __init__(self, row_version_tables):
+        self.row_version_tables = row_version_tables
+        self.queries = []
+
+    def execute_query(self, query, params=None):
+        self.queries.append(query)
+        if 'COL_LENGTH' in query and query.startswith('SELECT'):
+            return [(8 if any(f"[{table_name}]" in query for table_name in self.row_version_tables) else None,)]
+        return []
+
+def test_refresh_fails_without_the_row_version_column():
+    dwh_manager = FakeDwhManager(['fact_supply_chain'])
+
+    with pytest.raises(RuntimeError, match="fact_sales table has no rowVersion column"):
+        DwhIncrementalRefresher(dwh_manager).prepare_refresh()
+    # The refresh never alters the ODS tables itself.
+    assert not any('ALTER TABLE [ODS_PRODUCTION]' in query or 'CREATE NONCLUSTERED INDEX' in query for query in dwh_manager.queries)
+
+def test_prepare_refresh_with_the_row_version_column():
+    dwh_manager = FakeDwhManager(['fact_supply_chain', 'fact_sales'])
+    DwhIncrementalRefresher(dwh_manager).prepare_refresh()
+
+    assert any('CREATE TABLE dwh_refresh_watermarks' in query for query in dwh_manager.queries)
+
+def get_indexed_columns(table_name, layer):
+    return [list(index.columns) for index in get_table_indexes(table_name, layer)]
+
+def test_row_version_indexes_are_declared_for_the_ods_only():
+    assert get_indexed_columns('fact_supply_chain', ODS_LAYER) == [['trscUnitId', 'materialId'], ['rowVersion'], ['timeId'], ['partId', 'materialPriceDate']]
+    assert get_indexed_columns('fact_sales', ODS_LAYER) == [['rowVersion']]
+    assert get_indexed_columns('fact_supply_chain', DWH_LAYER) == [['timeId']]
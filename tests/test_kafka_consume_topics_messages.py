@@ -0,0 +1,88 @@
+import os
+import sys
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('kafka')
+pytest.importorskip('pyodbc')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+from kafka.structs import TopicPartition
+import kafka_consume_topics_messages
+from kafka_consume_topics_messages import KafkaConsumerClient
+
+MACHINE_PARTITION = TopicPartition('machine', 0)
+MATERIAL_PARTITION = TopicPartition('material', 0)
+
+class FakeKafkaConsumer:
+    """A stand-in of a KafkaConsumer recording the seeks and the committed offsets."""
+
+    def __init__(self, **configs):
+        self.seeks = []
+        self.commits = []
+
+    def assignment(self):
+        return {MACHINE_PARTITION, MATERIAL_PARTITION}
+
+    def seek(self, topic_partition, offset):
+        self.seeks.append((topic_partition, offset))
+
+    def commit(self, offsets):
+        self.commits.append({topic_partition: offset_and_metadata.offset for topic_partition, offset_and_metadata in offsets.items()})
+
+class FakeOdsManager:
+    def __init__(self):
+        self.transactions = []
+
+    @contextmanager
+    def transaction(self):
+        self.transactions.append('begin')
+        try:
+            yield self
+        except Exception:
+            self.transactions.append('rollback')
+            raise
+        self.transactions.append('commit')
+
+def decoded(topic_partition, messages):
+    return [(SimpleNamespace(topic=topic_partition.topic, partition=topic_partition.partition, offset=offset), message)
+            for offset, message in enumerate(messages)]
+
+def test_replay_batch_stops_each_partition_at_its_first_failed_message(monkeypatch):
+    replayed_messages = []
+
+    def process(ods_manager, topic_name, message):
+        if message == 'fail':
+            raise RuntimeError("The message couldn't be written.")
+        replayed_messages.append((topic_name, message))
+    monkeypatch.setattr(kafka_consume_topics_messages, 'KafkaConsumer', FakeKafkaConsumer)
+    monkeypatch.setattr(kafka_consume_topics_messages, 'execute_ruling_topic_processor', process)
+
+    consumer_client = KafkaConsumerClient(['localhost:9092'], ['machine', 'material'], batch_size=10)
+    ods_manager = FakeOdsManager()
+    consumer_client.replay_batch(ods_manager, {
+        # The machine partition fails at its offset 2, after an undecodable record.
+        MACHINE_PARTITION: decoded(MACHINE_PARTITION, ['m0', None, 'fail', 'm3']),
+        MATERIAL_PARTITION: decoded(MATERIAL_PARTITION, ['t0', 't1']),
+    })
+
+    # The material partition is replayed first, and the machine partition isn't replayed past its failed message.
+    assert replayed_messages == [('material', 't0'), ('material', 't1'), ('machine', 'm0')]
+    assert ods_manager.transactions.count('rollback') == 1
+    assert consumer_client.consumer.seeks == [(MACHINE_PARTITION, 2)]
+    assert consumer_client.consumer.commits == [{MATERIAL_PARTITION: 2, MACHINE_PARTITION: 2}]
+
+def test_replay_batch_failing_on_the_first_message_commits_nothing_of_its_partition(monkeypatch):
+    def process(ods_manager, topic_name, message):
+        raise RuntimeError("The message couldn't be written.")
+    monkeypatch.setattr(kafka_consume_topics_messages, 'KafkaConsumer', FakeKafkaConsumer)
+    monkeypatch.setattr(kafka_consume_topics_messages, 'execute_ruling_topic_processor', process)
+
+    consumer_client = KafkaConsumerClient(['localhost:9092'], ['machine'], batch_size=10)
+    consumer_client.replay_batch(FakeOdsManager(), {MACHINE_PARTITION: decoded(MACHINE_PARTITION, ['m0', 'm1'])})
+
+    assert consumer_client.consumer.seeks == [(MACHINE_PARTITION, 0)]
+    assert consumer_client.consumer.commits == []
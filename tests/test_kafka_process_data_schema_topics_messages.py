@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+from kafka_process_data_schema_topics_messages import process_supply_chain_topic_messages_batch
+from kafka_topic_messages_key_cache import ods_key_caches
+from kafka_topic_messages_schemas import decode_topic_message, parse_datetime
+from kafka_topic_messages_utils import get_max_id_incremented, get_ods_table_id
+
+# (materialId, materialPrice, materialPriceDate, partDefaultPrice, partId) of the fact_supply_chain price rows.
+FACT_PRICES = [
+    (1, 10.5, date(2023, 1, 1), 100.0, 5),
+    (2, 20.0, date(2023, 1, 1), 100.0, 5),
+    (1, 11.0, date(2024, 1, 1), 100.0, 5),
+    (3, 30.0, date(2023, 1, 1), 80.0, 6),
+    (9, 90.0, date(2023, 1, 1), 60.0, 7),
+]
+
+# A fixed batch: known machine and part, missing machine, missing part, a material without operational id,
+# a material missing from dim_material and a part without any price.
+SUPPLY_CHAIN_PAYLOADS = [
+    {'id': 'a0000000-0000-4000-8000-000000000001', 'machineId': 2, 'partId': 5, 'timeOfProduction': '2023-10-10T08:30:00.000Z', 'isDeleted': False, 'var5': False, 'lastUpdate': '2023-10-10T08:30:01.000Z'},
+    {'id': 'a0000000-0000-4000-8000-000000000002', 'machineId': 4, 'partId': 5, 'timeOfProduction': '2024-02-01T10:00:00.000Z', 'isDeleted': False, 'var5': True, 'lastUpdate': '2024-02-01T10:00:01.000Z'},
+    {'id': 'a0000000-0000-4000-8000-000000000003', 'machineId': 2, 'partId': 6, 'timeOfProduction': '2023-05-05T00:00:00.000Z', 'isDeleted': False, 'var5': False, 'lastUpdate': '2023-05-05T00:00:01.000Z'},
+    {'id': 'a0000000-0000-4000-8000-000000000004', 'machineId': 2, 'partId': 7, 'timeOfProduction': '2023-06-06T00:00:00.000Z', 'isDeleted': False, 'var5': False, 'lastUpdate': '2023-06-06T00:00:01.000Z'},
+    {'id': 'a0000000-0000-4000-8000-000000000005', 'machineId': 2, 'partId': 8, 'timeOfProduction': '2023-07-07T00:00:00.000Z', 'isDeleted': False, 'var5': False, 'lastUpdate': '2023-07-07T00:00:01.000Z'},
+]
+
+class FakeSupplyChainOds:
+    """
+    A stand-in of a DataWarehouseManager answering, from the same in-memory tables, both the per-message lookups of the
+    original supply chain processor and the set-based enrichment query, and recording the written records.
+    """
+
+    def __init__(self):
+        self.machines = {2: 20}
+        self.parts = {5: 50}
+        self.materials = {1: 101, 2: None, 3: 103}
+        self.written_records = []
+
+    def fetch_prices(self, part_id, year):
+        return [row[:4] for row in FACT_PRICES if row[4] == part_id and row[2].year == year]
+
+    def execute_query(self, query, params=None, commit=True):
+        if 'VALUES' in query:
+            rows = []
+            for machine_id, part_id, year in zip(params[0::3], params[1::3], params[2::3]):
+                prices = self.fetch_prices(part_id, year) or [(None, None, None, None)]
+                for price in prices:
+                    material_found = 1 if price[0] in self.materials else None
+                    rows.append((machine_id, part_id, year, self.machines.get(machine_id), self.parts.get(part_id))
+                                + price + (material_found, self.materials.get(price[0]), self.next_trsc_material_id()))
+            return rows
+        if 'SELECT DISTINCT' in query:
+            return self.fetch_prices(params[0], int(params[1][:4]))
+        if 'MAX(trscMaterialId)' in query:
+            return [(self.next_trsc_material_id(),)]
+        if 'SELECT trscMaterialId' in query:
+            return [(self.materials[params[0]],)] if params[0] in self.materials else []
+        mapping = self.machines if '[dim_machine]' in query else self.parts
+        if 'MAX(' in query:
+            return [(max(mapping.values()) + 1,)]
+        return [(mapping[params],)] if params in mapping else []
+
+    def next_trsc_material_id(self):
+        return max(trsc_id for trsc_id in self.materials.values() if trsc_id is not None) + 1
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records):
+        self.written_records.extend(records)
+
+def build_baseline_supply_chain_records(ods_manager, message):
+    """The per-message enrichment of the original process_supply_chain_topic_messages, returning its records."""
+    try:
+        materials_fetched = ods_manager.execute_query("SELECT DISTINCT materialId, materialPrice, materialPriceDate, partDefaultPrice "
+                                                      "FROM [ODS_PRODUCTION].[dbo].[fact_supply_chain]", (message['partId'], message['timeOfProduction']))
+        if not materials_fetched:
+            return []
+        tuple_materials = [tuple(material) for material in materials_fetched]
+        for idx, material in enumerate(materials_fetched):
+            trsc_material_id = ods_manager.execute_query("SELECT trscMaterialId FROM [ODS_PRODUCTION].[dbo].[dim_material]", (material[0],))[0][0]
+            operational_material_id = trsc_material_id if trsc_material_id is not None else get_max_id_incremented(ods_manager, 'trscMaterialId', 'dim_material')[0][0] + idx
+            tuple_materials[idx] += (operational_material_id,)
+
+        machine_id = get_ods_table_id(ods_manager, 'machineId', message['machineId'], 'dim_machine')[0][0]
+        part_id = get_ods_table_id(ods_manager, 'partId', message['partId'], 'dim_part_information')[0][0]
+        time_id = int(message['timeOfProduction'].split('T')[0].replace('-', ''))
+        message_values = (machine_id, part_id, time_id, message['machineId'], message['partId'], message['timeOfProduction'], message['var5'], message['lastUpdate'])
+        return [material + message_values for material in tuple_materials]
+    except Exception:
+        return []
+
+@pytest.fixture(autouse=True)
+def no_key_caches():
+    ods_key_caches.clear()
+    yield
+    ods_key_caches.clear()
+
+def test_set_based_enrichment_matches_the_per_message_records():
+    baseline_records = []
+    for payload in SUPPLY_CHAIN_PAYLOADS:
+        baseline_records.extend(build_baseline_supply_chain_records(FakeSupplyChainOds(), payload))
+
+    ods_manager = FakeSupplyChainOds()
+    messages = [decode_topic_message('supply_chain', json.dumps(payload).encode()) for payload in SUPPLY_CHAIN_PAYLOADS]
+    process_supply_chain_topic_messages_batch(ods_manager, messages)
+
+    # The records are the original ones, followed by the unit id they are merged on. Only 'lastUpdate' is decoded,
+    # into the datetime SQL Server casts the raw string to.
+    assert [record[:-1] for record in ods_manager.written_records] == [record[:-1] + (parse_datetime(record[-1]),) for record in baseline_records]
+    unit_ids = [payload['id'] for payload in SUPPLY_CHAIN_PAYLOADS]
+    assert [record[-1] for record in ods_manager.written_records] == [unit_ids[0], unit_ids[0], unit_ids[1], unit_ids[2]]
+    # The missing machine and part got an allocated id, and the material without operational id the next one plus its index.
+    assert ods_manager.written_records[2][5] == 21
+    assert ods_manager.written_records[3][6] == 51
+    assert ods_manager.written_records[1][4] == 105
+    assert ods_manager.written_records[0][10] == '2023-10-10T08:30:00.000Z'
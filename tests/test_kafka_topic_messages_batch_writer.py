@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+from kafka_topic_messages_batch_writer import OdsBatchWriter
+
+MACHINE_FIELDS = ['trscMachineId', 'machineId', 'lastUpdate']
+
+class FakeOdsManager:
+    """A stand-in of a DataWarehouseManager applying the flushed writes to in-memory tables keyed on their first column."""
+
+    def __init__(self):
+        self.tables = {}
+        self.statements = []
+
+    def execute_query(self, query, params=None):
+        self.statements.append(('select', query))
+        if 'fail' in query:
+            raise RuntimeError("The query failed.")
+        return []
+
+    def generate_and_execute_massive_upsert(self, table_name, column_names, records):
+        self.statements.append(('upsert', table_name, [record[0] for record in records]))
+        for record in records:
+            self.tables.setdefault(table_name, {})[record[0]] = record
+
+    def generate_and_execute_massive_insert(self, table_name, column_names, records):
+        self.statements.append(('insert', table_name, [record[0] for record in records]))
+        for record in records:
+            self.tables.setdefault(table_name, {})[record[0]] = record
+
+    def generate_and_execute_massive_delete(self, table_name, key_columns, keys):
+        self.statements.append(('delete', table_name, [key[0] for key in keys]))
+        for key in keys:
+            self.tables.get(table_name, {}).pop(key[0], None)
+
+def test_upsert_delete_upsert_of_a_key_keeps_the_last_write():
+    ods_manager = FakeOdsManager()
+    batch_writer = OdsBatchWriter(ods_manager)
+
+    batch_writer.generate_and_execute_massive_upsert('dim_machine', MACHINE_FIELDS, [(5, 1, 'first')])
+    batch_writer.generate_and_execute_massive_delete('dim_machine', ['trscMachineId'], [(5,)])
+    batch_writer.generate_and_execute_massive_upsert('dim_machine', MACHINE_FIELDS, [(5, 1, 'second')])
+    batch_writer.flush_all()
+
+    # The delete opens a second generation, applied after the first upsert and before the second one.
+    assert ods_manager.statements == [('upsert', 'dim_machine', [5]), ('delete', 'dim_machine', [5]), ('upsert', 'dim_machine', [5])]
+    assert ods_manager.tables['dim_machine'] == {5: (5, 1, 'second')}
+
+def test_upsert_delete_of_a_key_removes_it():
+    ods_manager = FakeOdsManager()
+    batch_writer = OdsBatchWriter(ods_manager)
+
+    batch_writer.generate_and_execute_massive_upsert('dim_machine', MACHINE_FIELDS, [(5, 1, 'first'), (6, 2, 'first')])
+    batch_writer.generate_and_execute_massive_delete('dim_machine', ['trscMachineId'], [(5,)])
+    batch_writer.flush_all()
+
+    assert ods_manager.tables['dim_machine'] == {6: (6, 2, 'first')}
+
+def test_delete_of_another_key_joins_the_generation():
+    ods_manager = FakeOdsManager()
+    batch_writer = OdsBatchWriter(ods_manager)
+
+    batch_writer.generate_and_execute_massive_upsert('dim_machine', MACHINE_FIELDS, [(6, 2, 'first')])
+    batch_writer.generate_and_execute_massive_delete('dim_machine', ['trscMachineId'], [(5,)])
+    batch_writer.generate_and_execute_massive_delete('dim_machine', ['trscMachineId'], [(7,)])
+    batch_writer.flush_all()
+
+    # One generation: its deletes are flushed first, in one statement, then its upserts.
+    assert ods_manager.statements == [('delete', 'dim_machine', [5, 7]), ('upsert', 'dim_machine', [6])]
+
+def test_lookup_flushes_the_tables_it_reads():
+    ods_manager = FakeOdsManager()
+    batch_writer = OdsBatchWriter(ods_manager)
+
+    batch_writer.generate_and_execute_massive_upsert('dim_machine', MACHINE_FIELDS, [(5, 1, 'first')])
+    batch_writer.generate_and_execute_massive_upsert('dim_material', ['trscMaterialId', 'materialId', 'name', 'lastUpdate'], [(3, 1, 'toz', None)])
+    batch_writer.execute_query("SELECT machineId FROM [ODS_PRODUCTION].[dbo].[dim_machine] WHERE trscMachineId = ?", 5)
+
+    assert ods_manager.statements[0] == ('upsert', 'dim_machine', [5])
+    assert batch_writer.pending_tables() == {'dim_material'}
+
+def test_failed_lookup_refuses_the_commit():
+    batch_writer = OdsBatchWriter(FakeOdsManager())
+
+    with pytest.raises(RuntimeError):
+        batch_writer.execute_query("SELECT fail FROM [ODS_PRODUCTION].[dbo].[dim_machine]")
+    with pytest.raises(RuntimeError, match="Refusing to commit"):
+        batch_writer.flush_all()
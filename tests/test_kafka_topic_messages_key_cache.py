@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+from kafka_topic_messages_key_cache import SurrogateKeyCache, ods_key_caches, ods_key_cache_scope, refresh_stale_ods_key_caches
+from kafka_topic_messages_utils import get_ods_table_id
+
+class FakeDimensionManager:
+    """A stand-in of a DataWarehouseManager answering the key lookups of a dimension table holding no row."""
+
+    def __init__(self):
+        self.queries = []
+
+    def execute_query(self, query, params=None, commit=True):
+        self.queries.append(query)
+        return []
+
+class FakeSnapshotManager:
+    """A stand-in of a DataWarehouseManager answering the preload queries of a dimension table whose snapshot rows can be replaced."""
+
+    def __init__(self, mapped_rows, max_id, snapshot_version):
+        self.mapped_rows = mapped_rows
+        self.max_id = max_id
+        self.snapshot_version = snapshot_version
+
+    def execute_query(self, query, params=None, commit=True):
+        if 'MAX(lastUpdate)' in query:
+            return [self.snapshot_version]
+        if 'MAX(partId)' in query:
+            return [(self.max_id,)]
+        return self.mapped_rows
+
+@pytest.fixture
+def part_key_cache():
+    key_cache = SurrogateKeyCache('dim_part_information', 'partId')
+    key_cache.next_id = 1
+    key_cache.complete = True
+    ods_key_caches['dim_part_information'] = key_cache
+    yield key_cache
+    ods_key_caches.clear()
+
+def test_key_cache_scope_caches_keys_once_committed(part_key_cache):
+    ods_manager = FakeDimensionManager()
+    with ods_key_cache_scope():
+        assert get_ods_table_id(ods_manager, 'partId', 7, 'dim_part_information') == [(1,)]
+        assert get_ods_table_id(ods_manager, 'partId', 7, 'dim_part_information') == [(1,)]
+        assert part_key_cache.entries == {}
+
+    assert part_key_cache.entries == {7: 1}
+    assert ods_manager.queries == []
+
+def test_key_cache_scope_drops_keys_on_rollback(part_key_cache):
+    with pytest.raises(RuntimeError):
+        with ods_key_cache_scope():
+            get_ods_table_id(FakeDimensionManager(), 'partId', 7, 'dim_part_information')
+            raise RuntimeError("The transaction was rolled back.")
+
+    assert part_key_cache.entries == {}
+
+def test_fact_lookup_doesnt_allocate_ids(part_key_cache):
+    assert get_ods_table_id(FakeDimensionManager(), 'partId', 7, 'dim_part_information', allocate=False) == [(None,)]
+    assert part_key_cache.entries == {}
+    assert part_key_cache.next_id == 1
+
+def test_key_cache_is_preloaded_again_once_the_snapshot_is_replaced(part_key_cache):
+    ods_manager = FakeSnapshotManager([(7, 11)], 12, (10, '2024-01-01 08:00:00'))
+    assert part_key_cache.preload(ods_manager)
+    assert refresh_stale_ods_key_caches(ods_manager) == []
+
+    # The populate job replaced its rows with more parts, and the consumer allocated an id since the preload.
+    assert part_key_cache.allocate_id() == 12
+    ods_manager.max_id = 30
+    ods_manager.snapshot_version = (28, '2024-01-02 08:00:00')
+    ods_manager.mapped_rows = [(7, 11), (8, 12)]
+    assert refresh_stale_ods_key_caches(ods_manager) == ['dim_part_information']
+    assert part_key_cache.entries == {7: 11, 8: 12}
+    assert part_key_cache.allocate_id() == 30
+
+def test_key_cache_allocator_never_goes_back_when_preloaded_again(part_key_cache):
+    ods_manager = FakeSnapshotManager([], 1, (0, None))
+    part_key_cache.next_id = 40
+    assert part_key_cache.preload(ods_manager)
+    assert part_key_cache.allocate_id() == 40
@@ -0,0 +1,32 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+from kafka_topic_messages_schemas import MachineMessage, MaterialMessage, SupplyChainMessage, decode_topic_message
+
+def test_decode_logged_machine_delete():
+    # Logged in kafka_process_data_schema_topics_messages.log: {'id': 5, 'isDelete': True, 'lastUpdate': '2024-01-11 19:42:19.0000000'}
+    raw_value = b'{"id": 5, "isDelete": true, "lastUpdate": "2024-01-11 19:42:19.0000000"}'
+
+    assert decode_topic_message('machine', raw_value) == MachineMessage(id=5, isDeleted=True, lastUpdate=datetime(2024, 1, 11, 19, 42, 19))
+
+def test_decode_logged_material_upsert():
+    # Logged in kafka_process_data_schema_topics_messages.log: {'name': 'toz', 'id': 3, 'isDelete': False, 'lastUpdate': '2024-01-11 19:50:12.0000000'}
+    raw_value = b'{"name": "toz", "id": 3, "isDelete": false, "lastUpdate": "2024-01-11 19:50:12.0000000"}'
+
+    assert decode_topic_message('material', raw_value) == MaterialMessage(id=3, isDeleted=False, name='toz', lastUpdate=datetime(2024, 1, 11, 19, 50, 12))
+
+def test_decode_message_without_deletion_flag_fails():
+    with pytest.raises(ValueError, match="'isDeleted'"):
+        decode_topic_message('machine', b'{"id": 5, "lastUpdate": "2024-01-11 19:42:19.0000000"}')
+
+def test_decode_supply_chain_keeps_unit_id():
+    raw_value = (b'{"timeOfProduction": "2023-10-10T00:00:00.000Z", "machineId": 2, "partId": 5, "var5": false, "isDelete": false, '
+                 b'"id": "dbde6a6b-26a7-43ed-a2d0-bc0ec97fdc50"}')
+
+    assert decode_topic_message('supply_chain', raw_value) == SupplyChainMessage(
+        id='dbde6a6b-26a7-43ed-a2d0-bc0ec97fdc50', machineId=2, partId=5, timeOfProduction='2023-10-10T00:00:00.000Z',
+        isDeleted=False, var5=False, lastUpdate=None)
@@ -0,0 +1,78 @@
+import os
+import sys
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'kafka-consumer'))
+import kafka_topic_messages_worker_pool
+from kafka_topic_messages_worker_pool import PartitionOffsetTracker, TopicMessageWorkerPool
+
+TOPIC_PARTITION = ('machine', 0)
+
+class FakeOdsManager:
+    @contextmanager
+    def transaction(self):
+        yield self
+
+class FakeOdsPool:
+    @contextmanager
+    def connection(self):
+        yield FakeOdsManager()
+
+def make_record(offset):
+    return SimpleNamespace(topic='machine', partition=0, offset=offset)
+
+def test_tracker_fail_drain_retry():
+    tracker = PartitionOffsetTracker()
+    epochs = {offset: tracker.dispatched(TOPIC_PARTITION, offset) for offset in range(3)}
+    tracker.completed(TOPIC_PARTITION, 0, epochs[0])
+    tracker.failed(TOPIC_PARTITION, 1, epochs[1])
+
+    # The partition is drained: the records from the failed one on are dropped, and the offset stops before it.
+    assert tracker.pending_count([TOPIC_PARTITION]) == 0
+    assert tracker.is_stale(TOPIC_PARTITION, 2, epochs[2])
+    assert tracker.pop_committable() == {TOPIC_PARTITION: 1}
+
+    tracker.forget([TOPIC_PARTITION])
+    retry_epochs = {offset: tracker.dispatched(TOPIC_PARTITION, offset) for offset in (1, 2)}
+
+    # The record 2 still queued from the former epoch is stale, and doesn't complete the record 2 dispatched again.
+    assert tracker.is_stale(TOPIC_PARTITION, 2, epochs[2])
+    assert not tracker.is_stale(TOPIC_PARTITION, 2, retry_epochs[2])
+    tracker.completed(TOPIC_PARTITION, 2, epochs[2])
+    tracker.failed(TOPIC_PARTITION, 2, epochs[2])
+    assert tracker.pending_count([TOPIC_PARTITION]) == 2
+    assert tracker.pop_committable() == {}
+    assert tracker.get_failed() == {}
+
+    tracker.completed(TOPIC_PARTITION, 2, retry_epochs[2])
+    assert tracker.pop_committable() == {}
+    tracker.completed(TOPIC_PARTITION, 1, retry_epochs[1])
+    assert tracker.pop_committable() == {TOPIC_PARTITION: 3}
+
+def test_worker_pool_skips_stale_records_after_retry(monkeypatch):
+    processed_offsets = []
+
+    def process(ods_manager, topic_name, message):
+        if message == 'fail':
+            raise RuntimeError("The record couldn't be written.")
+        processed_offsets.append(message)
+    monkeypatch.setattr(kafka_topic_messages_worker_pool, 'execute_ruling_topic_processor', process)
+
+    worker_pool = TopicMessageWorkerPool(FakeOdsPool(), workers=1)
+    try:
+        worker_pool.dispatch(TOPIC_PARTITION, make_record(0), 'fail')
+        worker_pool.dispatch(TOPIC_PARTITION, make_record(1), 1)
+        assert worker_pool.drain([TOPIC_PARTITION], 5)
+        assert TOPIC_PARTITION in worker_pool.offset_tracker.get_failed()
+
+        # The record 1 of the former epoch may still be queued when the partition is retried from the failed offset.
+        worker_pool.offset_tracker.forget([TOPIC_PARTITION])
+        worker_pool.dispatch(TOPIC_PARTITION, make_record(0), 0)
+        worker_pool.dispatch(TOPIC_PARTITION, make_record(1), 1)
+        assert worker_pool.drain([TOPIC_PARTITION], 5)
+    finally:
+        worker_pool.close()
+
+    assert processed_offsets == [0, 1]
+    assert worker_pool.offset_tracker.pop_committable() == {TOPIC_PARTITION: 2}
@@ -0,0 +1,62 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'ods'))
+from ods_jdbc_export_utils import replace_table_rows
+
+class FakeJdbcConnection:
+    """A stand-in of a java.sql.Connection recording the statements, and failing the ones containing `fail_on`."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.events = []
+
+    def setAutoCommit(self, auto_commit):
+        self.events.append(('autocommit', auto_commit))
+
+    def createStatement(self):
+        return self
+
+    def executeUpdate(self, query):
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("The statement failed.")
+        self.events.append(('update', query))
+        return 3
+
+    def commit(self):
+        self.events.append(('commit',))
+
+    def rollback(self):
+        self.events.append(('rollback',))
+
+    def close(self):
+        pass
+
+def fake_spark(connection):
+    driver_manager = SimpleNamespace(getConnection=lambda jdbc_url: connection)
+    return SimpleNamespace(_jvm=SimpleNamespace(java=SimpleNamespace(sql=SimpleNamespace(DriverManager=driver_manager))))
+
+def test_replace_table_rows_commits_the_delete_and_the_insert_once():
+    connection = FakeJdbcConnection()
+    rows = replace_table_rows(fake_spark(connection), 'jdbc:sqlserver://', 'dim_machine', 'dim_machine_staging',
+                              ['machineId', 'name'], 'trscMachineId IS NULL')
+
+    assert rows == (3, 3)
+    assert connection.events == [
+        ('autocommit', False),
+        ('update', "DELETE FROM dim_machine WHERE trscMachineId IS NULL"),
+        ('update', "INSERT INTO dim_machine ([machineId], [name]) SELECT [machineId], [name] FROM dim_machine_staging"),
+        ('commit',),
+    ]
+
+def test_replace_table_rows_rolls_the_delete_back_when_the_insert_fails():
+    connection = FakeJdbcConnection(fail_on='INSERT')
+
+    with pytest.raises(RuntimeError):
+        replace_table_rows(fake_spark(connection), 'jdbc:sqlserver://', 'dim_machine', 'dim_machine_staging',
+                           ['machineId'], 'trscMachineId IS NULL')
+    assert ('commit',) not in connection.events
+    assert connection.events[-1] == ('rollback',)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pyspark')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs', 'ods'))
+from pyspark.sql import SparkSession
+import ods_populate_tables_star_schema
+from ods_spark_stage_runner import SparkStageRunner
+
+@pytest.fixture(scope='module')
+def spark():
+    spark = SparkSession.builder \
+                        .appName("NamkinProductionOdsPopulateTablesTests") \
+                        .master("local[1]") \
+                        .config("spark.sql.shuffle.partitions", "1") \
+                        .getOrCreate()
+    yield spark
+    spark.stop()
+
+@pytest.fixture
+def runner(spark, tmp_path, monkeypatch):
+    """A runner of the load_sources stage reading the workbooks of the repository data directory, and a compacted supply chain."""
+    machines_parquet_path = tmp_path / 'machines_parquet'
+    spark.createDataFrame([(1, 2, '2024-01-01 08:00:00', False)], 'partId INT, machineId INT, timeOfProduction STRING, isDamaged BOOLEAN') \
+         .write.parquet(str(machines_parquet_path / 'machines_all_parquet'))
+    monkeypatch.setattr(ods_populate_tables_star_schema, 'MACHINES_PARQUET_PATH', str(machines_parquet_path))
+    monkeypatch.setattr(ods_populate_tables_star_schema, 'EXCEL_STAGING_PATH', str(tmp_path / 'excel_parquet'))
+
+    runner = SparkStageRunner(spark)
+    runner.register('load_sources', ods_populate_tables_star_schema.stage_load_sources)
+    yield runner
+    for name in list(runner.outputs):
+        runner.release(name)
+
+def test_load_sources_reads_the_repository_workbooks(runner):
+    report = runner.run(['load_sources'])
+
+    # The empty sales.xlsx workbook isn't read, the fact_sales rows being generated from the supply chain.
+    assert report['load_sources']['status'] == 'ran'
+    assert sorted(runner.outputs['load_sources']) == ['material_df', 'part_information_df', 'supply_chain_df']
+    assert runner.get('load_sources', 'material_df').count() == 5
+    assert runner.get('load_sources', 'part_information_df').count() == 100
+    assert runner.get('load_sources', 'supply_chain_df').count() == 1
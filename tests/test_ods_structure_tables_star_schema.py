@@ -0,0 +1,108 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pyodbc')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'jobs'))
+from ods.ods_structure_tables_star_schema import DataWarehouseManager
+from ods.ods_schema_registry import ODS_LAYER, DWH_LAYER, get_table_indexes
+
+SUPPLY_CHAIN_FIELDS = ['materialId', 'materialPrice', 'trscMachineId', 'trscPartId', 'timeOfProduction', 'lastUpdate', 'trscUnitId']
+
+class FakeCursor:
+    """A stand-in of a pyodbc cursor recording the executed statements."""
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.fast_executemany = False
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+    def executemany(self, query, records):
+        self.statements.append((query, list(records)))
+
+    def setinputsizes(self, input_sizes):
+        pass
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+def connect_fake(ods_manager):
+    ods_manager.connection = FakeConnection()
+    ods_manager.cursor = ods_manager.connection.cursor()
+    ods_manager.insert_cursor = ods_manager.connection.cursor()
+    return ods_manager
+
+@pytest.fixture
+def ods_manager(monkeypatch):
+    # The layer comes from the name of the manager database, whatever the DB_NAME variable.
+    monkeypatch.delenv('DB_NAME', raising=False)
+    return connect_fake(DataWarehouseManager('localhost', 'ODS_PRODUCTION', 'user', 'password'))
+
+def test_supply_chain_upsert_merges_on_unit_and_material(ods_manager):
+    records = [(1, 2.5, 3, 4, '2024-01-01', '2024-01-01 08:00:00', 'dbde6a6b-26a7-43ed-a2d0-bc0ec97fdc50')]
+    ods_manager.generate_and_execute_massive_upsert('fact_supply_chain', SUPPLY_CHAIN_FIELDS, records)
+
+    (create_sql, _), (insert_sql, inserted), (merge_sql, _) = ods_manager.connection.statements
+    staging_table = ods_manager.staging_tables[('fact_supply_chain', tuple(SUPPLY_CHAIN_FIELDS))]
+    assert f"CREATE TABLE {staging_table} (" in create_sql
+    assert "trscUnitId VARCHAR(36)" in create_sql
+    assert "trscMachineId INT," in create_sql
+    assert insert_sql == f"INSERT INTO {staging_table} ({', '.join(SUPPLY_CHAIN_FIELDS)}) VALUES ({', '.join('?' * len(SUPPLY_CHAIN_FIELDS))})"
+    assert inserted == records
+
+    assert "PARTITION BY trscUnitId, materialId ORDER BY lastUpdate DESC, rowSeq DESC" in merge_sql
+    assert "MERGE INTO fact_supply_chain WITH (HOLDLOCK) AS target" in merge_sql
+    assert "ON target.trscUnitId = source.trscUnitId AND target.materialId = source.materialId\n" in merge_sql
+    assert "WHEN MATCHED AND (target.lastUpdate IS NULL OR source.lastUpdate >= target.lastUpdate) THEN\n" in merge_sql
+    assert "UPDATE SET materialPrice = source.materialPrice, trscMachineId = source.trscMachineId, trscPartId = source.trscPartId, " \
+           "timeOfProduction = source.timeOfProduction, lastUpdate = source.lastUpdate\n" in merge_sql
+    assert f"INSERT ({', '.join(SUPPLY_CHAIN_FIELDS)}) VALUES ({', '.join(f'source.{field}' for field in SUPPLY_CHAIN_FIELDS)});" in merge_sql
+    assert merge_sql.endswith(f"TRUNCATE TABLE {staging_table};")
+    assert ods_manager.connection.commits == 1
+
+def test_dimension_upsert_merges_on_trsc_columns(ods_manager):
+    ods_manager.generate_and_execute_massive_upsert('dim_machine', ['trscMachineId', 'machineId', 'lastUpdate'], [(5, 1, None)])
+    ods_manager.generate_and_execute_massive_upsert('dim_machine', ['trscMachineId', 'machineId', 'lastUpdate'], [(6, 2, None)])
+
+    statements = [query for query, _ in ods_manager.connection.statements]
+    # The staging table is created once per connection, and reused by the following upserts.
+    assert len([query for query in statements if 'CREATE TABLE' in query]) == 1
+    merge_sql = statements[2]
+    assert "ON target.trscMachineId = source.trscMachineId\n" in merge_sql
+    assert "UPDATE SET machineId = source.machineId, lastUpdate = source.lastUpdate\n" in merge_sql
+
+def test_unresolved_layer_raises_rather_than_inserting(monkeypatch):
+    monkeypatch.delenv('DB_NAME', raising=False)
+    with pytest.raises(ValueError, match="Pass the layer explicitly"):
+        DataWarehouseManager('localhost', 'PRODUCTION', 'user', 'password')
+
+def test_explicit_layer_merges_on_trsc_columns(monkeypatch):
+    monkeypatch.delenv('DB_NAME', raising=False)
+    ods_manager = connect_fake(DataWarehouseManager('localhost', 'PRODUCTION', 'user', 'password', ODS_LAYER))
+    ods_manager.generate_and_execute_massive_upsert('dim_machine', ['trscMachineId', 'machineId', 'lastUpdate'], [(5, 1, None)])
+
+    assert "MERGE INTO dim_machine" in ods_manager.connection.statements[-1][0]
+
+def test_supply_chain_price_index_covers_the_consumer_price_lookup(ods_manager):
+    price_index = [index for index in get_table_indexes('fact_supply_chain', ODS_LAYER) if index.columns[0] == 'partId'][0]
+
+    assert ods_manager.prepare_index_sql('fact_supply_chain', price_index.columns, price_index.include).endswith(
+        "CREATE NONCLUSTERED INDEX IX_fact_supply_chain_partId_materialPriceDate ON fact_supply_chain (partId, materialPriceDate) "
+        "INCLUDE (materialId, materialPrice, partDefaultPrice)")
+    assert price_index not in get_table_indexes('fact_supply_chain', DWH_LAYER)
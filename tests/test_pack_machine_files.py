@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'infrastructure', 'files-storage'))
+import pack_machine_files
+
+def write_machine_file(directory, file_name, day_timestamp):
+    file_path = directory / file_name
+    file_path.write_bytes(b'machineId,partId\n1,5\n')
+    os.utime(file_path, (day_timestamp, day_timestamp))
+
+def test_pack_machine_files_returns_the_days_that_failed(tmp_path, monkeypatch):
+    machines_path = tmp_path / 'machines'
+    machines_path.mkdir()
+    write_machine_file(machines_path, 'machine_1.csv', 1705230000)  # 2024-01-14
+    write_machine_file(machines_path, 'machine_2.csv', 1705402800)  # 2024-01-16
+    failing_day = pack_machine_files.group_files_by_day(str(machines_path)).popitem()[0]
+
+    pack_day = pack_machine_files.pack_day
+    def failing_pack_day(input_path, archives_path, day, file_names):
+        if day == failing_day:
+            raise OSError("No space left on device.")
+        return pack_day(input_path, archives_path, day, file_names)
+    monkeypatch.setattr(pack_machine_files, 'pack_day', failing_pack_day)
+
+    packed_days, failed_days = pack_machine_files.pack_machine_files(str(machines_path), str(tmp_path / 'archives'))
+
+    assert failed_days == [failing_day]
+    assert len(packed_days) == 1 and failing_day not in packed_days
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path / 'archives'))
@@ -0,0 +1,97 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('azure.storage.blob')
+pytest.importorskip('dotenv')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'infrastructure', 'files-storage'))
+from azure.core.exceptions import ResourceNotFoundError
+from store_files_into_blob_container_azure import BlobDirectoryUploader, hash_file_md5, UPLOADED_FILE_EXTENSIONS, DERIVED_DIRECTORY_NAMES
+
+class FakeBlobClient:
+    """A stand-in of a BlobClient over the blobs of a FakeBlobServiceClient."""
+
+    def __init__(self, service, blob_name):
+        self.service = service
+        self.blob_name = blob_name
+
+    def get_blob_properties(self):
+        if self.blob_name not in self.service.blobs:
+            raise ResourceNotFoundError(f"The blob {self.blob_name} doesn't exist.")
+        return SimpleNamespace(content_settings=SimpleNamespace(content_md5=self.service.blobs[self.blob_name]['md5']))
+
+    def create_snapshot(self):
+        snapshots = self.service.snapshots.setdefault(self.blob_name, [])
+        snapshots.append(self.service.blobs[self.blob_name]['data'])
+        return {'snapshot': f"snapshot-{len(snapshots)}"}
+
+    def upload_blob(self, data, overwrite=False, content_settings=None, **kwargs):
+        if self.blob_name in self.service.blobs and not overwrite:
+            raise AssertionError(f"The blob {self.blob_name} would be overwritten.")
+        self.service.blobs[self.blob_name] = {'data': data.read(), 'md5': content_settings.content_md5}
+        self.service.uploads.append(self.blob_name)
+
+class FakeBlobServiceClient:
+    """A stand-in of a BlobServiceClient keeping the blobs of a single container in memory."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.snapshots = {}
+        self.uploads = []
+
+    def create_container(self, container_name):
+        pass
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self, blob)
+
+@pytest.fixture
+def data_directory(tmp_path):
+    directory = tmp_path / 'data'
+    directory.mkdir()
+    (directory / 'sales.csv').write_bytes(b'partId,cash\n1,100.0\n')
+    (directory / 'material.csv').write_bytes(b'materialId,name\n1,steel\n')
+    return directory
+
+def get_uploader(service, data_directory):
+    return BlobDirectoryUploader(service, 'files', str(data_directory / '_blob_upload_manifest.json'), max_workers=2)
+
+def test_upload_directory_skips_unchanged_files(data_directory):
+    service = FakeBlobServiceClient()
+    assert get_uploader(service, data_directory).upload_directory(str(data_directory)) == {'uploaded': 2, 'skipped': 0, 'failed': 0}
+
+    assert get_uploader(service, data_directory).upload_directory(str(data_directory)) == {'uploaded': 0, 'skipped': 2, 'failed': 0}
+    assert sorted(service.uploads) == ['material.csv', 'sales.csv']
+    assert service.snapshots == {}
+
+def test_upload_directory_snapshots_changed_files(data_directory):
+    service = FakeBlobServiceClient()
+    get_uploader(service, data_directory).upload_directory(str(data_directory))
+
+    (data_directory / 'sales.csv').write_bytes(b'partId,cash\n1,100.0\n2,50.0\n')
+    assert get_uploader(service, data_directory).upload_directory(str(data_directory)) == {'uploaded': 1, 'skipped': 1, 'failed': 0}
+
+    assert service.blobs['sales.csv']['data'] == b'partId,cash\n1,100.0\n2,50.0\n'
+    assert bytes(service.blobs['sales.csv']['md5']) == hash_file_md5(str(data_directory / 'sales.csv'))
+    assert service.snapshots == {'sales.csv': [b'partId,cash\n1,100.0\n']}
+
+def test_upload_directory_only_uploads_the_source_files_and_the_archives(data_directory):
+    for name in ('excel_parquet', 'dim_time_parquet'):
+        (data_directory / name).mkdir()
+        (data_directory / name / '_SUCCESS').write_bytes(b'')
+        (data_directory / name / 'part-00000.snappy.parquet').write_bytes(b'PAR1')
+    (data_directory / 'machines').mkdir()
+    (data_directory / 'machines' / 'machine_1.csv').write_bytes(b'machineId\n1\n')
+    (data_directory / 'archives').mkdir()
+    (data_directory / 'archives' / 'machines_20240114.tar.xz').write_bytes(b'xz')
+    (data_directory / 'archives' / 'machines_20240114.json').write_bytes(b'{}')
+
+    service = FakeBlobServiceClient()
+    counts = get_uploader(service, data_directory).upload_directory(
+        str(data_directory), [str(data_directory / name) for name in DERIVED_DIRECTORY_NAMES], UPLOADED_FILE_EXTENSIONS)
+
+    assert counts == {'uploaded': 4, 'skipped': 0, 'failed': 0}
+    assert sorted(service.uploads) == ['machines_20240114.json', 'machines_20240114.tar.xz', 'material.csv', 'sales.csv']